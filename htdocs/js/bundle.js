@@ -26,10 +26,6 @@ function order_button_click(node)
         form.get(0).submit();
     } else {
 
-        /* store the first order value */
-        start_order = row_to_patch_id(rows[0]);
-        $("input[name='order_start']").attr("value", start_order);
-
         /* update buttons */
         node.setAttribute("value", "Save order");
         $("#reorder\\-cancel").css("display", "inline");
@@ -25,7 +25,12 @@ GRANT SELECT, UPDATE, INSERT, DELETE ON
 	patchwork_emailoptout,
 	patchwork_patchchangenotification,
 	patchwork_tag,
-	patchwork_patchtag
+	patchwork_patchtag,
+	patchwork_personsearchtoken,
+	patchwork_patchfile,
+	patchwork_job,
+	patchwork_apitoken,
+	patchwork_changesequence
 TO "www-data";
 GRANT SELECT, UPDATE ON
 	auth_group_id_seq,
@@ -48,17 +53,26 @@ GRANT SELECT, UPDATE ON
 	patchwork_userprofile_id_seq,
 	patchwork_userprofile_maintainer_projects_id_seq,
 	patchwork_tag_id_seq,
-	patchwork_patchtag_id_seq
+	patchwork_patchtag_id_seq,
+	patchwork_personsearchtoken_id_seq,
+	patchwork_patchfile_id_seq,
+	patchwork_job_id_seq,
+	patchwork_apitoken_id_seq,
+	patchwork_changesequence_id_seq
 TO "www-data";
 
 -- allow the mail user (in this case, 'nobody') to add patches
 GRANT INSERT, SELECT ON
 	patchwork_patch,
 	patchwork_comment,
-	patchwork_person
+	patchwork_person,
+	patchwork_job
 TO "nobody";
 GRANT INSERT, SELECT, UPDATE, DELETE ON
-	patchwork_patchtag
+	patchwork_patchtag,
+	patchwork_personsearchtoken,
+	patchwork_patchfile,
+	patchwork_changesequence
 TO "nobody";
 GRANT SELECT ON
 	patchwork_project,
@@ -69,7 +83,11 @@ GRANT UPDATE, SELECT ON
 	patchwork_patch_id_seq,
 	patchwork_person_id_seq,
 	patchwork_comment_id_seq,
-	patchwork_patchtag_id_seq
+	patchwork_patchtag_id_seq,
+	patchwork_personsearchtoken_id_seq,
+	patchwork_patchfile_id_seq,
+	patchwork_job_id_seq,
+	patchwork_changesequence_id_seq
 TO "nobody";
 
 COMMIT;
@@ -20,7 +20,8 @@
 from django.contrib import admin
 
 from patchwork.models import (
-    Project, Person, UserProfile, State, Patch, Comment, Bundle, Tag, Check)
+    Project, Person, UserProfile, State, Patch, Comment, Bundle, Tag, Check,
+    Job, APIToken)
 
 
 class ProjectAdmin(admin.ModelAdmin):
@@ -93,3 +94,22 @@ admin.site.register(Bundle, BundleAdmin)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name',)
 admin.site.register(Tag, TagAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'args', 'created', 'run_after', 'attempts',
+                    'failed')
+    list_filter = ('name', 'failed')
+admin.site.register(Job, JobAdmin)
+
+
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'created')
+    search_fields = ('user__username',)
+    readonly_fields = ('key',)
+
+    # tokens are only useful to the user who creates them, as only the
+    # token's hash is stored
+    def has_add_permission(self, request):
+        return False
+admin.site.register(APIToken, APITokenAdmin)
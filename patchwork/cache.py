@@ -0,0 +1,548 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Caching of frequently recomputed values.
+
+Values are stored using the Django cache framework, in the cache
+configured by the CACHES setting. This should be shared between all of
+patchwork's processes (web server workers, parsemail, ...) so that
+changes made by one process invalidate the entries used by the others.
+
+Rather than tracking every cached key, related entries embed a
+"version" in their keys. Bumping the version makes all older entries
+unreachable; they are then evicted by the cache backend in due course.
+
+A process-local cache (LocMemCache) only sees the invalidations made by
+its own process, so entries stored in one are kept for no longer than
+LOCAL_CACHE_TIMEOUT; see _timeout.
+"""
+
+import hashlib
+import hmac
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.encoding import force_bytes
+
+
+def _key(*parts):
+    return 'patchwork:' + ':'.join([str(part) for part in parts])
+
+
+def _timeout(timeout, backend='default'):
+    """Return the timeout to store an entry in the named cache with,
+    given the timeout it would have in a cache shared between processes.
+    """
+    if not isinstance(caches[backend], LocMemCache):
+        return timeout
+    if timeout is None:
+        return settings.LOCAL_CACHE_TIMEOUT
+    return min(timeout, settings.LOCAL_CACHE_TIMEOUT)
+
+
+def _cacheable(value, max_size):
+    # memcached silently drops items larger than its limit (1MB by
+    # default), so large values are better not stored at all
+    return max_size is None or len(force_bytes(value)) <= max_size
+
+
+def _initial_version():
+    # Versions start from the current time, rather than zero, so that a
+    # version key which has been evicted from the cache can never be
+    # recreated with a value that has already been used.
+    return int(time.time() * 1000)
+
+
+def get_version(*parts):
+    key = _key('version', *parts)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(*parts):
+    key = _key('version', *parts)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), None)
+
+
+#
+# Patch counts
+#
+
+def _project_count_key(project_id, archived):
+    return _key('project-count', project_id, int(bool(archived)))
+
+
+def project_patch_count(project, archived):
+    """Return the number of archived or non-archived patches in project.
+
+    These counts are kept up to date incrementally as patches are
+    created, archived and deleted (see patch_archived_changed), so they
+    are only counted from the database on a cache miss. They expire
+    after PATCH_COUNT_CACHE_TIMEOUT, which bounds any drift from
+    changes made outside of the ORM.
+    """
+    from patchwork.models import Patch
+
+    key = _project_count_key(project.id, archived)
+    count = cache.get(key)
+    if count is None:
+        count = Patch.objects.filter(project=project,
+                                     archived=archived).count()
+        cache.add(key, count, _timeout(settings.PATCH_COUNT_CACHE_TIMEOUT))
+    return count
+
+
+def patch_archived_changed(project_id, old_archived, new_archived):
+    """Update the cached project patch counts for a single patch.
+
+    old_archived and new_archived are the patch's archived state before
+    and after the change, or None if the patch did not exist before
+    (creation) or does not exist after it (deletion).
+    """
+    if old_archived == new_archived:
+        return
+
+    for (archived, delta) in [(old_archived, -1), (new_archived, 1)]:
+        if archived is None:
+            continue
+        try:
+            cache.incr(_project_count_key(project_id, archived), delta)
+        except ValueError:
+            # not cached; this will be counted on the next lookup
+            pass
+
+
+def invalidate_patch_counts(project_id):
+    """Invalidate all cached list counts for a project."""
+    bump_version('project', project_id)
+
+
+def invalidate_project(project_id):
+    """Invalidate all cached patch counts for a project."""
+    cache.delete_many([_project_count_key(project_id, archived)
+                       for archived in [False, True]])
+    invalidate_patch_counts(project_id)
+
+
+def patch_list_count(project, queryset, approximate=False):
+    """Return the number of patches in a project's patch list queryset.
+
+    Counts are cached by the SQL of the (unordered) query, so each
+    distinct combination of filters has its own entry. Entries are
+    invalidated whenever any patch in the project changes.
+
+    If approximate is True, the entry is not invalidated by patch
+    changes and is only refreshed once PATCH_COUNT_CACHE_TIMEOUT has
+    elapsed.
+    """
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        # the filters can never match (e.g. an empty IN clause)
+        return 0
+
+    digest = hashlib.sha1(
+        (u'%s %r' % (sql, params)).encode('utf-8')).hexdigest()
+
+    if approximate:
+        key = _key('list-count', project.id, 'approx', digest)
+    else:
+        key = _key('list-count', project.id,
+                   get_version('project', project.id), digest)
+
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, _timeout(settings.PATCH_COUNT_CACHE_TIMEOUT))
+    return count
+
+
+#
+# Todo counts
+#
+
+def action_required_states():
+    """Return the set of IDs of states which require action."""
+    from patchwork.models import State
+
+    key = _key('action-required-states', get_version('states'))
+    states = cache.get(key)
+    if states is None:
+        states = set(State.objects.filter(action_required=True)
+                     .values_list('id', flat=True))
+        cache.set(key, states, _timeout(None))
+    return states
+
+
+def invalidate_states():
+    """Invalidate all cached values that depend on patch states."""
+    bump_version('states')
+
+
+def _todo_count_key(user_id, project_id=None, states_version=None):
+    if project_id is None:
+        project_id = 'all'
+    if states_version is None:
+        states_version = get_version('states')
+    return _key('todo-count', states_version, user_id, project_id)
+
+
+def todo_patch_count(profile, project=None):
+    """Return the number of patches on a user's todo list.
+
+    If project is None, the count covers all projects. Counts are
+    updated incrementally as patches are delegated, change state or
+    are archived (see todo_patch_changed).
+    """
+    key = _todo_count_key(profile.user_id, project and project.id)
+    count = cache.get(key)
+    if count is None:
+        count = profile.todo_patches(project=project).count()
+        cache.add(key, count, _timeout(settings.PATCH_COUNT_CACHE_TIMEOUT))
+    return count
+
+
+def todo_patch_counts(profile, projects):
+    """Return a dict of the number of patches on a user's todo list in
+    each of a list of projects, keyed by project ID.
+
+    This shares its cache entries with todo_patch_count, and any counts
+    that aren't cached are counted together in a single grouped query.
+    """
+    states_version = get_version('states')
+    keys = dict([(project.id, _todo_count_key(profile.user_id, project.id,
+                                              states_version))
+                 for project in projects])
+    cached = cache.get_many(keys.values())
+    counts = dict([(project_id, cached[key])
+                   for (project_id, key) in keys.items() if key in cached])
+
+    missing = [project_id for project_id in keys if project_id not in counts]
+    if missing:
+        totals = dict(profile.todo_patches().order_by()
+                      .values_list('project').annotate(Count('id')))
+        for project_id in missing:
+            counts[project_id] = totals.get(project_id, 0)
+            cache.add(keys[project_id], counts[project_id],
+                      _timeout(settings.PATCH_COUNT_CACHE_TIMEOUT))
+
+    return counts
+
+
+def _is_todo(fields):
+    if fields is None:
+        return False
+    return fields['delegate_id'] is not None and not fields['archived'] and \
+        fields['state_id'] in action_required_states()
+
+
+def todo_patch_changed(project_id, old_fields, new_fields):
+    """Update the cached todo counts for a single patch.
+
+    old_fields and new_fields are dicts of the patch's delegate_id,
+    state_id and archived values before and after the change, or None
+    if the patch did not exist before or after the change.
+    """
+    old_todo = _is_todo(old_fields)
+    new_todo = _is_todo(new_fields)
+
+    if old_todo and new_todo and \
+            old_fields['delegate_id'] == new_fields['delegate_id']:
+        return
+
+    changes = []
+    if old_todo:
+        changes.append((old_fields['delegate_id'], -1))
+    if new_todo:
+        changes.append((new_fields['delegate_id'], 1))
+
+    for (user_id, delta) in changes:
+        for key in [_todo_count_key(user_id, project_id),
+                    _todo_count_key(user_id)]:
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                pass
+
+
+#
+# Lookups of mostly-static objects, as used on every page
+#
+
+def _cached_list(key, timeout, fn):
+    objects = cache.get(key)
+    if objects is None:
+        objects = list(fn())
+        cache.set(key, objects, _timeout(timeout))
+    return objects
+
+
+def get_projects():
+    """Return a list of all projects."""
+    from patchwork.models import Project
+
+    return _cached_list(_key('projects', get_version('projects')), None,
+                        Project.objects.all)
+
+
+def invalidate_projects():
+    bump_version('projects')
+
+
+def get_states():
+    """Return a list of all patch states."""
+    from patchwork.models import State
+
+    return _cached_list(_key('states', get_version('states')), None,
+                        State.objects.all)
+
+
+def get_delegates(project):
+    """Return a list of the users that patches in a project may be
+    delegated to; that is, the project's maintainers."""
+    from django.contrib.auth.models import User
+
+    return _cached_list(
+        _key('delegates', get_version('delegates'), project.id), None,
+        lambda: User.objects.filter(profile__maintainer_projects=project)
+        .select_related('profile'))
+
+
+def invalidate_delegates():
+    bump_version('delegates')
+
+
+def get_bundles(user):
+    """Return a list of the bundles owned by a user."""
+    from patchwork.models import Bundle
+
+    return _cached_list(
+        _key('bundles', get_version('bundles', user.id), user.id), None,
+        lambda: Bundle.objects.filter(owner=user))
+
+
+def invalidate_bundles(user_id):
+    bump_version('bundles', user_id)
+
+
+#
+# Submitter autocompletion
+#
+
+def get_person_completions(search, limit):
+    """Return a list of up to limit people matching a (normalised)
+    search prefix.
+
+    Responses are cached for SUBMITTER_COMPLETE_CACHE_TIMEOUT, so
+    repeated lookups of popular prefixes don't need a query. Entries
+    are invalidated whenever a person is added or changed.
+    """
+    from patchwork.models import Person
+
+    digest = hashlib.sha1(search.encode('utf-8')).hexdigest()
+    return _cached_list(
+        _key('person-completions', get_version('people'), limit, digest),
+        settings.SUBMITTER_COMPLETE_CACHE_TIMEOUT,
+        lambda: Person.objects.complete(search, limit))
+
+
+def invalidate_people():
+    bump_version('people')
+
+
+#
+# Syntax-highlighted patch and comment content
+#
+
+# Bump this when the output of the syntax highlighter changes
+HIGHLIGHT_VERSION = 1
+
+
+def get_highlighted(kind, obj_id, content, render):
+    """Return the highlighted HTML for a patch or comment's content,
+    rendering it with render(content) on a cache miss.
+
+    Entries are keyed by the object's ID and a hash of its content, so
+    edited content is rendered afresh rather than needing to be
+    explicitly invalidated. HTML larger than HIGHLIGHT_CACHE_MAX_SIZE
+    isn't cached.
+    """
+    if obj_id is None or not content:
+        return render(content)
+
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    key = _key('highlighted', HIGHLIGHT_VERSION, kind, obj_id, digest)
+
+    html = cache.get(key)
+    if html is None:
+        html = render(content)
+        if _cacheable(html, settings.HIGHLIGHT_CACHE_MAX_SIZE):
+            cache.set(key, html, settings.HIGHLIGHT_CACHE_TIMEOUT)
+    return html
+
+
+#
+# Patch mboxes
+#
+
+def _mbox_cache():
+    return caches[settings.MBOX_CACHE]
+
+
+def _mbox_timeout():
+    # the versions are kept in the default cache, so entries are only
+    # invalidated across processes if both caches are shared
+    return _timeout(_timeout(settings.MBOX_CACHE_TIMEOUT),
+                    settings.MBOX_CACHE)
+
+
+def _mbox_versions(patches):
+    # each patch's mbox depends on the patch (and its comments), and on
+    # its submitter, whose name is in the From header
+    names = set([('mbox', patch.id) for patch in patches] +
+                [('mbox-submitter', patch.submitter_id) for patch in patches])
+    keys = dict([(name, _key('version', *name)) for name in names])
+    versions = cache.get_many(keys.values())
+
+    for (name, key) in keys.items():
+        if key not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[key] = cache.get(key)
+
+    return dict([(name, versions[key]) for (name, key) in keys.items()])
+
+
+def _incr_stat(mbox_cache, name, delta):
+    if not delta:
+        return
+
+    key = _key('mbox-stats', name)
+    try:
+        mbox_cache.incr(key, delta)
+    except ValueError:
+        if not mbox_cache.add(key, delta, None):
+            mbox_cache.incr(key, delta)
+
+
+def get_patch_mboxes(patches, render):
+    """Return a list of the mbox text of each of a list of patches.
+
+    Text is cached in the cache named by the MBOX_CACHE setting, keyed
+    by the patch ID and versions which are bumped whenever the patch, its
+    comments or its submitter change (see invalidate_patch_mbox and
+    invalidate_submitter_mbox). Patches that aren't cached are rendered
+    with render(patches), which should return a list of their mbox text.
+    Entries are kept for MBOX_CACHE_TIMEOUT, or for no more than
+    LOCAL_CACHE_TIMEOUT if either cache is process-local. Text larger than
+    MBOX_CACHE_MAX_SIZE isn't cached.
+    """
+    mbox_cache = _mbox_cache()
+    versions = _mbox_versions(patches)
+    keys = [_key('mbox', patch.id, versions[('mbox', patch.id)],
+                 versions[('mbox-submitter', patch.submitter_id)])
+            for patch in patches]
+
+    mboxes = mbox_cache.get_many(keys)
+    missing = [(patch, key) for (patch, key) in zip(patches, keys)
+               if key not in mboxes]
+
+    if missing:
+        rendered = dict(zip([key for (_, key) in missing],
+                            render([patch for (patch, _) in missing])))
+        cacheable = dict([(key, text) for (key, text) in rendered.items()
+                          if _cacheable(text, settings.MBOX_CACHE_MAX_SIZE)])
+        mbox_cache.set_many(cacheable, _mbox_timeout())
+        mboxes.update(rendered)
+        _incr_stat(mbox_cache, 'skipped', len(rendered) - len(cacheable))
+
+    _incr_stat(mbox_cache, 'hits', len(patches) - len(missing))
+    _incr_stat(mbox_cache, 'misses', len(missing))
+
+    return [mboxes[key] for key in keys]
+
+
+def invalidate_patch_mbox(patch_id):
+    bump_version('mbox', patch_id)
+
+
+def invalidate_submitter_mbox(person_id):
+    bump_version('mbox-submitter', person_id)
+
+
+MBOX_STATS = ['hits', 'misses', 'skipped']
+
+
+def mbox_cache_stats():
+    """Return the number of hits and misses of the mbox cache, and the
+    number of mboxes too large to cache, as a (hits, misses, skipped)
+    tuple."""
+    mbox_cache = _mbox_cache()
+    return tuple([mbox_cache.get(_key('mbox-stats', name), 0)
+                  for name in MBOX_STATS])
+
+
+def reset_mbox_cache_stats():
+    _mbox_cache().delete_many([_key('mbox-stats', name)
+                               for name in MBOX_STATS])
+
+
+#
+# Verified credentials
+#
+
+def _credentials_key(username, password):
+    # Keys are an HMAC of the credentials, so that neither the password
+    # nor an unsalted hash of it is stored in the cache.
+    digest = hmac.new(force_bytes(settings.SECRET_KEY),
+                      force_bytes(username) + b':' + force_bytes(password),
+                      hashlib.sha256).hexdigest()
+    return _key('credentials', digest)
+
+
+def get_verified_credentials(username, password):
+    """Return the user ID and session auth hash stored by
+    set_verified_credentials for these credentials, or None.
+
+    Callers should check that the auth hash matches the user's current
+    one (see User.get_session_auth_hash), so that credentials stop
+    being accepted as soon as the user's password changes.
+    """
+    if not settings.XMLRPC_AUTH_CACHE_TIMEOUT:
+        return None
+    return cache.get(_credentials_key(username, password))
+
+
+def set_verified_credentials(username, password, user):
+    """Remember that username and password are valid credentials for
+    user, for XMLRPC_AUTH_CACHE_TIMEOUT seconds."""
+    if not settings.XMLRPC_AUTH_CACHE_TIMEOUT:
+        return
+    cache.set(_credentials_key(username, password),
+              (user.id, user.get_session_auth_hash()),
+              settings.XMLRPC_AUTH_CACHE_TIMEOUT)
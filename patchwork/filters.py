@@ -18,7 +18,10 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from patchwork.models import Person, State
+from patchwork.cache import action_required_states, get_delegates, \
+     get_states
+from patchwork.models import Person
+from patchwork.search import get_search_backend
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
 from django.contrib.auth.models import User
@@ -71,6 +74,12 @@ class Filter(object):
     def kwargs(self):
         return {}
 
+    def apply(self, queryset):
+        """Filter a queryset by the current condition of the filter.
+           Filters that can't be expressed as keyword arguments to
+           QuerySet.filter() should override this"""
+        return queryset.filter(**self.kwargs())
+
     def __str__(self):
         return '%s: %s' % (self.name, self.kwargs())
 
@@ -105,9 +114,7 @@ class SubmitterFilter(Filter):
             return
 
 
-        people = Person.objects.filter(name__icontains = str)
-
-        if not people:
+        if not Person.objects.filter(name__icontains = str).exists():
             return
 
         self.person_match = str
@@ -160,19 +167,22 @@ class StateFilter(Filter):
             return
 
         try:
-            self.state = State.objects.get(id=int(str))
-        except:
+            state_id = int(str)
+        except ValueError:
+            return
+
+        states = [s for s in get_states() if s.id == state_id]
+        if not states:
             return
 
+        self.state = states[0]
         self.applied = True
 
     def kwargs(self):
         if self.state is not None:
             return {'state': self.state}
         else:
-            return {'state__in': \
-                        State.objects.filter(action_required = True) \
-                            .values('pk').query}
+            return {'state__in': sorted(action_required_states())}
 
     def condition(self):
         if self.state:
@@ -200,7 +210,7 @@ class StateFilter(Filter):
         str += '<option %s value="">%s</option>' % \
                (selected, self.action_req_str)
 
-        for state in State.objects.all():
+        for state in get_states():
             selected = ''
             if self.state and self.state == state:
                 selected = ' selected="true"'
@@ -237,6 +247,17 @@ class SearchFilter(Filter):
     def kwargs(self):
         return {'name__icontains': self.search}
 
+    def apply(self, queryset):
+        return get_search_backend().filter(queryset, self.search)
+
+    def ranked(self):
+        """Whether the search backend can order results by relevance"""
+        return get_search_backend().ranked
+
+    def rank(self, queryset):
+        """Order a queryset by relevance to the search"""
+        return get_search_backend().rank(queryset, self.search)
+
     def condition(self):
         return self.search
 
@@ -354,8 +375,7 @@ class DelegateFilter(Filter):
         return self.no_delegate_str
 
     def _form(self):
-        delegates = User.objects.filter(profile__maintainer_projects =
-                self.filters.project)
+        delegates = get_delegates(self.filters.project)
 
         str = '<select name="delegate" class="form-control">'
 
@@ -425,10 +445,17 @@ class Filters:
         return kwargs
 
     def apply(self, queryset):
-        kwargs = self.filter_conditions()
-        if not kwargs:
-            return queryset
-        return queryset.filter(**kwargs)
+        for f in self._filters:
+            if f.applied:
+                queryset = f.apply(queryset)
+        return queryset
+
+    def search_filter(self):
+        """Return the applied search filter, if any"""
+        for f in self.applied_filters():
+            if isinstance(f, SearchFilter):
+                return f
+        return None
 
     def params(self):
         return [ (f.param, f.key()) for f in self._filters \
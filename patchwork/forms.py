@@ -206,14 +206,15 @@ class MultiplePatchForm(forms.Form):
         self.fields['delegate'] = OptionalDelegateField(project = project,
                 required = False)
 
-    def save(self, instance, commit = True):
-        opts = instance.__class__._meta
+    def changes(self):
+        """Return a dict of the patch fields to change, and their new
+        values"""
         if self.errors:
-            raise ValueError("The %s could not be changed because the data "
-                    "didn't validate." % opts.object_name)
+            raise ValueError("The patches could not be changed because the "
+                    "data didn't validate.")
         data = self.cleaned_data
-        # Update the instance
-        for f in opts.fields:
+        changes = {}
+        for f in Patch._meta.fields:
             if not f.name in data:
                 continue
 
@@ -224,7 +225,14 @@ class MultiplePatchForm(forms.Form):
             if field.is_no_change(data[f.name]):
                 continue
 
-            setattr(instance, f.name, data[f.name])
+            changes[f.name] = data[f.name]
+
+        return changes
+
+    def save(self, instance, commit = True):
+        # Update the instance
+        for (name, value) in self.changes().items():
+            setattr(instance, name, value)
 
         if commit:
             instance.save()
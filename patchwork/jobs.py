@@ -0,0 +1,156 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""A simple job queue, stored in the patchwork database.
+
+Expensive work that needn't happen within a request (or a mail being
+parsed) can be deferred with enqueue(). Jobs are stored as Job objects,
+and run by the runjobs management command.
+
+Workers claim a job by setting its locked_until time, which is also its
+visibility timeout: if a worker dies while running a job, it will be
+picked up by another worker once JOB_VISIBILITY_TIMEOUT has passed.
+Failed jobs are retried after JOB_RETRY_DELAY seconds, doubling for
+each attempt, until they have been tried JOB_MAX_ATTEMPTS times.
+
+Unless JOB_QUEUE_ASYNC is set, enqueue() runs jobs immediately instead,
+so that no worker is needed.
+"""
+
+import datetime
+import json
+import traceback
+
+from django.conf import settings
+from django.db.models import F, Q
+
+_tasks = {}
+
+
+def task(name):
+    """Register a function as the task to run for jobs called name."""
+    def wrap(fn):
+        _tasks[name] = fn
+        return fn
+    return wrap
+
+
+def enqueue(name, *args, **kwargs):
+    """Queue a job to run the task called name, with (JSON-serialisable)
+    arguments args.
+
+    If unique is True, the job isn't queued if there's already an
+    identical job waiting to be run.
+    """
+    from patchwork.models import Job
+
+    if name not in _tasks:
+        raise ValueError('unknown task "%s"' % name)
+
+    if not settings.JOB_QUEUE_ASYNC:
+        _tasks[name](*args)
+        return
+
+    args = json.dumps(args)
+    if kwargs.get('unique') and Job.objects.filter(
+            name=name, args=args, failed=False,
+            locked_until__isnull=True).exists():
+        return
+
+    Job.objects.create(name=name, args=args)
+
+
+def _claim_job():
+    from patchwork.models import Job
+
+    now = datetime.datetime.now()
+    candidates = Job.objects.filter(failed=False, run_after__lte=now) \
+        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now)) \
+        .values_list('id', 'locked_until')[:10]
+
+    for (job_id, locked_until) in candidates:
+        # only one worker can move a job from its current lock time, so
+        # this claims the job without locking the table
+        claimed = Job.objects.filter(id=job_id, locked_until=locked_until) \
+            .update(attempts=F('attempts') + 1,
+                    locked_until=now + datetime.timedelta(
+                        seconds=settings.JOB_VISIBILITY_TIMEOUT))
+        if claimed:
+            return Job.objects.get(id=job_id)
+
+    return None
+
+
+def run_next_job():
+    """Claim and run the next job that is due, if any. Returns the job,
+    or None if there were no jobs to run."""
+    from patchwork.models import Job
+
+    job = _claim_job()
+    if job is None:
+        return None
+
+    # updates are made only while we still hold the job's lock
+    ours = Job.objects.filter(id=job.id, locked_until=job.locked_until)
+
+    if job.attempts > settings.JOB_MAX_ATTEMPTS:
+        # the worker running a previous attempt never finished
+        ours.update(failed=True, last_error='Timed out')
+        return job
+
+    try:
+        _tasks[job.name](*json.loads(job.args))
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            ours.update(failed=True, last_error=error)
+        else:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            ours.update(locked_until=None, last_error=error,
+                        run_after=datetime.datetime.now() +
+                        datetime.timedelta(seconds=delay))
+    else:
+        ours.delete()
+
+    return job
+
+
+#
+# Tasks
+#
+
+@task('refresh-tag-counts')
+def refresh_tag_counts(patch_id):
+    from patchwork.models import Patch
+
+    try:
+        patch = Patch.objects.get(id=patch_id)
+    except Patch.DoesNotExist:
+        return
+    patch.refresh_tag_counts()
+
+
+@task('send-notifications')
+def send_notifications():
+    from patchwork.utils import send_notifications
+
+    # failed recipients' notifications are kept, and retried on the next
+    # run, so there's no need to retry the job itself
+    send_notifications()
@@ -17,18 +17,36 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from patchwork.utils import send_notifications, do_expiry
+
+from patchwork.jobs import enqueue
+from patchwork.utils import send_notifications, do_expiry, compact_bundles
 
 
 class Command(BaseCommand):
-    help = ('Run periodic patchwork functions: send notifications and '
-            'expire unused users')
+    help = ('Run periodic patchwork functions: send notifications, '
+            'expire unused users and compact bundle ordering')
 
     def handle(self, *args, **kwargs):
-        errors = send_notifications()
+        if settings.JOB_QUEUE_ASYNC:
+            enqueue('send-notifications', unique=True)
+        else:
+            self.send_notifications(int(kwargs.get('verbosity', 1)))
+
+        do_expiry()
+        compact_bundles()
+
+    def send_notifications(self, verbosity):
+        stats = {}
+        errors = send_notifications(stats)
         for (recipient, error) in errors:
             self.stderr.write("Failed sending to %s: %s" %
                               (recipient.email, error))
 
-        do_expiry()
+        if verbosity > 1:
+            rate = stats['sent'] / stats['time'] if stats['time'] else 0
+            self.stdout.write('Sent %d notification emails (%d notifications) '
+                              'in %.2fs, %.1f emails/s' %
+                              (stats['sent'], stats['notifications'],
+                               stats['time'], rate))
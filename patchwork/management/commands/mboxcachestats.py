@@ -0,0 +1,43 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from patchwork.cache import mbox_cache_stats, reset_mbox_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the hit rate of the patch mbox cache'
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', dest='reset',
+                    default=False, help='Reset the statistics'),
+    )
+
+    def handle(self, *args, **options):
+        (hits, misses, skipped) = mbox_cache_stats()
+        total = hits + misses
+        rate = 100.0 * hits / total if total else 0
+
+        self.stdout.write('hits: %d\nmisses: %d\nhit rate: %.1f%%\n'
+                          'too large to cache: %d' %
+                          (hits, misses, rate, skipped))
+
+        if options['reset']:
+            reset_mbox_cache_stats()
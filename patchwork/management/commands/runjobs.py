@@ -0,0 +1,92 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2015 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from optparse import make_option
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from patchwork.jobs import run_next_job
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(stop, once=False, poll_interval=5):
+    """Run jobs until stop is set or, if once is True, until there are no
+    jobs left to run."""
+    try:
+        while not stop.is_set():
+            try:
+                job = run_next_job()
+            except Exception:
+                # e.g. a dropped database connection or a deadlock. Failures
+                # of the jobs themselves are recorded by run_next_job, so
+                # reconnect and carry on
+                logger.exception('Error running jobs')
+                connection.close()
+                stop.wait(poll_interval)
+                continue
+
+            if job is None:
+                if once:
+                    break
+                stop.wait(poll_interval)
+    finally:
+        # each thread has its own database connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Run deferred jobs from the job queue'
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', dest='once',
+                    default=False,
+                    help='Exit once there are no jobs left to run'),
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=settings.JOB_WORKER_CONCURRENCY,
+                    help='Number of jobs to run at a time'),
+        make_option('--poll-interval', type='float', dest='poll_interval',
+                    default=5, help='Seconds to wait between checks for '
+                    'new jobs'),
+    )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+
+        def worker():
+            run_worker(stop, options['once'], options['poll_interval'])
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(max(options['concurrency'], 1))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while [thread for thread in threads if thread.is_alive()]:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            # let running jobs finish
+            stop.set()
+            for thread in threads:
+                thread.join()
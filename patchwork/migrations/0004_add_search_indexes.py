@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Full-text indexes for the search backends in patchwork.search. These
+# are database-specific, so aren't created for other databases; searches
+# will use the substring backend there.
+
+INDEXES = [
+    ('patchwork_patch_name_fts', 'patchwork_patch', 'name'),
+    ('patchwork_comment_content_fts', 'patchwork_comment', 'content'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    for (name, table, column) in INDEXES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                "CREATE INDEX %s ON %s USING gin "
+                "(to_tsvector('simple', %s))" % (name, table, column))
+        elif vendor == 'mysql':
+            schema_editor.execute(
+                'CREATE FULLTEXT INDEX %s ON %s (%s)' % (name, table, column))
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    for (name, table, column) in INDEXES:
+        if vendor == 'postgresql':
+            schema_editor.execute('DROP INDEX %s' % name)
+        elif vendor == 'mysql':
+            schema_editor.execute('DROP INDEX %s ON %s' % (name, table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0003_add_check_model'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
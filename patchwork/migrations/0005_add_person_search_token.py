@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+# This duplicates Person.search_tokens(), as historical models don't have
+# the methods of the current ones.
+
+word_re = re.compile(r'\w+', re.U)
+
+
+def normalise(search):
+    return u' '.join(search.lower().split())[:255]
+
+
+def search_tokens(person):
+    email = normalise(person.email)
+    tokens = set([email, email.split('@')[0]])
+    if person.name:
+        name = normalise(person.name)
+        tokens.add(name)
+        tokens.update(word_re.findall(name))
+    tokens.discard(u'')
+    return tokens
+
+
+def create_person_search_tokens(apps, schema_editor):
+    Person = apps.get_model('patchwork', 'Person')
+    PersonSearchToken = apps.get_model('patchwork', 'PersonSearchToken')
+
+    tokens = []
+    for person in Person.objects.all().iterator():
+        tokens.extend([PersonSearchToken(person_id=person.id, token=token)
+                       for token in search_tokens(person)])
+        if len(tokens) >= 1000:
+            PersonSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    PersonSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0004_add_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonSearchToken',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('token', models.CharField(max_length=255, db_index=True)),
+                ('person', models.ForeignKey(to='patchwork.Person')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='personsearchtoken',
+            unique_together=set([('person', 'token')]),
+        ),
+        migrations.RunPython(create_person_search_tokens,
+                             migrations.RunPython.noop),
+    ]
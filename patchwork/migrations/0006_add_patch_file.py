@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from patchwork.parser import split_patch
+
+
+def create_patch_files(apps, schema_editor):
+    Patch = apps.get_model('patchwork', 'Patch')
+    PatchFile = apps.get_model('patchwork', 'PatchFile')
+
+    patches = Patch.objects.exclude(content=None).exclude(content='') \
+        .only('id', 'content')
+
+    files = []
+    for patch in patches.iterator():
+        files.extend([PatchFile(patch_id=patch.id, filename=filename[:255],
+                                start_offset=start, end_offset=end,
+                                additions=additions, deletions=deletions)
+                      for (filename, start, end, additions, deletions)
+                      in split_patch(patch.content)])
+        if len(files) >= 1000:
+            PatchFile.objects.bulk_create(files)
+            files = []
+    PatchFile.objects.bulk_create(files)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0005_add_person_search_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatchFile',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('start_offset', models.PositiveIntegerField()),
+                ('end_offset', models.PositiveIntegerField()),
+                ('additions', models.PositiveIntegerField(default=0)),
+                ('deletions', models.PositiveIntegerField(default=0)),
+                ('patch', models.ForeignKey(to='patchwork.Patch')),
+            ],
+            options={
+                'ordering': ['start_offset'],
+            },
+        ),
+        migrations.RunPython(create_patch_files, migrations.RunPython.noop),
+    ]
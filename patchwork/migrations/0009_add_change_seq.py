@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+# Existing patches and checks are numbered in order of ID, patches first,
+# and the counter starts after the last of them.
+
+
+def number_changes(apps, schema_editor):
+    Patch = apps.get_model('patchwork', 'Patch')
+    Check = apps.get_model('patchwork', 'Check')
+    ChangeSequence = apps.get_model('patchwork', 'ChangeSequence')
+
+    max_patch_id = Patch.objects.aggregate(Max('id'))['id__max'] or 0
+    max_check_id = Check.objects.aggregate(Max('id'))['id__max'] or 0
+
+    Patch.objects.update(change_seq=F('id'))
+    Check.objects.update(change_seq=F('id') + max_patch_id)
+    ChangeSequence.objects.create(id=1, value=max_patch_id + max_check_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0008_add_api_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='check',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='patch',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, db_index=True),
+        ),
+        migrations.RunPython(number_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0009_add_change_seq'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='patch',
+            index_together=set([('hash', 'project')]),
+        ),
+    ]
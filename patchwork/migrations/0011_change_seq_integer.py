@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patchwork', '0010_add_patch_hash_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changesequence',
+            name='value',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='check',
+            name='change_seq',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='patch',
+            name='change_seq',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+    ]
@@ -19,7 +19,9 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 from collections import Counter, OrderedDict
+import bisect
 import datetime
+import hashlib
 import random
 import re
 
@@ -27,11 +29,42 @@ from django.contrib.auth.models import User
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import (
+    Case, F, IntegerField, Min, Q, Value, When)
+from django.utils.crypto import get_random_string
+from django.utils.encoding import force_bytes
 from django.utils.functional import cached_property
 
-from patchwork.parser import extract_tags, hash_patch
+from patchwork.cache import (
+    invalidate_bundles, invalidate_delegates, invalidate_patch_counts,
+    invalidate_patch_mbox, invalidate_people, invalidate_project,
+    invalidate_projects, invalidate_states, invalidate_submitter_mbox,
+    patch_archived_changed, todo_patch_changed, todo_patch_count)
+from patchwork.jobs import enqueue
+from patchwork.parser import extract_tags, hash_patch, split_patch
+
+
+_search_word_re = re.compile(r'\w+', re.U)
+
+
+def normalise_search(search):
+    """Normalise a string for matching against person search tokens."""
+    return u' '.join(search.lower().split())[:255]
+
+
+class PersonManager(models.Manager):
+
+    def complete(self, search, limit):
+        """Return up to limit people with a search token starting with
+        search, which should already be normalised.
+
+        People are ordered by their lowest matching token, so exact
+        matches come before longer tokens that merely share the prefix.
+        """
+        return self.filter(personsearchtoken__token__startswith=search) \
+            .annotate(rank=Min('personsearchtoken__token')) \
+            .order_by('rank', 'email')[:limit]
 
 
 class Person(models.Model):
@@ -40,6 +73,8 @@ class Person(models.Model):
     user = models.ForeignKey(User, null=True, blank=True,
                              on_delete=models.SET_NULL)
 
+    objects = PersonManager()
+
     def __unicode__(self):
         if self.name:
             return u'%s <%s>' % (self.name, self.email)
@@ -50,10 +85,34 @@ class Person(models.Model):
         self.name = user.profile.name()
         self.user = user
 
+    def search_tokens(self):
+        """Return the set of tokens this person can be found by: their
+        full name and email address, each word of their name, and the
+        local part of their email address."""
+        email = normalise_search(self.email)
+        tokens = set([email, email.split('@')[0]])
+        if self.name:
+            name = normalise_search(self.name)
+            tokens.add(name)
+            tokens.update(_search_word_re.findall(name))
+        tokens.discard(u'')
+        return tokens
+
     class Meta:
         verbose_name_plural = 'People'
 
 
+class PersonSearchToken(models.Model):
+    """A normalised token for finding a person by prefix, as used for
+    submitter autocompletion. These are kept up to date as people are
+    saved."""
+    person = models.ForeignKey(Person)
+    token = models.CharField(max_length=255, db_index=True)
+
+    class Meta:
+        unique_together = [('person', 'token')]
+
+
 class Project(models.Model):
     linkname = models.CharField(max_length=255, unique=True)
     name = models.CharField(max_length=255, unique=True)
@@ -111,7 +170,7 @@ class UserProfile(models.Model):
         pass
 
     def n_todo_patches(self):
-        return self.todo_patches().count()
+        return todo_patch_count(self)
 
     def todo_patches(self, project=None):
 
@@ -140,6 +199,52 @@ def _user_saved_callback(sender, created, instance, **kwargs):
 models.signals.post_save.connect(_user_saved_callback, sender=User)
 
 
+class APIToken(models.Model):
+    """A token which authenticates a user's XML-RPC calls, in place of
+    their password.
+
+    Only a hash of the token is stored, so the token itself is only
+    available when it's created. As tokens are long and random, an
+    unsalted hash is enough, and lets us find a token with an indexed
+    lookup rather than running the password hasher.
+    """
+    user = models.ForeignKey(User, related_name='api_tokens')
+    key = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(default=datetime.datetime.now)
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(force_bytes(token)).hexdigest()
+
+    @classmethod
+    def create_token(cls, user):
+        """Create a new token for user, returning the token object and
+        the token string."""
+        token = get_random_string(40)
+        obj = cls.objects.create(user=user, key=cls.hash_token(token))
+        return (obj, token)
+
+    @classmethod
+    def user_for_token(cls, token):
+        """Return the active user with the given token, or None."""
+        try:
+            obj = cls.objects.select_related('user').get(
+                key=cls.hash_token(token))
+        except cls.DoesNotExist:
+            return None
+
+        if not obj.user.is_active:
+            return None
+
+        return obj.user
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.user.username, self.created)
+
+    class Meta:
+        ordering = ['created']
+
+
 class State(models.Model):
     name = models.CharField(max_length=100)
     ordering = models.IntegerField(unique=True)
@@ -215,6 +320,78 @@ def get_default_initial_patch_state():
     return State.objects.get(ordering=0)
 
 
+class ChangeSequence(models.Model):
+    """The counter from which patches and checks take their change
+    sequence numbers. There's a single instance of this model.
+
+    Sequence numbers are sent to XML-RPC clients, which can't handle
+    integers of more than 32 bits, so they're stored as IntegerFields.
+    """
+    value = models.IntegerField(default=0)
+
+    # number of objects given new sequence numbers by each update query
+    # in set_change_seqs
+    UPDATE_CHUNK_SIZE = 250
+
+    @classmethod
+    def reserve(cls, count=1):
+        """Reserve count new change sequence numbers, and return the
+        last of them.
+
+        This must be called in the same transaction as the changes that
+        the numbers are used for. The counter stays locked until that
+        transaction completes, so changes are committed in sequence
+        order, and a client which has seen one change can't later find
+        an earlier one.
+        """
+        with transaction.atomic():
+            counter = cls.objects.filter(id=1)
+            if not counter.update(value=F('value') + count):
+                cls.objects.get_or_create(id=1)
+                counter.update(value=F('value') + count)
+            return counter.values_list('value', flat=True)[0]
+
+    @classmethod
+    def set_change_seqs(cls, queryset, ids):
+        """Give each object in queryset with an ID in ids a new change
+        sequence number, in order of ID."""
+        ids = sorted(set(ids))
+        if not ids:
+            return
+
+        seq = cls.reserve(len(ids)) - len(ids) + 1
+        size = cls.UPDATE_CHUNK_SIZE
+        for start in range(0, len(ids), size):
+            chunk = ids[start:start + size]
+            queryset.filter(id__in=chunk).update(change_seq=Case(
+                *[When(id=id, then=Value(seq + start + i))
+                  for (i, id) in enumerate(chunk)],
+                output_field=IntegerField()))
+
+
+def changes_since(patches, checks, since, limit):
+    """Return the patches and checks changed since a change sequence
+    number, as a (patches, checks) tuple.
+
+    patches and checks are querysets to find the changed objects in. At
+    most limit objects are returned in total: those with the lowest
+    change sequence numbers, so that clients can fetch later changes by
+    passing the highest change_seq returned as since.
+    """
+    patches = list(patches.filter(change_seq__gt=since)
+                   .order_by('change_seq')[:limit])
+    checks = list(checks.filter(change_seq__gt=since)
+                  .order_by('change_seq')[:limit])
+
+    seqs = sorted([obj.change_seq for obj in patches + checks])
+    if len(seqs) > limit:
+        last = seqs[limit - 1]
+        patches = [p for p in patches if p.change_seq <= last]
+        checks = [c for c in checks if c.change_seq <= last]
+
+    return (patches, checks)
+
+
 class PatchQuerySet(models.query.QuerySet):
 
     def with_tag_counts(self, project):
@@ -238,6 +415,56 @@ class PatchQuerySet(models.query.QuerySet):
 
         return qs.extra(select=select, select_params=select_params)
 
+    def editable(self, user):
+        """Limit to the patches that user may edit, as determined by
+        Patch.is_editable()"""
+        if not user.is_authenticated():
+            return self.none()
+
+        return self.filter(
+            Q(project__in=user.profile.maintainer_projects.all()) |
+            Q(delegate=user) | Q(submitter__user=user))
+
+    def update_patches(self, **fields):
+        """Set the state, delegate, archived and/or commit_ref fields of
+        all patches in the queryset, and return the number of patches.
+
+        The patches are updated with a single query, rather than being
+        saved individually. Patch change notifications and cached patch
+        counts are updated as they would be for individual saves.
+        """
+        orig_fields = list(self.values('id', 'project_id', 'archived',
+                                       'delegate_id', 'state_id'))
+        if not orig_fields or not fields:
+            return len(orig_fields)
+
+        ids = [f['id'] for f in orig_fields]
+        new_values = {}
+        for (name, value) in fields.items():
+            if name in ('state', 'delegate'):
+                new_values[name + '_id'] = value.id if value else None
+            else:
+                new_values[name] = value
+
+        with transaction.atomic():
+            Patch.objects.filter(id__in=ids).update(**fields)
+            ChangeSequence.set_change_seqs(Patch.objects, ids)
+            if 'state' in fields:
+                _bulk_patch_change_notifications(orig_fields,
+                                                 new_values['state_id'])
+
+        for orig in orig_fields:
+            new = orig.copy()
+            new.update(new_values)
+            patch_archived_changed(orig['project_id'], orig['archived'],
+                                   new['archived'])
+            todo_patch_changed(orig['project_id'], orig, new)
+
+        for project_id in set([f['project_id'] for f in orig_fields]):
+            invalidate_patch_counts(project_id)
+
+        return len(orig_fields)
+
 
 class PatchManager(models.Manager):
     use_for_related_fields = True
@@ -265,6 +492,10 @@ class Patch(models.Model):
     hash = HashField(null=True, blank=True)
     tags = models.ManyToManyField(Tag, through=PatchTag)
 
+    # Taken from the ChangeSequence each time the patch is saved, so
+    # clients can find the patches changed since they last looked.
+    change_seq = models.IntegerField(default=0, db_index=True)
+
     objects = PatchManager()
 
     def __unicode__(self):
@@ -313,7 +544,63 @@ class Patch(models.Model):
         if self.hash is None and self.content is not None:
             self.hash = hash_patch(self.content).hexdigest()
 
-        super(Patch, self).save()
+        update_files = self.pk is None or self._content_changed()
+
+        # the stored values of the fields that notifications and cached
+        # patch counts depend on
+        orig_fields = None
+        if self.pk is not None:
+            orig_fields = Patch.objects.filter(pk=self.pk) \
+                .values('archived', 'delegate_id', 'state_id').first()
+
+        with transaction.atomic():
+            _patch_change_notification(self, orig_fields)
+            # the change sequence counter stays locked until the
+            # transaction completes, so take a number only once
+            # everything else is done, just before the patch is written
+            self.change_seq = ChangeSequence.reserve()
+            super(Patch, self).save()
+
+        _patch_saved(self, orig_fields)
+
+        if update_files:
+            self.update_files()
+        self._loaded_content = self.content
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        patch = super(Patch, cls).from_db(db, field_names, values)
+        # remember the stored content, so that save() can tell whether
+        # the file offsets need to be recomputed
+        if 'content' not in patch.get_deferred_fields():
+            patch._loaded_content = patch.content
+        return patch
+
+    def _content_changed(self):
+        if 'content' in self.get_deferred_fields():
+            # never loaded, so can't have been changed
+            return False
+        if not hasattr(self, '_loaded_content'):
+            return True
+        return self.content != self._loaded_content
+
+    def update_files(self):
+        """Record the offsets of each file's diff within the patch
+        content, so that they can be displayed separately.
+
+        This is called by save() whenever the content has changed, so
+        the content must not be changed with QuerySet.update().
+        """
+        self.patchfile_set.all().delete()
+        if not self.content:
+            return
+
+        PatchFile.objects.bulk_create(
+            [PatchFile(patch=self, filename=filename[:255],
+                       start_offset=start, end_offset=end,
+                       additions=additions, deletions=deletions)
+             for (filename, start, end, additions, deletions)
+             in split_patch(self.content)])
 
     def is_editable(self, user):
         if not user.is_authenticated():
@@ -407,6 +694,25 @@ class Patch(models.Model):
         verbose_name_plural = 'Patches'
         ordering = ['date']
         unique_together = [('msgid', 'project')]
+        # for lookups by hash, with or without a project
+        index_together = [('hash', 'project')]
+
+
+class PatchFile(models.Model):
+    """The diff of a single file within a patch.
+
+    The diff itself isn't stored separately; start_offset and
+    end_offset give its location within the patch content.
+    """
+    patch = models.ForeignKey(Patch)
+    filename = models.CharField(max_length=255)
+    start_offset = models.PositiveIntegerField()
+    end_offset = models.PositiveIntegerField()
+    additions = models.PositiveIntegerField(default=0)
+    deletions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['start_offset']
 
 
 class Comment(models.Model):
@@ -427,17 +733,65 @@ class Comment(models.Model):
 
     def save(self, *args, **kwargs):
         super(Comment, self).save(*args, **kwargs)
-        self.patch.refresh_tag_counts()
+        enqueue('refresh-tag-counts', self.patch_id, unique=True)
 
     def delete(self, *args, **kwargs):
         super(Comment, self).delete(*args, **kwargs)
-        self.patch.refresh_tag_counts()
+        enqueue('refresh-tag-counts', self.patch_id, unique=True)
 
     class Meta:
         ordering = ['date']
         unique_together = [('msgid', 'patch')]
 
 
+def _increasing_subsequence(values):
+    """Return the set of indices of a longest strictly increasing
+    subsequence of values."""
+    # tails[k] is the index of the smallest value ending an increasing
+    # subsequence of length k + 1
+    tails = []
+    prev = [None] * len(values)
+    for (i, value) in enumerate(values):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if values[tails[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo > 0:
+            prev[i] = tails[lo - 1]
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+
+    indices = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        indices.add(i)
+        i = prev[i]
+    return indices
+
+
+def _order_keys(count, lo, hi):
+    """Return count increasing order keys between lo and hi (exclusive),
+    either of which may be None for no bound, or None if there isn't
+    room for them."""
+    gap = BundlePatch.ORDER_GAP
+    if hi is None:
+        if lo is None:
+            lo = 0
+        return [lo + gap * (i + 1) for i in range(count)]
+    if lo is None:
+        return [hi - gap * (count - i) for i in range(count)]
+
+    step = (hi - lo) // (count + 1)
+    if step < 1:
+        return None
+    return [lo + step * (i + 1) for i in range(count)]
+
+
 class Bundle(models.Model):
     owner = models.ForeignKey(User)
     project = models.ForeignKey(Project)
@@ -452,22 +806,168 @@ class Bundle(models.Model):
         return self.patches.order_by('bundlepatch__order')
 
     def append_patch(self, patch):
-        # todo: use the aggregate queries in django 1.1
-        orders = BundlePatch.objects.filter(bundle=self).order_by('-order') \
-            .values('order')
+        if not self.add_patches([patch]):
+            raise Exception('patch is already in bundle')
 
-        if len(orders) > 0:
-            max_order = orders[0]['order']
-        else:
-            max_order = 0
+    def add_patches(self, patches):
+        """Append patches to the end of the bundle, in the order given.
 
-        # see if the patch is already in this bundle
-        if BundlePatch.objects.filter(bundle=self, patch=patch).count():
-            raise Exception('patch is already in bundle')
+        Patches that are already in the bundle are skipped. Returns the
+        list of patches that were added.
+        """
+        existing = dict(BundlePatch.objects.filter(bundle=self)
+                        .values_list('patch_id', 'order'))
+        order = max(existing.values() or [0])
+
+        added = []
+        for patch in patches:
+            if patch.id in existing:
+                continue
+            order += BundlePatch.ORDER_GAP
+            existing[patch.id] = order
+            added.append(patch)
+
+        if added:
+            BundlePatch.objects.bulk_create(
+                [BundlePatch(bundle=self, patch=patch,
+                             order=existing[patch.id])
+                 for patch in added])
+            # bulk_create doesn't send post_save signals
+            invalidate_patch_counts(self.project_id)
+
+        return added
+
+    def remove_patches(self, patches):
+        """Remove patches from the bundle. Returns the list of patches
+        that were removed."""
+        bundlepatches = BundlePatch.objects.filter(bundle=self,
+                                                   patch__in=patches)
+        removed = [bp.patch for bp in bundlepatches.select_related('patch')]
+
+        if removed:
+            # there are no post_delete handlers for BundlePatch, so this
+            # is a single DELETE query
+            bundlepatches.delete()
+            invalidate_patch_counts(self.project_id)
+
+        return removed
+
+    def reorder_patches(self, patch_ids):
+        """Reorder patches within the bundle.
+
+        patch_ids is a list of the IDs of patches in the bundle, in their
+        new order. These patches are rearranged among the positions they
+        currently occupy, so they needn't cover the whole bundle. Only
+        patches that have moved relative to the others are updated, so
+        moving a single patch updates a single row. Returns the number of
+        patches updated.
+        """
+        rows = list(BundlePatch.objects.filter(bundle=self)
+                    .order_by('order', 'id').values_list('patch_id', 'order'))
+        orders = dict(rows)
+
+        ids = []
+        for patch_id in patch_ids:
+            if patch_id in orders and patch_id not in ids:
+                ids.append(patch_id)
+        if not ids:
+            return 0
+
+        # the patches take the positions (slots) that the reordered patches
+        # currently occupy. The other patches split these slots into
+        # segments, and the patch placed in a slot must be given a key
+        # within that slot's segment, between the same two other patches.
+        reordered = set(ids)
+        others = [order for (patch_id, order) in rows
+                  if patch_id not in reordered]
+        segments = [bisect.bisect(others, order)
+                    for order in sorted(orders[patch_id] for patch_id in ids)]
+
+        changes = {}
+        start = 0
+        for end in range(1, len(ids) + 1):
+            if end < len(ids) and segments[end] == segments[start]:
+                continue
+
+            segment = segments[start]
+            lo = others[segment - 1] if segment > 0 else None
+            hi = others[segment] if segment < len(others) else None
+            segment_changes = self._reorder_segment(ids[start:end], orders,
+                                                    lo, hi)
+            if segment_changes is None:
+                # no room left between the neighbouring keys
+                return self._renumber_patches(rows, ids)
+            changes.update(segment_changes)
+            start = end
+
+        self._set_patch_orders(changes)
+        return len(changes)
+
+    def _reorder_segment(self, ids, orders, lo, hi):
+        # Return a dict of new order keys for patches ids, which must be
+        # ordered between the keys lo and hi (either of which may be None
+        # for no bound), or None if there isn't room. The longest run of
+        # patches that are already in order (and within the bounds) keep
+        # their keys, and the others are given keys between their
+        # neighbours in the new order.
+        keys = [orders[patch_id] for patch_id in ids]
+        candidates = [i for (i, key) in enumerate(keys)
+                      if (lo is None or key > lo) and (hi is None or key < hi)]
+        kept = set([candidates[i] for i in _increasing_subsequence(
+                    [keys[i] for i in candidates])])
+
+        changes = {}
+        prev_key = lo
+        run = []
+        for (i, patch_id) in enumerate(ids + [None]):
+            if patch_id is not None and i not in kept:
+                run.append(patch_id)
+                continue
+
+            next_key = hi if patch_id is None else keys[i]
+            if run:
+                run_keys = _order_keys(len(run), prev_key, next_key)
+                if run_keys is None:
+                    return None
+                changes.update(zip(run, run_keys))
+                run = []
+            prev_key = next_key
+
+        return changes
+
+    def compact_order(self):
+        """Renumber the bundle's patches with evenly spaced order keys,
+        leaving room for patches to be moved between any two others.
+        Returns the number of patches updated."""
+        rows = list(BundlePatch.objects.filter(bundle=self)
+                    .order_by('order', 'id').values_list('patch_id', 'order'))
+        return self._renumber_patches(rows, [])
+
+    def _renumber_patches(self, rows, patch_ids):
+        # rows is the bundle's current (patch_id, order) list; patch_ids
+        # are placed in the positions that those patches currently occupy
+        ids = iter(patch_ids)
+        reordered = set(patch_ids)
+        changes = {}
+        for (i, (patch_id, order)) in enumerate(rows):
+            if patch_id in reordered:
+                patch_id = next(ids)
+                order = None
+            new_order = (i + 1) * BundlePatch.ORDER_GAP
+            if new_order != order:
+                changes[patch_id] = new_order
+
+        self._set_patch_orders(changes)
+        return len(changes)
+
+    def _set_patch_orders(self, changes):
+        if not changes:
+            return
 
-        bp = BundlePatch.objects.create(bundle=self, patch=patch,
-                                        order=max_order + 1)
-        bp.save()
+        BundlePatch.objects.filter(bundle=self, patch__in=changes.keys()) \
+            .update(order=Case(*[When(patch_id=patch_id, then=Value(order))
+                                 for (patch_id, order) in changes.items()],
+                               output_field=IntegerField()))
 
     class Meta:
         unique_together = [('owner', 'name')]
@@ -492,6 +992,12 @@ class Bundle(models.Model):
 
 
 class BundlePatch(models.Model):
+    # Patches are added to bundles with order keys ORDER_GAP apart, so a
+    # patch can be moved by changing its key alone. Bundles are compacted
+    # once the gaps between their keys drop below MIN_ORDER_GAP.
+    ORDER_GAP = 1024
+    MIN_ORDER_GAP = 32
+
     patch = models.ForeignKey(Patch)
     bundle = models.ForeignKey(Bundle)
     order = models.IntegerField()
@@ -537,6 +1043,14 @@ class Check(models.Model):
         help_text='A label to discern check from checks of other testing '
         'systems.')
 
+    # as for Patch.change_seq
+    change_seq = models.IntegerField(default=0, db_index=True)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.change_seq = ChangeSequence.reserve()
+            super(Check, self).save(*args, **kwargs)
+
     def __repr__(self):
         return "<Check id='%d' context='%s' state='%s'" % (
             self.id, self.context, self.get_state_display())
@@ -591,35 +1105,51 @@ class PatchChangeNotification(models.Model):
     orig_state = models.ForeignKey(State)
 
 
-def _patch_change_callback(sender, instance, **kwargs):
-    # we only want notification of modified patches
-    if instance.pk is None:
-        return
+class Job(models.Model):
+    """A deferred task, to be run by the runjobs management command. See
+    patchwork.jobs."""
+    name = models.CharField(max_length=255)
+    args = models.TextField(default='[]')
+    created = models.DateTimeField(default=datetime.datetime.now)
+    run_after = models.DateTimeField(default=datetime.datetime.now,
+                                     db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return u'%s(%s)' % (self.name, self.args)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+
 
-    if instance.project is None or not instance.project.send_notifications:
+def _patch_change_notification(patch, orig_fields):
+    # called by Patch.save, with the patch's stored fields (or None if
+    # the patch is new); we only want notification of modified patches
+    if orig_fields is None:
         return
 
-    try:
-        orig_patch = Patch.objects.get(pk=instance.pk)
-    except Patch.DoesNotExist:
+    if patch.project is None or not patch.project.send_notifications:
         return
 
     # If there's no interesting changes, abort without creating the
     # notification
-    if orig_patch.state == instance.state:
+    if orig_fields['state_id'] == patch.state_id:
         return
 
     notification = None
     try:
-        notification = PatchChangeNotification.objects.get(patch=instance)
+        notification = PatchChangeNotification.objects.get(patch=patch)
     except PatchChangeNotification.DoesNotExist:
         pass
 
     if notification is None:
-        notification = PatchChangeNotification(patch=instance,
-                                               orig_state=orig_patch.state)
+        notification = PatchChangeNotification(
+            patch=patch, orig_state_id=orig_fields['state_id'])
 
-    elif notification.orig_state == instance.state:
+    elif notification.orig_state_id == patch.state_id:
         # If we're back at the original state, there is no need to notify
         notification.delete()
         return
@@ -627,4 +1157,150 @@ def _patch_change_callback(sender, instance, **kwargs):
     notification.last_modified = datetime.datetime.now()
     notification.save()
 
-models.signals.pre_save.connect(_patch_change_callback, sender=Patch)
+
+def _bulk_patch_change_notifications(orig_fields, state_id):
+    # the equivalent of _patch_change_callback, for a set of patches that
+    # have all been changed to the same state
+    projects = set(Project.objects.filter(
+        id__in=set([f['project_id'] for f in orig_fields]),
+        send_notifications=True).values_list('id', flat=True))
+
+    orig_states = dict([(f['id'], f['state_id']) for f in orig_fields
+                        if f['project_id'] in projects and
+                        f['state_id'] != state_id])
+    if not orig_states:
+        return
+
+    notifications = PatchChangeNotification.objects.filter(
+        patch__in=orig_states.keys())
+    existing = dict(notifications.values_list('patch_id', 'orig_state_id'))
+
+    # if we're back at the original state, there is no need to notify
+    notifications.filter(orig_state=state_id).delete()
+
+    now = datetime.datetime.now()
+    notifications.exclude(orig_state=state_id).update(last_modified=now)
+    PatchChangeNotification.objects.bulk_create(
+        [PatchChangeNotification(patch_id=patch_id, orig_state_id=orig_state,
+                                 last_modified=now)
+         for (patch_id, orig_state) in orig_states.items()
+         if patch_id not in existing])
+
+
+def _state_change_callback(sender, instance, **kwargs):
+    invalidate_states()
+
+models.signals.post_save.connect(_state_change_callback, sender=State)
+models.signals.post_delete.connect(_state_change_callback, sender=State)
+
+
+def _project_saved_callback(sender, instance, **kwargs):
+    invalidate_projects()
+    invalidate_project(instance.id)
+
+
+def _project_deleted_callback(sender, instance, **kwargs):
+    invalidate_projects()
+
+models.signals.post_save.connect(_project_saved_callback, sender=Project)
+models.signals.post_delete.connect(_project_deleted_callback, sender=Project)
+
+
+def _person_saved_callback(sender, instance, **kwargs):
+    tokens = instance.search_tokens()
+    existing = set(PersonSearchToken.objects.filter(person=instance)
+                   .values_list('token', flat=True))
+
+    if existing - tokens:
+        PersonSearchToken.objects.filter(person=instance,
+                                         token__in=existing - tokens).delete()
+    if tokens - existing:
+        PersonSearchToken.objects.bulk_create(
+            [PersonSearchToken(person=instance, token=token)
+             for token in tokens - existing])
+
+    invalidate_people()
+    # patch mboxes include their submitter's name and email address
+    invalidate_submitter_mbox(instance.id)
+
+
+def _person_deleted_callback(sender, instance, **kwargs):
+    invalidate_people()
+
+models.signals.post_save.connect(_person_saved_callback, sender=Person)
+models.signals.post_delete.connect(_person_deleted_callback, sender=Person)
+
+
+def _delegate_change_callback(sender, **kwargs):
+    # the cached delegate lists contain users and their profiles, so we
+    # need to invalidate on changes to either, as well as changes to
+    # project maintainership
+    invalidate_delegates()
+
+models.signals.post_save.connect(_delegate_change_callback, sender=User)
+models.signals.post_delete.connect(_delegate_change_callback, sender=User)
+models.signals.post_save.connect(_delegate_change_callback,
+                                 sender=UserProfile)
+models.signals.m2m_changed.connect(
+    _delegate_change_callback,
+    sender=UserProfile.maintainer_projects.through)
+
+
+def _bundle_change_callback(sender, instance, **kwargs):
+    invalidate_bundles(instance.owner_id)
+
+models.signals.post_save.connect(_bundle_change_callback, sender=Bundle)
+models.signals.post_delete.connect(_bundle_change_callback, sender=Bundle)
+
+
+def _patch_fields(patch):
+    return {
+        'archived': patch.archived,
+        'delegate_id': patch.delegate_id,
+        'state_id': patch.state_id,
+    }
+
+
+def _patch_saved(patch, orig_fields):
+    # called by Patch.save once the patch has been saved, after the
+    # change sequence number's transaction, to update the cached counts
+    # from the patch's previously-stored fields
+    patch_archived_changed(patch.project_id,
+                           orig_fields and orig_fields['archived'],
+                           patch.archived)
+    todo_patch_changed(patch.project_id, orig_fields, _patch_fields(patch))
+    invalidate_patch_counts(patch.project_id)
+    invalidate_patch_mbox(patch.id)
+
+
+def _patch_deleted_callback(sender, instance, **kwargs):
+    patch_archived_changed(instance.project_id, instance.archived, None)
+    todo_patch_changed(instance.project_id, _patch_fields(instance), None)
+    invalidate_patch_counts(instance.project_id)
+
+models.signals.post_delete.connect(_patch_deleted_callback, sender=Patch)
+
+
+def _comment_change_callback(sender, instance, **kwargs):
+    # patch mboxes include the commit message and responses
+    invalidate_patch_mbox(instance.patch_id)
+
+models.signals.post_save.connect(_comment_change_callback, sender=Comment)
+models.signals.post_delete.connect(_comment_change_callback, sender=Comment)
+
+
+def _bundlepatch_change_callback(sender, instance, **kwargs):
+    # bundle views are paginated too, so changes to bundle membership
+    # need to invalidate the project's cached list counts. This isn't
+    # connected to post_delete, so that deletes needn't fetch each row:
+    # Bundle.remove_patches invalidates the counts itself, and rows
+    # deleted along with their patch or bundle need no invalidation.
+    try:
+        project_id = instance.bundle.project_id
+    except Bundle.DoesNotExist:
+        return
+
+    invalidate_patch_counts(project_id)
+
+models.signals.post_save.connect(_bundlepatch_change_callback,
+                                 sender=BundlePatch)
@@ -34,7 +34,11 @@ ADJACENT_PAGES = 1
 #  http://blog.localkinegrinds.com/2007/09/06/digg-style-pagination-in-django/
 
 class Paginator(paginator.Paginator):
-    def __init__(self, request, objects):
+    def __init__(self, request, objects, count=None):
+
+        # allow callers to provide a (possibly cached) count, to avoid a
+        # COUNT query on every page load
+        self._patch_count = count
 
         patches_per_page = settings.DEFAULT_PATCHES_PER_PAGE
 
@@ -88,3 +92,9 @@ class Paginator(paginator.Paginator):
         self.leading_set.reverse()
         self.long_page = \
                 len(self.current_page.object_list) >= LONG_PAGE_THRESHOLD
+
+    @property
+    def count(self):
+        if self._patch_count is None:
+            self._patch_count = super(Paginator, self).count
+        return self._patch_count
@@ -229,6 +229,91 @@ def hash_patch(str):
 
     return hash
 
+_file_header_re = re.compile('^(diff |Index: )')
+
+def _patch_filename(name):
+    # strip any timestamp, and the -p1 top-directory
+    name = name.split('\t')[0].strip()
+    if name == '/dev/null':
+        return None
+    if '/' in name:
+        name = name.split('/', 1)[1]
+    return name
+
+def split_patch(content):
+    """Split the content of a patch into per-file sections.
+
+    Returns a list of (filename, start, end, additions, deletions)
+    tuples, where start and end are offsets of the section within
+    content. Sections cover the whole of content; any text before the
+    first file's header is included in the first section.
+    """
+    files = []
+    section = None
+    offset = 0
+    # remaining old and new lines of the current hunk
+    (old, new) = (0, 0)
+
+    lines = content.split('\n')
+    for (i, line) in enumerate(lines):
+        start = offset
+        offset += len(line) + 1
+
+        if old > 0 or new > 0:
+            c = line[:1]
+            if c == '-':
+                old -= 1
+                section['deletions'] += 1
+            elif c == '+':
+                new -= 1
+                section['additions'] += 1
+            elif c != '\\':
+                old -= 1
+                new -= 1
+            continue
+
+        hunk_match = _hunk_re.match(line)
+        if hunk_match:
+            if section is not None:
+                (old, new) = [int(x) if x is not None else 1
+                              for x in hunk_match.groups()]
+                section['hunks'] += 1
+            continue
+
+        next_line = lines[i + 1] if i + 1 < len(lines) else ''
+        is_header = _file_header_re.match(line) is not None
+        is_diff = line.startswith('--- ') and next_line.startswith('+++ ')
+
+        if not (is_header or is_diff):
+            continue
+
+        # a file header line ('diff', 'Index:') or a '---' line starts a
+        # new section, unless it's part of the current section's header
+        if section is None or section['hunks'] or \
+                (is_header and section['header']):
+            section = {'start': start if section else 0, 'header': False,
+                       'hunks': 0, 'filename': None, 'additions': 0,
+                       'deletions': 0}
+            files.append(section)
+
+        if is_header:
+            section['header'] = True
+            section['filename'] = _patch_filename(line.split(' ')[-1])
+        else:
+            section['filename'] = _patch_filename(next_line[4:]) or \
+                    _patch_filename(line[4:]) or section['filename']
+
+    if not files:
+        if not content:
+            return []
+        files = [{'start': 0, 'filename': None, 'additions': 0,
+                  'deletions': 0}]
+
+    ends = [f['start'] for f in files[1:]] + [len(content)]
+    return [(f['filename'] or '', f['start'], end,
+             f['additions'], f['deletions'])
+            for (f, end) in zip(files, ends)]
+
 def extract_tags(content, tags):
     counts = Counter()
 
@@ -21,15 +21,15 @@ from django.template import RequestContext
 from django.utils.html import escape
 from django.contrib.sites.models import Site
 from django.conf import settings
+from patchwork.cache import get_bundles, get_projects
 from patchwork.filters import Filters
-from patchwork.models import Bundle, Project
 
 
 def bundle(request):
     user = request.user
     if not user.is_authenticated():
         return {}
-    return {'bundles': Bundle.objects.filter(owner=user)}
+    return {'bundles': get_bundles(user)}
 
 
 class PatchworkRequestContext(RequestContext):
@@ -68,7 +68,7 @@ class PatchworkRequestContext(RequestContext):
                         'params': params
                         }})
 
-        self.projects = Project.objects.all()
+        self.projects = get_projects()
 
         self.update({
             'project': self.project,
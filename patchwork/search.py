@@ -0,0 +1,155 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Patch search backends.
+
+The search backend is selected by the SEARCH_BACKEND setting. The
+full-text backends rely on the indexes created by the
+0004_add_search_indexes migration, which the database keeps up to date
+as patches and comments are added.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+
+class SubstringSearchBackend(object):
+    """Search for patches with names containing the search string.
+
+    This works with any database, but can't use an index, so needs to
+    scan every patch.
+    """
+    ranked = False
+
+    def filter(self, queryset, search):
+        return queryset.filter(name__icontains=search)
+
+    def rank(self, queryset, search):
+        return queryset
+
+
+class FullTextSearchBackend(SubstringSearchBackend):
+    """Base class for database-specific full-text search backends.
+
+    Search strings are split into words, and patches match if their
+    name (or, if SEARCH_COMMENTS is set, any of their comments) contain
+    words starting with each of the search words. Where a search string
+    has no usable words, we fall back to a substring search.
+
+    Subclasses give the database's SQL for matching and ranking a column
+    against a query in match_template and rank_template, where {column}
+    is replaced by the column and %s is the query parameter. The query
+    parameter is made by formatting each search word with word_template
+    and joining them with word_separator.
+    """
+    ranked = True
+    min_word_length = 1
+    word_re = re.compile(r'\w+', re.U)
+
+    match_template = None
+    rank_template = None
+    word_template = None
+    word_separator = ' '
+    lowercase_words = False
+
+    def words(self, search):
+        words = self.word_re.findall(search)
+        if [w for w in words if len(w) < self.min_word_length]:
+            return []
+        return words
+
+    def match_sql(self, column):
+        return self.match_template.format(column=column)
+
+    def rank_sql(self, column):
+        return self.rank_template.format(column=column)
+
+    def query_param(self, words):
+        if self.lowercase_words:
+            words = [word.lower() for word in words]
+        return self.word_separator.join([self.word_template % word
+                                         for word in words])
+
+    def filter(self, queryset, search):
+        words = self.words(search)
+        if not words:
+            return super(FullTextSearchBackend, self).filter(queryset,
+                                                             search)
+        param = self.query_param(words)
+
+        where = self.match_sql('patchwork_patch.name')
+        params = [param]
+        if settings.SEARCH_COMMENTS:
+            where = ('(%s OR patchwork_patch.id IN (SELECT patch_id FROM '
+                     'patchwork_comment WHERE %s))' %
+                     (where, self.match_sql('patchwork_comment.content')))
+            params.append(param)
+
+        return queryset.extra(where=[where], params=params)
+
+    def rank(self, queryset, search):
+        words = self.words(search)
+        if not words:
+            return queryset
+
+        rank = RawSQL(self.rank_sql('patchwork_patch.name'),
+                      [self.query_param(words)], output_field=FloatField())
+        return queryset.annotate(search_rank=rank) \
+            .order_by('-search_rank', '-date')
+
+
+class PostgreSQLSearchBackend(FullTextSearchBackend):
+    """Full-text search using PostgreSQL's text search functions."""
+    match_template = "to_tsvector('simple', {column}) @@ " \
+        "to_tsquery('simple', %s)"
+    rank_template = "ts_rank(to_tsvector('simple', {column}), " \
+        "to_tsquery('simple', %s))"
+    word_template = '%s:*'
+    word_separator = ' & '
+    lowercase_words = True
+
+
+class MySQLSearchBackend(FullTextSearchBackend):
+    """Full-text search using MySQL's FULLTEXT indexes.
+
+    Words shorter than the server's minimum token size aren't indexed,
+    so we fall back to a substring search for those.
+    """
+    min_word_length = 3
+    match_template = 'MATCH ({column}) AGAINST (%s IN BOOLEAN MODE)'
+    rank_template = match_template
+    word_template = '+%s*'
+
+
+backends = {
+    'substring': SubstringSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+    'mysql': MySQLSearchBackend,
+}
+
+
+def get_search_backend():
+    name = settings.SEARCH_BACKEND
+    if name == 'auto':
+        name = connection.vendor
+    return backends.get(name, SubstringSearchBackend)()
@@ -4,8 +4,6 @@ Base settings for patchwork project.
 
 import os
 
-import django
-
 ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                         os.pardir, os.pardir)
 
@@ -35,14 +33,9 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.admindocs.middleware.XViewMiddleware',
 ]
 
-if django.VERSION < (1, 7):
-    MIDDLEWARE_CLASSES.append('django.middleware.doc.XViewMiddleware')
-else:
-    MIDDLEWARE_CLASSES.append(
-        'django.contrib.admindocs.middleware.XViewMiddleware')
-
 # Globalization
 
 TIME_ZONE = 'Australia/Canberra'
@@ -65,6 +58,21 @@ TEMPLATE_DIRS = (
     os.path.join(ROOT_DIR, 'templates'),
 )
 
+# Caching
+#
+# Patchwork caches counts and lookups, which are invalidated when the
+# underlying objects change. The default local-memory cache only sees the
+# changes made by its own process, so its entries are kept for at most
+# LOCAL_CACHE_TIMEOUT. Use memcached to share the cache between all of
+# patchwork's processes (web server workers and the mail parser).
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 # Email
 
 DEFAULT_FROM_EMAIL = 'Patchwork <patchwork@patchwork.example.com>'
@@ -105,14 +113,109 @@ STATICFILES_DIRS = [
 
 DEFAULT_PATCHES_PER_PAGE = 100
 
+# A process-local cache (LocMemCache) doesn't see the invalidations made by
+# other processes, so if one is used, cached values are kept for at most this
+# many seconds
+LOCAL_CACHE_TIMEOUT = 60
+
+# Number of seconds to cache patch counts for. Counts are updated or
+# invalidated when patches change, so this only bounds how stale they can
+# become following changes made outside of patchwork (e.g. in the database
+# directly). The counts are stored in the cache configured by CACHES.
+PATCH_COUNT_CACHE_TIMEOUT = 300
+
+# Set to True to use approximate patch counts for unfiltered patch lists.
+# These counts are not invalidated when patches change; they are only
+# refreshed once PATCH_COUNT_CACHE_TIMEOUT has elapsed.
+APPROXIMATE_PATCH_COUNTS = False
+
 CONFIRMATION_VALIDITY_DAYS = 7
 
 NOTIFICATION_DELAY_MINUTES = 10
 NOTIFICATION_FROM_EMAIL = DEFAULT_FROM_EMAIL
 
+# Maximum number of notification emails to send over a single connection
+# to the mail server
+NOTIFICATION_BATCH_SIZE = 100
+
+# Number of threads used to send notification emails. If this is greater
+# than one, up to NOTIFICATION_DOMAIN_CONCURRENCY emails to any one domain
+# are sent at a time
+NOTIFICATION_DELIVERY_THREADS = 1
+NOTIFICATION_DOMAIN_CONCURRENCY = 2
+
+# Deferred jobs (see patchwork.jobs). If JOB_QUEUE_ASYNC is False, jobs
+# are run as soon as they are queued; otherwise they are run by the
+# runjobs management command, with up to JOB_WORKER_CONCURRENCY jobs at
+# a time. Failed jobs are retried JOB_MAX_ATTEMPTS times, after a delay
+# of JOB_RETRY_DELAY seconds doubling with each attempt. A job which
+# hasn't finished within JOB_VISIBILITY_TIMEOUT seconds is assumed to
+# have been abandoned, and may be run by another worker.
+JOB_QUEUE_ASYNC = False
+JOB_WORKER_CONCURRENCY = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 60
+JOB_VISIBILITY_TIMEOUT = 10 * 60
+
+# Search backend used for patch searches. 'auto' uses full-text search if
+# supported by the database (PostgreSQL or MySQL); 'substring' always
+# uses a (slower) substring match on patch names
+SEARCH_BACKEND = 'auto'
+
+# Set to True to also match patch searches against comments on the patch.
+# Only supported by full-text search backends
+SEARCH_COMMENTS = False
+
+# Submitter autocompletion results are cached for this many seconds. They
+# are invalidated when people are added or changed
+SUBMITTER_COMPLETE_CACHE_TIMEOUT = 600
+
+# Syntax-highlighted patch and comment content is cached for this many
+# seconds. Cached content is keyed by a hash of the original, so edits are
+# shown immediately
+HIGHLIGHT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Highlighted content larger than this many bytes isn't cached, as memcached
+# doesn't store items of more than 1MB by default. Set to None to cache
+# content of any size
+HIGHLIGHT_CACHE_MAX_SIZE = 1000 * 1000
+
+# Patches larger than this (in characters) are shown a file at a time, with
+# the first PATCH_PROGRESSIVE_FILES files shown initially and the rest
+# loaded on request
+PATCH_PROGRESSIVE_THRESHOLD = 512 * 1024
+PATCH_PROGRESSIVE_FILES = 10
+
+# The cache (the name of an entry in CACHES) used for generated patch mboxes.
+# These are invalidated when patches, their comments or their submitters
+# change, so can be kept for a long time; a separate on-disk cache (using
+# Django's FileBasedCache backend) may be useful for large sites. Like the
+# default cache, this should be shared between processes: entries in a
+# process-local cache are only kept for LOCAL_CACHE_TIMEOUT
+MBOX_CACHE = 'default'
+MBOX_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# Mboxes larger than this many bytes aren't cached, as memcached doesn't
+# store items of more than 1MB by default. Set to None to cache mboxes of
+# any size
+MBOX_CACHE_MAX_SIZE = 1000 * 1000
+
+# Maximum number of patches that can be downloaded as a single mbox from a
+# (filtered) patch list
+MAX_LIST_MBOX_PATCHES = 1000
+
 # Set to True to enable the Patchwork XML-RPC interface
 ENABLE_XMLRPC = False
 
+# Maximum number of objects returned by a single XML-RPC list call; clients
+# fetch further results a page at a time
+XMLRPC_MAX_PAGE_SIZE = 1000
+
+# Number of seconds for which a verified XML-RPC username and password are
+# remembered, so that later calls needn't run the (deliberately slow) password
+# hasher. Set to 0 to check the password on every call
+XMLRPC_AUTH_CACHE_TIMEOUT = 300
+
 # Set to True to enable redirections or URLs from previous versions
 # of patchwork
 COMPAT_REDIR = True
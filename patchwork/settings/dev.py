@@ -7,8 +7,6 @@ Design based on:
     http://www.revsys.com/blog/2014/nov/21/recommended-django-project-layout/
 """
 
-import django
-
 from base import *
 
 #
@@ -44,12 +42,9 @@ DATABASES = {
 if os.getenv('PW_TEST_DB_TYPE', None) == 'postgre':
     DATABASES['default']['ENGINE'] = 'django.db.backends.postgresql_psycopg2'
 
-if django.VERSION < (1, 7):
-    DATABASES['default']['TEST_CHARSET'] = 'utf8'
-else:
-    DATABASES['default']['TEST'] = {
-        'CHARSET': 'utf8',
-    }
+DATABASES['default']['TEST'] = {
+    'CHARSET': 'utf8',
+}
 
 # Email
 
@@ -22,54 +22,65 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 import re
 
+from patchwork.cache import get_highlighted
+
 register = template.Library()
 
-def _compile(t):
-    (r, str) = t
-    return (re.compile(r, re.M | re.I), str)
-
-_patch_span_res = map(_compile, [
-        ('^(Index:?|diff|\-\-\-|\+\+\+|\*\*\*) .*$', 'p_header'),
-        ('^\+.*$', 'p_add'),
-        ('^-.*$', 'p_del'),
-        ('^!.*$', 'p_mod'),
-        ])
-
-_patch_chunk_re = \
-        re.compile('^(@@ \-\d+(?:,\d+)? \+\d+(?:,\d+)? @@)(.*)$', re.M | re.I)
-
-_comment_span_res = map(_compile, [
-        ('^\s*Signed-off-by: .*$', 'signed-off-by'),
-        ('^\s*Acked-by: .*$', 'acked-by'),
-        ('^\s*Nacked-by: .*$', 'nacked-by'),
-        ('^\s*Tested-by: .*$', 'tested-by'),
-        ('^\s*Reviewed-by: .*$', 'reviewed-by'),
-        ('^\s*From: .*$', 'from'),
-        ('^\s*&gt;.*$', 'quote'),
-        ])
+# Content is highlighted a line at a time, with a single regex match at
+# the start of each line. Alternatives are tried in order, so (for
+# example) a '---' header line isn't also marked as a deletion.
+
+_patch_line_re = re.compile(
+        r'(?:(?P<p_header>(?:Index:?|diff|---|\+\+\+|\*\*\*) )'
+        r'|(?P<p_add>\+)|(?P<p_del>-)|(?P<p_mod>!)'
+        r'|(?P<p_chunk>@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@))', re.I)
+
+# as we match against escaped content, quotes start with '&gt;'
+_comment_line_re = re.compile(
+        r'[ \t\r\f\v]*(?:(signed-off-by|acked-by|nacked-by|tested-by|'
+        r'reviewed-by|from): |&gt;)', re.I)
 
 _span = '<span class="%s">%s</span>'
 
-@register.filter
-def patchsyntax(patch):
-    content = escape(patch.content)
+def _highlight_patch_line(line):
+    match = _patch_line_re.match(line)
+    if match is None:
+        return line
+
+    cls = match.lastgroup
+    if cls == 'p_chunk':
+        return _span % ('p_chunk', match.group(cls)) + ' ' + \
+               _span % ('p_context', line[match.end():])
+
+    return _span % (cls, line)
 
-    for (r,cls) in _patch_span_res:
-        content = r.sub(lambda x: _span % (cls, x.group(0)), content)
+def _highlight_comment_line(line):
+    match = _comment_line_re.match(line)
+    if match is None:
+        return line
 
-    content = _patch_chunk_re.sub( \
-            lambda x: \
-                _span % ('p_chunk', x.group(1)) + ' ' + \
-                _span % ('p_context', x.group(2)), \
-            content)
+    cls = match.group(1)
+    if cls is None:
+        cls = 'quote'
 
-    return mark_safe(content)
+    return _span % (cls.lower(), line)
+
+def _highlight(content, highlight_line):
+    lines = escape(content).split('\n')
+    return '\n'.join([highlight_line(line) for line in lines])
 
 @register.filter
-def commentsyntax(comment):
-    content = escape(comment.content)
+def patchsyntax(patch):
+    return mark_safe(get_highlighted('patch', patch.id, patch.content,
+            lambda content: _highlight(content, _highlight_patch_line)))
 
-    for (r,cls) in _comment_span_res:
-        content = r.sub(lambda x: _span % (cls, x.group(0)), content)
+@register.filter
+def patchfilesyntax(patch_file):
+    return mark_safe(get_highlighted('patch-file', patch_file.id,
+            patch_file.content,
+            lambda content: _highlight(content, _highlight_patch_line)))
 
-    return mark_safe(content)
+@register.filter
+def commentsyntax(comment):
+    return mark_safe(get_highlighted('comment', comment.id, comment.content,
+            lambda content: _highlight(content, _highlight_comment_line)))
@@ -21,11 +21,7 @@ import errno
 import os
 import time
 
-import django
-if django.VERSION < (1, 7):
-    from django.test import LiveServerTestCase as StaticLiveServerTestCase
-else:
-    from django.contrib.staticfiles.testing import StaticLiveServerTestCase
+from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 from selenium.common.exceptions import (
         NoSuchElementException, StaleElementReferenceException,
         TimeoutException)
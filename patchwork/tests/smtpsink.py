@@ -0,0 +1,177 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""A local SMTP server which accepts and discards mail.
+
+This is used to test notification delivery over real SMTP connections.
+Connections are handled in separate threads, and each message can be
+delayed to simulate a slow mail server, or held at a Gate to test
+concurrent delivery without depending on timing. It can also be run
+standalone,
+to measure the delivery rate of the cron command:
+
+    python -m patchwork.tests.smtpsink --port 1025 --delay 0.2
+
+then, with EMAIL_BACKEND set to the SMTP backend and EMAIL_PORT = 1025:
+
+    ./manage.py cron -v 2
+"""
+
+import optparse
+import SocketServer
+import threading
+import time
+
+
+class Gate(object):
+    """Hold each caller of wait() until count callers are waiting at once,
+    then let them (and all later callers) through.
+
+    This makes tests of concurrency deterministic: opened is True only if
+    count callers were waiting at the same time. If they never are, each
+    caller gives up after timeout seconds, rather than hanging the test.
+    """
+
+    def __init__(self, count, timeout=5):
+        self.count = count
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.waiting = 0
+        self.opened = False
+
+    def wait(self):
+        with self.cond:
+            self.waiting += 1
+            if self.waiting >= self.count:
+                self.opened = True
+                self.cond.notify_all()
+
+            deadline = time.time() + self.timeout
+            while not self.opened and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            self.waiting -= 1
+
+
+class SMTPSinkHandler(SocketServer.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.reply('220 localhost SMTP sink')
+        recipients = []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.strip().split(' ', 1)[0].upper()
+
+            if command in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip().strip('<>')
+                if address.split('@')[-1] in self.server.reject_domains:
+                    self.reply('550 Rejected')
+                    continue
+                recipients.append(address)
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline().rstrip('\r\n') != '.':
+                    pass
+                if self.server.gate:
+                    self.server.gate.wait()
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                self.server.received(recipients)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPSink(SocketServer.ThreadingTCPServer):
+    """An SMTP server which records the recipients of each message.
+
+    Messages to addresses in reject_domains are refused. Each message is
+    delayed by delay seconds before it is accepted, and held at gate (a
+    Gate) if set.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, delay=0, reject_domains=()):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', port),
+                                                 SMTPSinkHandler)
+        self.delay = delay
+        self.gate = None
+        self.reject_domains = set(reject_domains)
+        self.lock = threading.Lock()
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def received(self, recipients):
+        with self.lock:
+            self.messages.append(recipients)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=1025)
+    parser.add_option('--delay', type='float', default=0,
+                      help='seconds to delay each message')
+    (options, args) = parser.parse_args()
+
+    sink = SMTPSink(options.port, options.delay)
+    sink.start()
+    print 'Listening on port %d' % sink.port
+
+    count = 0
+    try:
+        while True:
+            time.sleep(1)
+            if len(sink.messages) != count:
+                count = len(sink.messages)
+                print '%d messages received' % count
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -19,12 +19,14 @@
 
 import unittest
 import datetime
+import json
 from django.test import TestCase
 from django.test.client import Client
 from django.utils.http import urlencode
 from django.conf import settings
 from patchwork.models import Patch, Bundle, BundlePatch, Person
 from patchwork.tests.utils import defaults, create_user, find_in_context
+from patchwork.utils import compact_bundles
 
 def bundle_url(bundle):
     return '/bundle/%s/%s/' % (bundle.owner.username, bundle.name)
@@ -517,6 +519,56 @@ class BundleAddFromPatchTest(BundleTestBase):
                 for i in [0, 1] ]
         self.failUnless(bps[0].order < bps[1].order)
 
+class BundleBulkUpdateTest(BundleTestBase):
+    def setUp(self):
+        super(BundleBulkUpdateTest, self).setUp(5)
+
+    def bundlePatchIds(self):
+        return [bp.patch_id for bp in
+                BundlePatch.objects.filter(bundle = self.bundle)]
+
+    def testAddPatches(self):
+        self.bundle.append_patch(self.patches[2])
+        patches = [self.patches[i] for i in [4, 2, 0]]
+
+        with self.assertNumQueries(2):
+            added = self.bundle.add_patches(patches)
+
+        self.assertEquals(added, [self.patches[4], self.patches[0]])
+        self.assertEquals(self.bundlePatchIds(),
+                [self.patches[i].id for i in [2, 4, 0]])
+
+    def testAddNoPatches(self):
+        self.bundle.append_patch(self.patches[0])
+
+        with self.assertNumQueries(1):
+            added = self.bundle.add_patches([self.patches[0]])
+
+        self.assertEquals(added, [])
+
+    def testRemovePatches(self):
+        self.bundle.add_patches(self.patches[:3])
+
+        with self.assertNumQueries(2):
+            removed = self.bundle.remove_patches(self.patches[1:])
+
+        self.assertEquals(removed, self.patches[1:3])
+        self.assertEquals(self.bundlePatchIds(), [self.patches[0].id])
+
+    def testRemoveFromBundleView(self):
+        self.bundle.add_patches(self.patches)
+        params = {'form': 'patchlistform',
+                  'action': 'Remove',
+                  'removed_bundle_id': self.bundle.id,
+                  'patch_id:%d' % self.patches[0].id: 'checked',
+                  'patch_id:%d' % self.patches[3].id: 'checked'}
+
+        response = self.client.post(bundle_url(self.bundle), params)
+
+        self.assertContains(response, 'removed from bundle', count = 2)
+        self.assertEquals(self.bundlePatchIds(),
+                [self.patches[i].id for i in [1, 2, 4]])
+
 class BundleInitialOrderTest(BundleTestBase):
     """When creating bundles from a patch list, ensure that the patches in the
        bundle are ordered by date"""
@@ -586,12 +638,8 @@ class BundleReorderTest(BundleTestBase):
     def checkReordering(self, neworder, start, end):
         neworder_ids = [ self.patches[i].id for i in neworder ]
 
-        firstpatch = BundlePatch.objects.get(bundle = self.bundle,
-                patch = self.patches[start]).patch
-
         slice_ids = neworder_ids[start:end]
         params = {'form': 'reorderform',
-                  'order_start': firstpatch.id,
                   'neworder': slice_ids}
 
         response = self.client.post(bundle_url(self.bundle), params)
@@ -605,10 +653,9 @@ class BundleReorderTest(BundleTestBase):
         bundle_ids = [ bp.patch.id for bp in bps ]
         self.failUnlessEqual(neworder_ids, bundle_ids)
 
-        # check if order field is still sequential:
+        # check that order keys are still distinct:
         order_numbers = [ bp.order for bp in bps ]
-        expected_order = range(1, len(neworder)+1) # [1 ... len(neworder)]
-        self.failUnlessEqual(order_numbers, expected_order)
+        self.failUnlessEqual(len(set(order_numbers)), len(neworder))
 
     def testBundleReorderAll(self):
         # reorder all patches:
@@ -626,6 +673,133 @@ class BundleReorderTest(BundleTestBase):
         # reorder only 2nd, 3rd, and 4th patches
         self.checkReordering([0,2,3,1,4], 1, 4)
 
+class BundleSparseOrderTest(BundleTestBase):
+    def setUp(self):
+        super(BundleSparseOrderTest, self).setUp(5)
+        self.bundle.add_patches(self.patches)
+
+    def orders(self):
+        return dict(BundlePatch.objects.filter(bundle = self.bundle)
+                        .values_list('patch_id', 'order'))
+
+    def bundlePatchIds(self):
+        return [bp.patch_id for bp in
+                BundlePatch.objects.filter(bundle = self.bundle)]
+
+    def checkMove(self, neworder):
+        ids = [ self.patches[i].id for i in neworder ]
+        orders = self.orders()
+
+        self.assertEqual(self.bundle.reorder_patches(ids), 1)
+
+        self.assertEqual(self.bundlePatchIds(), ids)
+        changed = [ id for (id, order) in self.orders().items()
+                    if orders[id] != order ]
+        self.assertEqual(len(changed), 1)
+
+    def testMoveToStart(self):
+        self.checkMove([3, 0, 1, 2, 4])
+
+    def testMoveToEnd(self):
+        self.checkMove([0, 2, 3, 4, 1])
+
+    def testMoveToMiddle(self):
+        self.checkMove([0, 1, 4, 2, 3])
+
+    def testMoveQueries(self):
+        ids = [ self.patches[i].id for i in [1, 0, 2, 3, 4] ]
+        with self.assertNumQueries(2):
+            self.bundle.reorder_patches(ids)
+
+    def testReorderSubset(self):
+        # reordering patches 1-3 leaves patches 0 and 4 where they are
+        ids = [ self.patches[i].id for i in [3, 1, 2] ]
+        self.bundle.reorder_patches(ids)
+        self.assertEqual(self.bundlePatchIds(),
+                [ self.patches[i].id for i in [0, 3, 1, 2, 4] ])
+
+    def checkSubsetReorder(self, subset, neworder):
+        # the reordered patches take the positions of the subset, and
+        # the other patches stay where they are
+        expected = self.bundlePatchIds()
+        slots = [ expected.index(self.patches[i].id) for i in subset ]
+        for (slot, i) in zip(sorted(slots), neworder):
+            expected[slot] = self.patches[i].id
+
+        self.bundle.reorder_patches([ self.patches[i].id for i in neworder ])
+        self.assertEqual(self.bundlePatchIds(), expected)
+
+    def testReorderScatteredSubset(self):
+        self.bundle.add_patches(self.extraPatches(7))
+        # a scattered subset, as shown in a filtered bundle view
+        self.checkSubsetReorder([1, 3, 6, 10], [10, 6, 1, 3])
+        self.checkSubsetReorder([0, 4, 6, 9, 11], [6, 0, 11, 4, 9])
+        self.checkSubsetReorder([2, 7, 10], [7, 10, 2])
+
+    def testReorderScatteredSubsetGaps(self):
+        # uneven gaps between the keys mustn't change the result
+        self.bundle.add_patches(self.extraPatches(3))
+        for (i, order) in enumerate([1, 2, 3, 5000, 5001, 9000, 9001, 9002]):
+            BundlePatch.objects.filter(bundle = self.bundle,
+                    patch = self.patches[i]).update(order = order)
+        self.checkSubsetReorder([0, 2, 4, 7], [7, 4, 2, 0])
+        self.checkSubsetReorder([1, 3, 5, 6], [6, 1, 5, 3])
+
+    def extraPatches(self, count):
+        for i in range(count):
+            name = 'extrapatch%d' % i
+            patch = Patch(project = defaults.project, msgid = name,
+                          name = name, submitter = self.patches[0].submitter,
+                          content = '')
+            patch.save()
+            self.patches.append(patch)
+        return self.patches[-count:]
+
+    def testNoRoom(self):
+        for (i, patch) in enumerate(self.patches):
+            BundlePatch.objects.filter(bundle = self.bundle,
+                    patch = patch).update(order = i + 1)
+
+        ids = [ self.patches[i].id for i in [0, 2, 1, 3, 4] ]
+        self.bundle.reorder_patches(ids)
+
+        self.assertEqual(self.bundlePatchIds(), ids)
+        self.assertEqual(sorted(self.orders().values()),
+                [ (i + 1) * BundlePatch.ORDER_GAP for i in range(5) ])
+
+    def testReorderView(self):
+        ids = [ self.patches[i].id for i in [4, 3, 2, 1, 0] ]
+        response = self.client.post(bundle_url(self.bundle) + 'reorder/',
+                                    {'neworder': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'updated': 4})
+        self.assertEqual(self.bundlePatchIds(), ids)
+
+    def testReorderViewOtherUser(self):
+        self.client.logout()
+        user = create_user()
+        self.client.login(username = user.username, password = user.username)
+        ids = [ self.patches[i].id for i in [4, 3, 2, 1, 0] ]
+        response = self.client.post(bundle_url(self.bundle) + 'reorder/',
+                                    {'neworder': ids})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.bundlePatchIds(),
+                [ patch.id for patch in self.patches ])
+
+    def testCompactBundles(self):
+        orders = [ 1, 2, 1024, 2048, 2049 ]
+        for (patch, order) in zip(self.patches, orders):
+            BundlePatch.objects.filter(bundle = self.bundle,
+                    patch = patch).update(order = order)
+
+        self.assertEqual(compact_bundles(), 1)
+
+        self.assertEqual(self.bundlePatchIds(),
+                [ patch.id for patch in self.patches ])
+        self.assertEqual(sorted(self.orders().values()),
+                [ (i + 1) * BundlePatch.ORDER_GAP for i in range(5) ])
+        self.assertEqual(compact_bundles(), 0)
+
 class BundleRedirTest(BundleTestBase):
     # old URL: private bundles used to be under /user/bundle/<id>
 
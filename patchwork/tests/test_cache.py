@@ -0,0 +1,68 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from patchwork.cache import _timeout, _mbox_timeout
+
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+SHARED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+LOCAL_MBOX_CACHES = {
+    'default': SHARED_CACHES['default'],
+    'mbox': LOCAL_CACHES['default'],
+}
+
+@override_settings(LOCAL_CACHE_TIMEOUT = 60)
+class CacheTimeoutTest(TestCase):
+
+    @override_settings(CACHES = LOCAL_CACHES)
+    def testLocalCache(self):
+        self.assertEqual(_timeout(None), 60)
+        self.assertEqual(_timeout(300), 60)
+        self.assertEqual(_timeout(10), 10)
+
+    @override_settings(CACHES = SHARED_CACHES)
+    def testSharedCache(self):
+        self.assertEqual(_timeout(None), None)
+        self.assertEqual(_timeout(300), 300)
+
+    @override_settings(CACHES = SHARED_CACHES, MBOX_CACHE = 'default',
+                       MBOX_CACHE_TIMEOUT = 3600)
+    def testSharedMboxCache(self):
+        self.assertEqual(_mbox_timeout(), 3600)
+
+    @override_settings(CACHES = LOCAL_CACHES, MBOX_CACHE = 'default',
+                       MBOX_CACHE_TIMEOUT = 3600)
+    def testLocalMboxCache(self):
+        self.assertEqual(_mbox_timeout(), 60)
+
+    @override_settings(CACHES = LOCAL_MBOX_CACHES, MBOX_CACHE = 'mbox',
+                       MBOX_CACHE_TIMEOUT = 3600)
+    def testLocalSeparateMboxCache(self):
+        self.assertEqual(_mbox_timeout(), 60)
@@ -0,0 +1,171 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import gzip
+import json
+from StringIO import StringIO
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from patchwork.models import Patch, Check, Project, ChangeSequence, \
+     changes_since
+from patchwork.tests.utils import defaults, create_user
+
+class ChangeSequenceTestBase(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_user()
+        self.patches = [self.createPatch() for i in range(3)]
+
+    def createPatch(self, project = None):
+        n = Patch.objects.count()
+        patch = Patch(project = project or defaults.project,
+                submitter = defaults.patch_author_person,
+                msgid = 'testpatch%d' % n, name = 'testpatch%d' % n,
+                content = '')
+        patch.save()
+        return patch
+
+    def createCheck(self, patch):
+        check = Check(patch = patch, user = self.user,
+                      target_url = 'http://example.com/',
+                      description = 'test check')
+        check.save()
+        return check
+
+    def seqs(self):
+        return [Patch.objects.get(id = patch.id).change_seq
+                for patch in self.patches]
+
+class ChangeSequenceTest(ChangeSequenceTestBase):
+
+    def testCreate(self):
+        seqs = self.seqs()
+        self.assertEqual(seqs, sorted(set(seqs)))
+
+    def testSave(self):
+        patch = self.patches[0]
+        patch.archived = True
+        patch.save()
+        self.assertTrue(patch.change_seq > max(self.seqs()[1:]))
+
+    def testCheck(self):
+        check = self.createCheck(self.patches[0])
+        self.assertTrue(check.change_seq > max(self.seqs()))
+
+    def testUpdatePatches(self):
+        before = max(self.seqs())
+        Patch.objects.filter(id__in = [p.id for p in self.patches[1:]]) \
+                .update_patches(archived = True)
+        seqs = self.seqs()
+        self.assertTrue(seqs[0] < before)
+        self.assertTrue(before < seqs[1] < seqs[2])
+
+    def testUpdatePatchesChunks(self):
+        self.patches += [self.createPatch() for i in range(4)]
+        before = max(self.seqs())
+        orig_size = ChangeSequence.UPDATE_CHUNK_SIZE
+        ChangeSequence.UPDATE_CHUNK_SIZE = 3
+        try:
+            Patch.objects.all().update_patches(archived = True)
+        finally:
+            ChangeSequence.UPDATE_CHUNK_SIZE = orig_size
+
+        seqs = self.seqs()
+        self.assertEqual(seqs, range(before + 1, before + 8))
+
+    def testMissingCounter(self):
+        ChangeSequence.objects.all().delete()
+        patch = self.createPatch()
+        self.assertEqual(patch.change_seq, 1)
+
+class ChangesSinceTest(ChangeSequenceTestBase):
+
+    def changes(self, since, limit):
+        (patches, checks) = changes_since(Patch.objects.all(),
+                Check.objects.all(), since, limit)
+        return ([p.id for p in patches], [c.id for c in checks])
+
+    def testAll(self):
+        check = self.createCheck(self.patches[0])
+        self.assertEqual(self.changes(0, 10),
+                         ([p.id for p in self.patches], [check.id]))
+
+    def testSince(self):
+        check = self.createCheck(self.patches[0])
+        self.patches[1].save()
+        self.assertEqual(self.changes(self.patches[2].change_seq, 10),
+                         ([self.patches[1].id], [check.id]))
+
+    def testLimit(self):
+        check = self.createCheck(self.patches[0])
+        self.patches[0].save()
+        since = self.patches[1].change_seq
+        self.assertEqual(self.changes(since, 1), ([self.patches[2].id], []))
+        self.assertEqual(self.changes(since, 2),
+                         ([self.patches[2].id], [check.id]))
+        self.assertEqual(self.changes(check.change_seq, 2),
+                         ([self.patches[0].id], []))
+
+class ChangesViewTest(ChangeSequenceTestBase):
+
+    def setUp(self):
+        super(ChangesViewTest, self).setUp()
+        self.url = reverse('patchwork.views.patch.changes',
+                kwargs = {'project_id': defaults.project.linkname})
+
+    def get(self, since):
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def testChanges(self):
+        check = self.createCheck(self.patches[1])
+        data = self.get(self.patches[0].change_seq)
+        self.assertEqual([p['id'] for p in data['patches']],
+                         [p.id for p in self.patches[1:]])
+        self.assertEqual([c['id'] for c in data['checks']], [check.id])
+        self.assertEqual(data['seq'], check.change_seq)
+
+        self.assertEqual(self.get(data['seq']),
+                         {'seq': data['seq'], 'patches': [], 'checks': []})
+
+    def testOtherProject(self):
+        project = Project(linkname = 'other', name = 'Other',
+                          listid = 'other.example.com',
+                          listemail = 'other@example.com')
+        project.save()
+        patch = self.createPatch(project)
+        self.createCheck(patch)
+        data = self.get(0)
+        self.assertEqual([p['id'] for p in data['patches']],
+                         [p.id for p in self.patches])
+        self.assertEqual(data['checks'], [])
+
+    def testInvalidSince(self):
+        response = self.client.get(self.url, {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def testGzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING = 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj = StringIO(response.content)).read()
+        self.assertEqual(len(json.loads(content)['patches']), 3)
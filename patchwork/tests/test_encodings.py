@@ -49,13 +49,28 @@ class UTF8PatchViewTest(TestCase):
     def testMboxView(self):
         response = self.client.get('/patch/%d/mbox/' % self.patch.id)
         self.assertEquals(response.status_code, 200)
+        content = ''.join(response.streaming_content)
         self.assertTrue(self.patch.content in \
-                response.content.decode(self.patch_encoding))
+                content.decode(self.patch_encoding))
 
     def testRawView(self):
         response = self.client.get('/patch/%d/raw/' % self.patch.id)
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(response.content.decode(self.patch_encoding),
+        content = ''.join(response.streaming_content)
+        self.assertEquals(content.decode(self.patch_encoding),
+                self.patch.content)
+
+    def testRawViewChunks(self):
+        from patchwork.views import patch as patch_views
+        orig_size = patch_views.CONTENT_CHUNK_SIZE
+        patch_views.CONTENT_CHUNK_SIZE = 7
+        try:
+            response = self.client.get('/patch/%d/raw/' % self.patch.id)
+            chunks = list(response.streaming_content)
+        finally:
+            patch_views.CONTENT_CHUNK_SIZE = orig_size
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(''.join(chunks).decode(self.patch_encoding),
                 self.patch.content)
 
     def tearDown(self):
@@ -20,6 +20,9 @@
 import unittest
 from django.test import TestCase
 from django.test.client import Client
+from django.test.utils import override_settings
+from patchwork.models import Patch
+from patchwork.search import PostgreSQLSearchBackend, MySQLSearchBackend
 from patchwork.tests.utils import defaults, create_user, find_in_context
 
 class FilterQueryStringTest(TestCase):
@@ -43,3 +46,61 @@ class FilterQueryStringTest(TestCase):
         url = '/project/%s/list/?submitter=%%E2%%98%%83' % project.linkname
         response = self.client.get(url)
         self.failUnlessEqual(response.status_code, 200)
+
+class SearchFilterTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        for name in ['net: fix packet loss', 'mm: fix leak', 'net: add feature']:
+            patch = Patch(project = defaults.project, msgid = name,
+                          name = name, content = '',
+                          submitter = defaults.patch_author_person)
+            patch.save()
+        self.url = '/project/%s/list/' % defaults.project.linkname
+
+    def _search(self, search):
+        response = self.client.get(self.url, {'q': search})
+        self.failUnlessEqual(response.status_code, 200)
+        page = find_in_context(response.context, 'page')
+        return sorted([p.name for p in page.object_list])
+
+    @override_settings(SEARCH_BACKEND = 'substring')
+    def testSubstringSearch(self):
+        self.assertEqual(self._search('fix'),
+                         ['mm: fix leak', 'net: fix packet loss'])
+        self.assertEqual(self._search('et: '),
+                         ['net: add feature', 'net: fix packet loss'])
+        self.assertEqual(self._search('nothing'), [])
+
+class SearchBackendTest(unittest.TestCase):
+
+    def testPostgreSQLQuery(self):
+        backend = PostgreSQLSearchBackend()
+        self.assertEqual(backend.query_param(backend.words('net: Fix')),
+                         'net:* & fix:*')
+
+    def testMySQLQuery(self):
+        backend = MySQLSearchBackend()
+        self.assertEqual(backend.query_param(backend.words('net: fix')),
+                         '+net* +fix*')
+
+    def testMySQLShortWords(self):
+        # words shorter than MySQL's minimum token size aren't indexed
+        backend = MySQLSearchBackend()
+        self.assertEqual(backend.words('mm: fix'), [])
+
+    def testPostgreSQLMatch(self):
+        backend = PostgreSQLSearchBackend()
+        self.assertEqual(backend.match_sql('name'),
+                "to_tsvector('simple', name) @@ to_tsquery('simple', %s)")
+
+    def testMySQLRank(self):
+        backend = MySQLSearchBackend()
+        self.assertEqual(backend.rank_sql('name'),
+                         'MATCH (name) AGAINST (%s IN BOOLEAN MODE)')
+
+    def testNoWords(self):
+        backend = PostgreSQLSearchBackend()
+        self.assertEqual(backend.words(': -'), [])
@@ -0,0 +1,200 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+import datetime
+import logging
+import threading
+import unittest
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from patchwork.jobs import enqueue, run_next_job, task
+from patchwork.models import Comment, Job, Patch, PatchTag, Tag
+from patchwork.tests.utils import defaults
+
+calls = []
+
+
+@task('test-task')
+def _test_task(*args):
+    calls.append(args)
+
+
+@task('test-failing-task')
+def _test_failing_task():
+    raise Exception('test failure')
+
+
+class JobInlineTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def testEnqueueRunsInline(self):
+        enqueue('test-task', 1, 'two')
+        self.assertEquals(calls, [(1, 'two')])
+        self.assertEquals(Job.objects.count(), 0)
+
+    def testUnknownTask(self):
+        self.assertRaises(ValueError, enqueue, 'no-such-task')
+
+
+@override_settings(JOB_QUEUE_ASYNC=True, JOB_MAX_ATTEMPTS=2,
+                   JOB_RETRY_DELAY=60, JOB_VISIBILITY_TIMEOUT=600)
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def _makeDue(self):
+        Job.objects.update(run_after=datetime.datetime.now() -
+                           datetime.timedelta(seconds=1))
+
+    def testEnqueue(self):
+        enqueue('test-task', 1, 'two')
+        self.assertEquals(calls, [])
+
+        job = run_next_job()
+        self.assertEquals(job.name, 'test-task')
+        self.assertEquals(calls, [(1, 'two')])
+        self.assertEquals(Job.objects.count(), 0)
+        self.assertEquals(run_next_job(), None)
+
+    def testUnique(self):
+        enqueue('test-task', 1, unique=True)
+        enqueue('test-task', 1, unique=True)
+        enqueue('test-task', 2, unique=True)
+        self.assertEquals(Job.objects.count(), 2)
+
+    def testOrder(self):
+        for i in range(3):
+            enqueue('test-task', i)
+        while run_next_job():
+            pass
+        self.assertEquals(calls, [(0,), (1,), (2,)])
+
+    def testRetry(self):
+        enqueue('test-failing-task')
+        run_next_job()
+
+        job = Job.objects.get()
+        self.assertEquals(job.attempts, 1)
+        self.assertFalse(job.failed)
+        self.assertTrue('test failure' in job.last_error)
+        self.assertTrue(job.run_after > datetime.datetime.now() +
+                        datetime.timedelta(seconds=50))
+
+        # not due until the retry delay has passed
+        self.assertEquals(run_next_job(), None)
+
+        self._makeDue()
+        run_next_job()
+        job = Job.objects.get()
+        self.assertEquals(job.attempts, 2)
+        self.assertTrue(job.failed)
+
+        self._makeDue()
+        self.assertEquals(run_next_job(), None)
+
+    def testVisibilityTimeout(self):
+        enqueue('test-task')
+        Job.objects.update(attempts=1, locked_until=datetime.datetime.now() +
+                           datetime.timedelta(seconds=60))
+
+        # the job is still locked by another worker
+        self.assertEquals(run_next_job(), None)
+
+        Job.objects.update(locked_until=datetime.datetime.now() -
+                           datetime.timedelta(seconds=1))
+        self.assertNotEquals(run_next_job(), None)
+        self.assertEquals(calls, [()])
+        self.assertEquals(Job.objects.count(), 0)
+
+    def testAbandoned(self):
+        enqueue('test-task')
+        Job.objects.update(attempts=2, locked_until=datetime.datetime.now() -
+                           datetime.timedelta(seconds=1))
+
+        run_next_job()
+        self.assertEquals(calls, [])
+        self.assertTrue(Job.objects.get().failed)
+
+
+@override_settings(JOB_QUEUE_ASYNC=True)
+class JobTagRefreshTest(TestCase):
+    fixtures = ['default_tags', 'default_states']
+
+    def testCommentTags(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        patch = Patch(project=defaults.project, msgid='patch',
+                      name='patch', content='',
+                      submitter=defaults.patch_author_person)
+        patch.save()
+        for i in range(2):
+            Comment(patch=patch, msgid='comment%d' % i,
+                    submitter=defaults.patch_author_person,
+                    content='Acked-by: %s' %
+                    defaults.patch_author_person.email).save()
+
+        # both comments share a single refresh
+        self.assertEquals(Job.objects.count(), 1)
+        self.assertEquals(PatchTag.objects.filter(patch=patch).count(), 0)
+
+        run_next_job()
+        tag = PatchTag.objects.get(patch=patch,
+                                   tag=Tag.objects.get(name='Acked-by'))
+        self.assertEquals(tag.count, 2)
+
+
+class JobWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        from patchwork.management.commands import runjobs
+        self.runjobs = runjobs
+        self.run_next_job = runjobs.run_next_job
+        self.results = []
+        runjobs.run_next_job = self._run_next_job
+        logging.getLogger(runjobs.__name__).disabled = True
+
+    def tearDown(self):
+        self.runjobs.run_next_job = self.run_next_job
+        logging.getLogger(self.runjobs.__name__).disabled = False
+
+    def _run_next_job(self):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def testErrors(self):
+        # errors outside of the jobs themselves, such as a lost database
+        # connection, mustn't stop the worker
+        self.results = [Exception('connection lost'), 'job',
+                        Exception('deadlock'), 'job', None]
+
+        # run the worker in its own thread, as it closes its connection
+        thread = threading.Thread(target=self.runjobs.run_worker,
+                                  args=(threading.Event(), True, 0))
+        thread.start()
+        thread.join()
+
+        self.assertEquals(self.results, [])
@@ -22,9 +22,13 @@ import random
 import datetime
 import string
 import re
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.test.client import Client
-from patchwork.tests.utils import defaults, create_user, find_in_context
+from patchwork.settings import base as base_settings
+from patchwork.tests.utils import defaults, create_user, create_maintainer, \
+     find_in_context
 from patchwork.models import Person, Patch
 from django.core.urlresolvers import reverse
 
@@ -115,3 +119,107 @@ class PatchOrderTest(TestCase):
                                     p2.submitter.name.lower())
         self._test_sequence(response, test_fn)
 
+
+class PatchCountTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.list_url = reverse('patchwork.views.patch.list',
+                kwargs={'project_id': defaults.project.linkname})
+        self.project_url = reverse('patchwork.views.project.project',
+                kwargs={'project_id': defaults.project.linkname})
+
+    def _create_patch(self, name):
+        patch = Patch(project = defaults.project, msgid = name, name = name,
+                      submitter = defaults.patch_author_person, content = '')
+        patch.save()
+        return patch
+
+    def _list_count(self):
+        response = self.client.get(self.list_url)
+        return find_in_context(response.context, 'page').paginator.count
+
+    def testListCountUpdated(self):
+        self._create_patch('patch one')
+        self.assertEqual(self._list_count(), 1)
+
+        patch = self._create_patch('patch two')
+        self.assertEqual(self._list_count(), 2)
+
+        patch.archived = True
+        patch.save()
+        self.assertEqual(self._list_count(), 1)
+
+    def testListCountCached(self):
+        self._create_patch('patch one')
+        self._list_count()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._list_count(), 1)
+        counts = [q for q in queries.captured_queries
+                  if 'COUNT(*)' in q['sql']]
+        self.assertEqual(counts, [])
+
+    def testProjectCountsUpdated(self):
+        patch = self._create_patch('patch one')
+        response = self.client.get(self.project_url)
+        self.assertEqual(response.context['n_patches'], 1)
+        self.assertEqual(response.context['n_archived_patches'], 0)
+
+        patch.archived = True
+        patch.save()
+        response = self.client.get(self.project_url)
+        self.assertEqual(response.context['n_patches'], 0)
+        self.assertEqual(response.context['n_archived_patches'], 1)
+
+        patch.delete()
+        response = self.client.get(self.project_url)
+        self.assertEqual(response.context['n_patches'], 0)
+        self.assertEqual(response.context['n_archived_patches'], 0)
+
+class PatchListQueryBudgetTest(TestCase):
+    """Ensure that the number of queries needed to render a patch list
+       doesn't depend on the number of patches, and that lookups cached
+       between requests aren't repeated"""
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_maintainer(defaults.project)
+        self.url = reverse('patchwork.views.patch.list',
+                kwargs={'project_id': defaults.project.linkname})
+        self.n_patches = 0
+
+    def _create_patches(self, count):
+        for i in range(self.n_patches, self.n_patches + count):
+            name = 'patch %d' % i
+            patch = Patch(project = defaults.project, msgid = name,
+                          name = name, content = '', delegate = self.user,
+                          submitter = defaults.patch_author_person)
+            patch.save()
+        self.n_patches += count
+
+    def _assertListQueries(self, n_queries):
+        for count in [1, 10]:
+            self._create_patches(count)
+            # the first request populates the cache
+            self.client.get(self.url)
+            with self.assertNumQueries(n_queries):
+                response = self.client.get(self.url)
+            page = find_in_context(response.context, 'page')
+            self.assertEqual(len(page.object_list), self.n_patches)
+
+    def testAnonymousListQueries(self):
+        self._assertListQueries(6)
+
+    def testMaintainerListQueries(self):
+        self.client.login(username = self.user.username,
+                          password = self.user.username)
+        self._assertListQueries(12)
+
+@override_settings(CACHES = base_settings.CACHES)
+class DefaultCacheQueryBudgetTest(PatchListQueryBudgetTest):
+    """Check the patch list query budget against patchwork's default cache
+       configuration, rather than the one used by the test settings"""
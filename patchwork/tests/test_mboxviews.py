@@ -23,9 +23,13 @@ import unittest
 import email
 import datetime
 import dateutil.parser, dateutil.tz
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.test.client import Client
-from patchwork.models import Patch, Comment, Person
+from patchwork.models import Patch, Comment, Person, Bundle
+from patchwork.cache import mbox_cache_stats
 from patchwork.tests.utils import defaults, create_user, find_in_context
 
 class MboxPatchResponseTest(TestCase):
@@ -169,7 +173,8 @@ class MboxDateHeaderTest(TestCase):
 
     def testDateHeader(self):
         response = self.client.get('/patch/%d/mbox/' % self.patch.id)
-        mail = email.message_from_string(response.content)
+        mail = email.message_from_string(
+                ''.join(response.streaming_content))
         mail_date = dateutil.parser.parse(mail['Date'])
         # patch dates are all in UTC
         patch_date = self.patch.date.replace(tzinfo=dateutil.tz.tzutc(),
@@ -186,7 +191,8 @@ class MboxDateHeaderTest(TestCase):
         self.patch.save()
 
         response = self.client.get('/patch/%d/mbox/' % self.patch.id)
-        mail = email.message_from_string(response.content)
+        mail = email.message_from_string(
+                ''.join(response.streaming_content))
         mail_date = dateutil.parser.parse(mail['Date'])
         self.assertEqual(mail_date, date)
 
@@ -219,3 +225,252 @@ class MboxCommentPostcriptUnchangedTest(TestCase):
         self.assertContains(response, self.txt)
         self.txt += "\n"
         self.assertNotContains(response, self.txt)
+
+class MboxBundleTest(TestCase):
+    fixtures = ['default_states']
+
+    """ Test that bundle mboxes contain each patch, in bundle order, when
+        patches are fetched in several chunks """
+    def setUp(self):
+        defaults.project.save()
+        self.user = create_user()
+
+        self.person = defaults.patch_author_person
+        self.person.save()
+
+        self.bundle = Bundle(owner = self.user, project = defaults.project,
+                name = 'testbundle', public = True)
+        self.bundle.save()
+
+        self.patches = []
+        for i in range(0, 5):
+            patch = Patch(project = defaults.project,
+                          msgid = 'p%d' % i, name = 'testpatch%d' % i,
+                          submitter = self.person, content = '')
+            patch.save()
+            comment = Comment(patch = patch, msgid = patch.msgid,
+                    submitter = self.person,
+                    content = 'comment %d text\n' % i)
+            comment.save()
+            self.patches.insert(0, patch)
+
+        for patch in self.patches:
+            self.bundle.append_patch(patch)
+
+        from patchwork import views
+        self.views = views
+        self.chunk_size = views.MBOX_CHUNK_SIZE
+        views.MBOX_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        self.views.MBOX_CHUNK_SIZE = self.chunk_size
+
+    def testBundleMbox(self):
+        response = self.client.get('/bundle/%s/%s/mbox/' %
+                                   (self.user.username, self.bundle.name))
+        self.assertEquals(response.status_code, 200)
+        content = ''.join(response.streaming_content)
+
+        mails = content.split('\nFrom patchwork ')
+        self.assertEquals(len(mails), len(self.patches))
+
+        for (mail, patch) in zip(mails, self.patches):
+            self.assertIn('Subject: %s\n' % patch.name, mail)
+            self.assertIn('%s text\n' % patch.msgid.replace('p', 'comment '),
+                          mail)
+
+    def testPatchMboxesQueries(self):
+        from patchwork.views import patch_mboxes
+        patches = list(Patch.objects.filter(project = defaults.project))
+        with self.assertNumQueries(2):
+            mails = patch_mboxes(patches)
+        self.assertEquals([mail['Message-Id'] for mail in mails],
+                          [patch.msgid for patch in patches])
+
+class MboxCacheTest(TestCase):
+    fixtures = ['default_states']
+
+    """ Test that cached mboxes are used, and updated when the patch or its
+        comments change """
+    def setUp(self):
+        cache.clear()
+        defaults.project.save()
+
+        self.person = defaults.patch_author_person
+        self.person.save()
+
+        self.patch = Patch(project = defaults.project,
+                           msgid = 'p1', name = 'testpatch',
+                           submitter = self.person, content = '')
+        self.patch.save()
+        comment = Comment(patch = self.patch, msgid = 'p1',
+                submitter = self.person,
+                content = 'comment 1 text\n')
+        comment.save()
+
+    def getMbox(self):
+        response = self.client.get('/patch/%d/mbox/' % self.patch.id)
+        return ''.join(response.streaming_content)
+
+    def testCacheHit(self):
+        mbox = self.getMbox()
+        self.assertEquals(mbox_cache_stats(), (0, 1, 0))
+        self.assertEquals(self.getMbox(), mbox)
+        self.assertEquals(mbox_cache_stats(), (1, 1, 0))
+
+    def testContentFetchedOnce(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.getMbox()
+        self.assertEquals(len([q for q in queries.captured_queries
+                               if '"patchwork_patch"."content"' in q['sql']]),
+                          1)
+
+    def testPatchChange(self):
+        self.getMbox()
+        self.patch.name = 'newname'
+        self.patch.save()
+        self.assertIn('Subject: newname\n', self.getMbox())
+
+    def testSubmitterChange(self):
+        self.getMbox()
+        self.person.name = 'New Name'
+        self.person.save()
+        self.assertIn('From: New Name <', self.getMbox())
+
+    @override_settings(MBOX_CACHE_MAX_SIZE = 10)
+    def testLargeMbox(self):
+        mbox = self.getMbox()
+        self.assertEquals(mbox_cache_stats(), (0, 1, 1))
+        self.assertEquals(self.getMbox(), mbox)
+        self.assertEquals(mbox_cache_stats(), (0, 2, 2))
+
+    def testCommentChange(self):
+        self.getMbox()
+        comment = Comment(patch = self.patch, msgid = 'p2',
+                submitter = self.person,
+                content = 'comment 2 text\nAcked-by: 2\n')
+        comment.save()
+        self.assertIn('Acked-by: 2\n', self.getMbox())
+
+class MboxListTest(TestCase):
+    fixtures = ['default_states']
+
+    """ Test the mbox download of a (filtered) patch list """
+    def setUp(self):
+        cache.clear()
+        defaults.project.save()
+
+        self.person = defaults.patch_author_person
+        self.person.save()
+        self.other_person = Person(name = 'Other', email = 'o@example.com')
+        self.other_person.save()
+
+        self.patches = []
+        for (i, person) in enumerate([self.person, self.other_person,
+                                      self.person]):
+            patch = Patch(project = defaults.project,
+                          msgid = 'p%d' % i, name = 'testpatch%d' % i,
+                          submitter = person, content = '',
+                          date = datetime.datetime(2016, 1, i + 1))
+            patch.save()
+            self.patches.append(patch)
+
+        self.url = '/project/%s/list/mbox/' % defaults.project.linkname
+
+    def getSubjects(self, response):
+        self.assertEquals(response.status_code, 200)
+        content = ''.join(response.streaming_content)
+        return [mail.split('\n')[0] for mail in
+                content.split('\nSubject: ')[1:]]
+
+    def testListMbox(self):
+        response = self.client.get(self.url)
+        self.assertEquals(self.getSubjects(response),
+                          ['testpatch2', 'testpatch1', 'testpatch0'])
+
+    def testListMboxOrder(self):
+        response = self.client.get(self.url, {'order': 'date'})
+        self.assertEquals(self.getSubjects(response),
+                          ['testpatch0', 'testpatch1', 'testpatch2'])
+
+    def testListMboxFiltered(self):
+        response = self.client.get(self.url,
+                                   {'submitter': self.other_person.id})
+        self.assertEquals(self.getSubjects(response), ['testpatch1'])
+
+    @override_settings(MAX_LIST_MBOX_PATCHES = 2)
+    def testListMboxLimit(self):
+        response = self.client.get(self.url)
+        self.assertEquals(response.status_code, 400)
+
+
+class MboxKeysetTest(TestCase):
+    fixtures = ['default_states']
+
+    """ Test that patches_to_mbox pages through patches by their ordering
+        keys, so that patches are neither skipped nor repeated """
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_user()
+
+        date = datetime.datetime(2016, 1, 1)
+        for i in range(7):
+            self.addPatch('testpatch%d' % i, date,
+                          delegate = self.user if i % 3 == 0 else None)
+
+        from patchwork import views
+        self.views = views
+        self.chunk_size = views.MBOX_CHUNK_SIZE
+        views.MBOX_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        self.views.MBOX_CHUNK_SIZE = self.chunk_size
+
+    def addPatch(self, name, date, delegate = None):
+        patch = Patch(project = defaults.project, msgid = name, name = name,
+                      submitter = defaults.patch_author_person,
+                      delegate = delegate, content = '', date = date)
+        patch.save()
+        return patch
+
+    def getSubjects(self, mboxes):
+        return [mbox.split('\nSubject: ')[1].split('\n')[0]
+                for mbox in mboxes if mbox != '\n']
+
+    def assertMboxOrder(self, patches):
+        self.assertEquals(
+                self.getSubjects(self.views.patches_to_mbox(patches)),
+                [patch.name for patch in patches.order_by(
+                    *(list(patches.query.order_by) + ['id']))])
+
+    def testEqualKeys(self):
+        self.assertMboxOrder(Patch.objects.order_by('-date'))
+
+    def testNullKeys(self):
+        self.assertMboxOrder(Patch.objects.order_by('delegate__username'))
+        self.assertMboxOrder(Patch.objects.order_by('-delegate__username',
+                                                    'date'))
+
+    def testBundleOrder(self):
+        bundle = Bundle(owner = self.user, project = defaults.project,
+                        name = 'testbundle')
+        bundle.save()
+        patches = list(Patch.objects.order_by('-id'))
+        bundle.add_patches(patches)
+        self.assertEquals(
+                self.getSubjects(
+                    self.views.patches_to_mbox(bundle.ordered_patches())),
+                [patch.name for patch in patches])
+
+    def testPatchesAdded(self):
+        mboxes = self.views.patches_to_mbox(Patch.objects.order_by('-date'))
+        subjects = self.getSubjects([next(mboxes) for i in range(3)])
+
+        # a patch ordered before those already sent, and one after them
+        self.addPatch('newpatch0', datetime.datetime(2016, 1, 2))
+        self.addPatch('newpatch1', datetime.datetime(2015, 1, 1))
+        subjects += self.getSubjects(mboxes)
+
+        self.assertEquals(subjects,
+                ['testpatch%d' % i for i in range(7)] + ['newpatch1'])
@@ -17,14 +17,64 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import collections
 import datetime
+import threading
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
 from django.conf import settings
-from patchwork.models import Patch, State, PatchChangeNotification, EmailOptout
+from django.db import connection
+from patchwork.models import Patch, Person, State, PatchChangeNotification, \
+     EmailOptout
+from patchwork.tests.smtpsink import Gate, SMTPSink
 from patchwork.tests.utils import defaults
 from patchwork.utils import send_notifications
 
+class FailingEmailBackend(EmailBackend):
+    """Email backend which fails to send to addresses at fail.example.com,
+    and counts the connections opened."""
+    connections = 0
+    connected = False
+
+    def open(self):
+        if self.connected:
+            return False
+        self.connected = True
+        FailingEmailBackend.connections += 1
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].endswith('@fail.example.com'):
+                raise Exception('failed to send')
+        return super(FailingEmailBackend, self).send_messages(messages)
+
+class ConcurrencyEmailBackend(EmailBackend):
+    """Email backend which records the greatest number of messages sent
+    at once to each domain. Each message is held at gate until gate.count
+    messages are being sent at once."""
+    lock = threading.Lock()
+    active = collections.Counter()
+    max_active = collections.Counter()
+    gate = None
+
+    def send_messages(self, messages):
+        domain = messages[0].to[0].split('@')[1]
+        cls = ConcurrencyEmailBackend
+        with cls.lock:
+            cls.active[domain] += 1
+            cls.max_active[domain] = max(cls.max_active[domain],
+                                         cls.active[domain])
+        cls.gate.wait()
+        with cls.lock:
+            cls.active[domain] -= 1
+        return super(ConcurrencyEmailBackend, self).send_messages(messages)
+
 class PatchNotificationModelTest(TestCase):
     fixtures = ['default_states']
 
@@ -70,6 +120,27 @@ class PatchNotificationModelTest(TestCase):
         self.assertEqual(notification.patch, self.patch)
         self.assertEqual(notification.orig_state, oldstate)
 
+    def testPatchChangeQueries(self):
+        """Ensure the patch is fetched once to detect changes, and the
+           change sequence is only locked once everything else is done"""
+        self.patch.save()
+        self.patch.state = State.objects.exclude(pk = self.patch.state.pk)[0]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.patch.save()
+        sqls = [q['sql'] for q in queries.captured_queries
+                if 'SAVEPOINT' not in q['sql']]
+        selects = [sql for sql in sqls
+                   if 'SELECT' in sql and 'FROM "patchwork_patch" ' in sql]
+        self.assertEqual(len(selects), 1)
+
+        reserved = [i for (i, sql) in enumerate(sqls)
+                    if 'UPDATE "patchwork_changesequence"' in sql]
+        self.assertEqual(len(reserved), 1)
+        # only the read of the counter and the patch update follow
+        self.assertEqual(len(sqls) - reserved[0], 3)
+        self.assertTrue('UPDATE "patchwork_patch" ' in sqls[-1])
+
     def testNotificationCancelled(self):
         """Ensure we cancel notifications that are no longer valid"""
         self.patch.save()
@@ -119,7 +190,7 @@ class PatchNotificationModelTest(TestCase):
         self.patch.save()
         self.assertEqual(PatchChangeNotification.objects.count(), 0)
 
-class PatchNotificationEmailTest(TestCase):
+class PatchNotificationTestBase(TestCase):
     fixtures = ['default_states']
 
     def setUp(self):
@@ -149,6 +220,23 @@ class PatchNotificationEmailTest(TestCase):
 
         qs.update(last_modified = timestamp)
 
+    def _createNotifications(self, emails):
+        for email in emails:
+            submitter = Person(email = email)
+            submitter.save()
+            patch = Patch(project = self.project, msgid = email,
+                          name = email, content = '', submitter = submitter)
+            patch.save()
+            PatchChangeNotification(patch = patch,
+                                   orig_state = patch.state).save()
+        self._expireNotifications()
+
+    def _countQueries(self):
+        with CaptureQueriesContext(connection) as queries:
+            send_notifications()
+        return len(queries)
+
+class PatchNotificationEmailTest(PatchNotificationTestBase):
     def testNoNotifications(self):
         self.assertEquals(send_notifications(), [])
 
@@ -254,3 +342,137 @@ class PatchNotificationEmailTest(TestCase):
         msg = mail.outbox[0]
         self.assertTrue(patches[0].get_absolute_url() in msg.body)
         self.assertTrue(patches[1].get_absolute_url() in msg.body)
+
+    def testNotificationQueries(self):
+        EmailOptout(email = 'test1@example.com').save()
+        EmailOptout(email = 'test3@example.com').save()
+
+        self._createNotifications(['test1@example.com', 'test2@example.com'])
+        n_queries = self._countQueries()
+
+        self._createNotifications(['test%d@example.com' % i
+                                   for i in range(3, 9)])
+        self.assertEquals(self._countQueries(), n_queries)
+        self.assertEquals(len(mail.outbox), 6)
+
+    @override_settings(NOTIFICATION_BATCH_SIZE = 2,
+        EMAIL_BACKEND = 'patchwork.tests.test_notifications.FailingEmailBackend')
+    def testNotificationBatches(self):
+        FailingEmailBackend.connections = 0
+        emails = ['test1@example.com', 'test2@fail.example.com',
+                  'test3@example.com', 'test4@example.com',
+                  'test5@example.com']
+        self._createNotifications(emails)
+
+        stats = {}
+        errors = send_notifications(stats)
+
+        self.assertEquals([ r.email for (r, ex) in errors ],
+                          ['test2@fail.example.com'])
+        self.assertEquals(sorted([ msg.to[0] for msg in mail.outbox ]),
+                          [ e for e in emails if 'fail' not in e ])
+        self.assertEquals(stats['sent'], 4)
+        self.assertEquals(stats['notifications'], 5)
+
+        # the failed notification is kept, to be retried
+        self.assertEquals(
+            [ n.patch.submitter.email for n in
+              PatchChangeNotification.objects.all() ],
+            ['test2@fail.example.com'])
+
+        # each batch is sent over a single connection
+        self.assertEquals(FailingEmailBackend.connections, 3)
+
+    @override_settings(NOTIFICATION_DELIVERY_THREADS = 3,
+        EMAIL_BACKEND = 'patchwork.tests.test_notifications.FailingEmailBackend')
+    def testConcurrentDelivery(self):
+        emails = ['test%d@example.com' % i for i in range(8)] + \
+                 ['test@fail.example.com']
+        self._createNotifications(emails)
+
+        errors = send_notifications()
+
+        self.assertEquals([ r.email for (r, ex) in errors ],
+                          ['test@fail.example.com'])
+        self.assertEquals(sorted([ msg.to[0] for msg in mail.outbox ]),
+                          sorted(emails[:-1]))
+        self.assertEquals(
+            [ n.patch.submitter.email for n in
+              PatchChangeNotification.objects.all() ],
+            ['test@fail.example.com'])
+
+    @override_settings(NOTIFICATION_DELIVERY_THREADS = 4,
+                       NOTIFICATION_DOMAIN_CONCURRENCY = 2,
+        EMAIL_BACKEND =
+            'patchwork.tests.test_notifications.ConcurrencyEmailBackend')
+    def testDomainConcurrency(self):
+        ConcurrencyEmailBackend.max_active.clear()
+        ConcurrencyEmailBackend.gate = Gate(4)
+        self._createNotifications(['test%d@%s.example.com' % (i, domain)
+                                   for domain in ['a', 'b', 'c']
+                                   for i in range(4)])
+
+        self.assertEquals(send_notifications(), [])
+        self.assertEquals(len(mail.outbox), 12)
+
+        # all four threads were sending at once, but no more than two
+        # messages to any one domain
+        self.assertTrue(ConcurrencyEmailBackend.gate.opened)
+        max_active = ConcurrencyEmailBackend.max_active
+        for domain in ['a', 'b', 'c']:
+            self.assertTrue(max_active['%s.example.com' % domain] <= 2)
+
+@override_settings(EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend',
+                   EMAIL_HOST = '127.0.0.1')
+class PatchNotificationSMTPTest(PatchNotificationTestBase):
+    """Deliver notifications over SMTP, to a local server"""
+
+    def setUp(self):
+        super(PatchNotificationSMTPTest, self).setUp()
+        self.sink = SMTPSink(reject_domains = ['fail.example.com'])
+        self.sink.start()
+
+    def tearDown(self):
+        self.sink.stop()
+        super(PatchNotificationSMTPTest, self).tearDown()
+
+    def _deliver(self, emails, threads):
+        self.sink.messages = []
+        self._createNotifications(emails)
+        with self.settings(EMAIL_PORT = self.sink.port,
+                           NOTIFICATION_DELIVERY_THREADS = threads):
+            stats = {}
+            errors = send_notifications(stats)
+        return (errors, stats)
+
+    def testConcurrentDelivery(self):
+        emails = ['test%d@%s.example.com' % (i, domain)
+                  for domain in ['a', 'b', 'c', 'd'] for i in range(2)]
+
+        (errors, stats) = self._deliver(emails, 1)
+        self.assertEquals(errors, [])
+        self.assertEquals(len(self.sink.messages), len(emails))
+
+        # the server holds each message until four are being delivered
+        # at once, over separate connections
+        self.sink.gate = Gate(4)
+        (errors, stats) = self._deliver(['x' + email for email in emails], 4)
+        self.assertEquals(errors, [])
+        self.assertEquals(len(self.sink.messages), len(emails))
+        self.assertEquals(stats['sent'], len(emails))
+        self.assertTrue(self.sink.gate.opened)
+
+    def testRejectedRecipient(self):
+        emails = ['test%d@example.com' % i for i in range(4)] + \
+                 ['test@fail.example.com']
+
+        (errors, stats) = self._deliver(emails, 2)
+
+        self.assertEquals([ r.email for (r, ex) in errors ],
+                          ['test@fail.example.com'])
+        self.assertEquals(stats['sent'], 4)
+        self.assertEquals(
+            [ n.patch.submitter.email for n in
+              PatchChangeNotification.objects.all() ],
+            ['test@fail.example.com'])
+
@@ -0,0 +1,138 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import unittest
+from django.test import TestCase
+from django.test.utils import override_settings
+from patchwork.models import Patch
+from patchwork.parser import split_patch
+from patchwork.tests.utils import defaults
+
+foo_diff = """diff --git a/foo b/foo
+index 1234567..89abcde 100644
+--- a/foo
++++ b/foo
+@@ -1,2 +1,2 @@
+-foo
++FOO
+ bar
+"""
+
+bar_diff = """diff --git a/bar b/bar
+new file mode 100644
+--- /dev/null
++++ b/bar
+@@ -0,0 +1,2 @@
++bar
++--- baz
+"""
+
+baz_diff = """--- a/dir/baz.c\t2016-01-01 00:00:00
++++ b/dir/baz.c\t2016-01-01 00:00:00
+@@ -1 +0,0 @@
+-baz
+"""
+
+class SplitPatchTest(unittest.TestCase):
+
+    def testEmpty(self):
+        self.assertEquals(split_patch(''), [])
+
+    def testSingleFile(self):
+        self.assertEquals(split_patch(foo_diff),
+                          [('foo', 0, len(foo_diff), 1, 1)])
+
+    def testMultipleFiles(self):
+        content = foo_diff + bar_diff + baz_diff
+        files = split_patch(content)
+        self.assertEquals([(f[0], f[3], f[4]) for f in files],
+                [('foo', 1, 1), ('bar', 2, 0), ('dir/baz.c', 0, 1)])
+        self.assertEquals([content[f[1]:f[2]] for f in files],
+                          [foo_diff, bar_diff, baz_diff])
+
+    def testPreamble(self):
+        content = 'Some text\n' + foo_diff
+        self.assertEquals(split_patch(content),
+                          [('foo', 0, len(content), 1, 1)])
+
+    def testNoDiff(self):
+        self.assertEquals(split_patch('foo\n'), [('', 0, 4, 0, 0)])
+
+class PatchFileViewTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.content = foo_diff + bar_diff + baz_diff
+        self.patch = Patch(project = defaults.project, msgid = 'x',
+                           name = defaults.patch_name,
+                           submitter = defaults.patch_author_person,
+                           content = self.content)
+        self.patch.save()
+
+    def testFilesCreated(self):
+        self.assertEquals(
+                [f.filename for f in self.patch.patchfile_set.all()],
+                ['foo', 'bar', 'dir/baz.c'])
+
+    def testFilesUpdated(self):
+        patch = Patch.objects.get(id = self.patch.id)
+        patch.content = baz_diff + foo_diff
+        patch.save()
+        files = Patch.objects.get(id = self.patch.id).patchfile_set.all()
+        self.assertEquals([(f.filename, f.start_offset) for f in files],
+                          [('dir/baz.c', 0), ('foo', len(baz_diff))])
+
+    def testFilesUnchanged(self):
+        ids = list(self.patch.patchfile_set.values_list('id', flat = True))
+        patch = Patch.objects.get(id = self.patch.id)
+        patch.archived = True
+        patch.save()
+        patch = Patch.objects.defer('content').get(id = self.patch.id)
+        patch.archived = False
+        patch.save()
+        self.assertEquals(
+                list(self.patch.patchfile_set.values_list('id', flat = True)),
+                ids)
+
+    def testFullPatch(self):
+        response = self.client.get('/patch/%d/' % self.patch.id)
+        self.assertNotIn('patch_files', response.context)
+        self.assertContains(response, '<span class="p_add">+FOO</span>')
+        self.assertContains(response, '<span class="p_del">-baz</span>')
+
+    @override_settings(PATCH_PROGRESSIVE_THRESHOLD = 0,
+                       PATCH_PROGRESSIVE_FILES = 1)
+    def testProgressivePatch(self):
+        response = self.client.get('/patch/%d/' % self.patch.id)
+        self.assertEquals(len(response.context['patch_files']), 3)
+        self.assertContains(response, '<span class="p_add">+FOO</span>')
+        self.assertNotContains(response, '<span class="p_del">-baz</span>')
+        self.assertContains(response, 'show diff of dir/baz.c')
+
+    def testFileFragment(self):
+        response = self.client.get('/patch/%d/files/2/' % self.patch.id)
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, '<span class="p_del">-baz</span>')
+        self.assertNotContains(response, 'FOO')
+
+    def testFileFragmentNotFound(self):
+        response = self.client.get('/patch/%d/files/3/' % self.patch.id)
+        self.assertEquals(response.status_code, 404)
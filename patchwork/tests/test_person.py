@@ -53,3 +53,40 @@ class SubmitterCompletionTest(TestCase):
         self.assertEquals(response.status_code, 200)
         data = json.loads(response.content)
         self.assertEquals(len(data), 5)
+
+    def testCompleteLargeLimit(self):
+        response = self.client.get('/submitter/', {'q': 'test', 'l': 1000})
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals(len(data), 2)
+
+    def testCompleteIsPrefixMatch(self):
+        response = self.client.get('/submitter/', {'q': 'xample'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), [])
+
+    def testCompleteFullName(self):
+        response = self.client.get('/submitter/', {'q': '  test  NA '})
+        data = json.loads(response.content)
+        self.assertEquals(len(data), 1)
+        self.assertEquals(data[0]['name'], 'Test Name')
+
+    def testCompleteRanking(self):
+        Person(name = "Namely Other", email = "other@example.com").save()
+        response = self.client.get('/submitter/', {'q': 'name'})
+        data = json.loads(response.content)
+        self.assertEquals([p['name'] for p in data],
+                          ['Test Name', 'Namely Other'])
+
+    def testCompleteNameChange(self):
+        response = self.client.get('/submitter/', {'q': 'other'})
+        self.assertEquals(json.loads(response.content), [])
+
+        person = self.people[1]
+        person.name = 'Other Name'
+        person.save()
+
+        response = self.client.get('/submitter/', {'q': 'other'})
+        data = json.loads(response.content)
+        self.assertEquals(len(data), 1)
+        self.assertEquals(data[0]['email'], 'test2@example.com')
@@ -0,0 +1,108 @@
+# Patchwork - automated patch tracking system
+# Copyright (C) 2016 Jeremy Kerr <jk@ozlabs.org>
+#
+# This file is part of the Patchwork package.
+#
+# Patchwork is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Patchwork is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Patchwork; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from patchwork.cache import get_highlighted
+from patchwork.models import Patch, Comment
+from patchwork.templatetags.syntax import patchsyntax, commentsyntax
+from patchwork.tests.utils import defaults
+
+class PatchSyntaxTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        cache.clear()
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.patch = Patch(project = defaults.project, msgid = 'x',
+                           name = defaults.patch_name,
+                           submitter = defaults.patch_author_person)
+        self.patch.content = '\n'.join([
+            'diff --git a/foo b/foo',
+            '--- a/foo',
+            '+++ b/foo',
+            '@@ -1,2 +1,2 @@ int main()',
+            ' context',
+            '-removed <b>',
+            '+added',
+            '!modified',
+            '---',
+        ])
+        self.patch.save()
+
+    def testPatchSyntax(self):
+        self.assertEquals(patchsyntax(self.patch), '\n'.join([
+            '<span class="p_header">diff --git a/foo b/foo</span>',
+            '<span class="p_header">--- a/foo</span>',
+            '<span class="p_header">+++ b/foo</span>',
+            '<span class="p_chunk">@@ -1,2 +1,2 @@</span> '
+                '<span class="p_context"> int main()</span>',
+            ' context',
+            '<span class="p_del">-removed &lt;b&gt;</span>',
+            '<span class="p_add">+added</span>',
+            '<span class="p_mod">!modified</span>',
+            '<span class="p_del">---</span>',
+        ]))
+
+    def testPatchSyntaxEdited(self):
+        patchsyntax(self.patch)
+        self.patch.content = '+new'
+        self.patch.save()
+        self.assertEquals(patchsyntax(self.patch),
+                          '<span class="p_add">+new</span>')
+
+    def _highlight_twice(self):
+        renders = []
+        def render(content):
+            renders.append(content)
+            return content.upper()
+        for i in range(2):
+            self.assertEquals(get_highlighted('patch', self.patch.id,
+                                              self.patch.content, render),
+                              self.patch.content.upper())
+        return len(renders)
+
+    def testHighlightCached(self):
+        self.assertEquals(self._highlight_twice(), 1)
+
+    @override_settings(HIGHLIGHT_CACHE_MAX_SIZE = 10)
+    def testLargeHighlightNotCached(self):
+        self.assertEquals(self._highlight_twice(), 2)
+
+    def testCommentSyntax(self):
+        comment = Comment(patch = self.patch, msgid = 'y',
+                          submitter = defaults.patch_author_person)
+        comment.content = '\n'.join([
+            'Hello',
+            '> quoted',
+            '  Acked-by: Test <test@example.com>',
+            'signed-off-by: Test <test@example.com>',
+        ])
+        comment.save()
+
+        self.assertEquals(commentsyntax(comment), '\n'.join([
+            'Hello',
+            '<span class="quote">&gt; quoted</span>',
+            '<span class="acked-by">  Acked-by: '
+                'Test &lt;test@example.com&gt;</span>',
+            '<span class="signed-off-by">signed-off-by: '
+                'Test &lt;test@example.com&gt;</span>',
+        ]))
@@ -19,8 +19,11 @@
 
 from django.test import TestCase
 from django.core.urlresolvers import reverse
-from patchwork.models import Patch, Person, State
-from patchwork.tests.utils import defaults, create_maintainer
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from patchwork.models import Patch, Person, Project, State, \
+     PatchChangeNotification
+from patchwork.tests.utils import defaults, create_maintainer, create_user
 
 class MultipleUpdateTest(TestCase):
     fixtures = ['default_states']
@@ -118,3 +121,82 @@ class MultipleUpdateTest(TestCase):
         response = self._testDelegateChange('')
         for p in self.patches:
             self.assertEquals(Patch.objects.get(pk = p.pk).delegate, None)
+
+    def testStateChangeNotifications(self):
+        project = Project.objects.get(pk = defaults.project.pk)
+        project.send_notifications = True
+        project.save()
+        orig_state = self.patches[0].state
+        state = State.objects.exclude(pk = orig_state.pk)[0]
+
+        self._testStateChange(state.pk)
+        self.assertEquals(
+            sorted(PatchChangeNotification.objects.filter(
+                orig_state = orig_state).values_list('patch', flat = True)),
+            sorted([p.pk for p in self.patches]))
+
+        # changing back to the original state removes the notifications
+        self._testStateChange(orig_state.pk)
+        self.assertEquals(PatchChangeNotification.objects.count(), 0)
+
+    def testUpdateQueryCount(self):
+        # the patch list only shows patches in action-required states
+        orig_state = self.patches[0].state
+        new_state = State.objects.filter(action_required = True) \
+                .exclude(pk = orig_state.pk)[0]
+        states = [new_state, orig_state]
+
+        def count_queries(state):
+            with CaptureQueriesContext(connection) as queries:
+                self._testStateChange(state.pk)
+            return len(queries)
+
+        # the first update will populate cached values used by the list
+        count_queries(states[0])
+        n_queries = count_queries(states[1])
+
+        for i in range(0, 5):
+            name = 'extra patch %d' % i
+            patch = Patch(project = defaults.project, msgid = name,
+                          name = name, content = '', state = states[1],
+                          submitter = self.patches[0].submitter)
+            patch.save()
+            self.patches.append(patch)
+
+        self.assertEquals(count_queries(states[0]), n_queries)
+
+class MultipleUpdatePermissionTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_user()
+        self.client.login(username = self.user.username,
+                password = self.user.username)
+        self.url = reverse(
+            'patchwork.views.patch.list', args = [defaults.project.linkname])
+
+        self.own_patch = Patch(project = defaults.project, msgid = 'own',
+                name = 'own patch', content = '',
+                submitter = Person.objects.get(user = self.user))
+        self.own_patch.save()
+        self.other_patch = Patch(project = defaults.project, msgid = 'other',
+                name = 'other patch', content = '',
+                submitter = defaults.patch_author_person)
+        self.other_patch.save()
+
+    def testUpdate(self):
+        data = {'action': 'Update', 'project': str(defaults.project.id),
+                'form': 'patchlistform', 'archived': 'True',
+                'delegate': '*', 'state': '*',
+                'patch_id:%d' % self.own_patch.id: 'checked',
+                'patch_id:%d' % self.other_patch.id: 'checked'}
+        response = self.client.post(self.url, data)
+        self.assertContains(response,
+                "You don&#39;t have permissions to edit patch &#39;%s&#39;"
+                % self.other_patch.name)
+        self.assertContains(response, '1 patch updated')
+        self.assertTrue(Patch.objects.get(pk = self.own_patch.pk).archived)
+        self.assertFalse(Patch.objects.get(pk = self.other_patch.pk).archived)
+
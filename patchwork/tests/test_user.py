@@ -22,8 +22,11 @@ from django.core import mail
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.contrib.auth.models import User
-from patchwork.models import EmailConfirmation, Person, Bundle, UserProfile
-from patchwork.tests.utils import defaults, error_strings
+from django.core.cache import cache
+from patchwork.cache import todo_patch_counts
+from patchwork.models import EmailConfirmation, Person, Bundle, UserProfile, \
+     Patch, Project, State, APIToken
+from patchwork.tests.utils import defaults, error_strings, create_maintainer
 
 
 def _confirmation_url(conf):
@@ -175,6 +178,50 @@ class UserProfileTest(TestCase):
         user_profile = UserProfile.objects.get(user=self.user.user.id)
         self.assertEquals(user_profile.patches_per_page, old_ppp)
 
+class UserAPITokenTest(TestCase):
+
+    def setUp(self):
+        self.user = TestUser()
+        self.client.login(username = self.user.username,
+                          password = self.user.password)
+
+    def testCreateToken(self):
+        response = self.client.post(
+                reverse('patchwork.views.user.token_create'))
+        token = response.context['token']
+        self.assertContains(response, token)
+        self.assertEqual(APIToken.user_for_token(token), self.user.user)
+
+        # only the hash of the token is stored
+        self.assertFalse(APIToken.objects.filter(key = token).exists())
+
+    def testCreateTokenGet(self):
+        response = self.client.get(
+                reverse('patchwork.views.user.token_create'))
+        self.assertRedirects(response, '/user/')
+        self.assertEqual(APIToken.objects.count(), 0)
+
+    def testDeleteToken(self):
+        (api_token, token) = APIToken.create_token(self.user.user)
+        response = self.client.get('/user/')
+        delete_url = reverse('patchwork.views.user.token_delete',
+                             kwargs = {'token_id': api_token.id})
+        self.assertContains(response, delete_url)
+
+        response = self.client.post(delete_url)
+        self.assertRedirects(response, '/user/')
+        self.assertEqual(APIToken.user_for_token(token), None)
+
+    def testDeleteOtherUsersToken(self):
+        other = TestUser(username = 'other', email = 'other@example.com',
+                         secondary_email = 'other2@example.com')
+        (api_token, token) = APIToken.create_token(other.user)
+        response = self.client.post(
+                reverse('patchwork.views.user.token_delete',
+                        kwargs = {'token_id': api_token.id}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(APIToken.user_for_token(token), other.user)
+
 
 class UserPasswordChangeTest(TestCase):
     user = None
@@ -295,3 +342,98 @@ class UserUnlinkTest(TestCase):
 
         person = Person.objects.get(email=user.secondary_email)
         self.assertEquals(person.user, user.user)
+
+
+class UserTodoCountTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        # todo counts are cached by user ID, which may be reused between
+        # tests as the database is rolled back
+        cache.clear()
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_maintainer(defaults.project)
+        self.client.login(username = self.user.username,
+                          password = self.user.username)
+        self.patches = []
+        for name in ['patch one', 'patch two']:
+            patch = Patch(project = defaults.project, msgid = name,
+                          name = name, content = '',
+                          submitter = defaults.patch_author_person,
+                          delegate = self.user)
+            patch.save()
+            self.patches.append(patch)
+
+    def _n_todo_patches(self):
+        return UserProfile.objects.get(user = self.user).n_todo_patches()
+
+    def testTodoCount(self):
+        self.assertEquals(self._n_todo_patches(), 2)
+
+    def testTodoCountDelegateChange(self):
+        self._n_todo_patches()
+        other = create_maintainer(defaults.project)
+        self.patches[0].delegate = other
+        self.patches[0].save()
+        self.assertEquals(self._n_todo_patches(), 1)
+        self.assertEquals(other.profile.n_todo_patches(), 1)
+
+    def testTodoCountArchived(self):
+        self._n_todo_patches()
+        self.patches[0].archived = True
+        self.patches[0].save()
+        self.assertEquals(self._n_todo_patches(), 1)
+
+    def testTodoCountStateChange(self):
+        self._n_todo_patches()
+        state = State.objects.filter(action_required = False)[0]
+        self.patches[0].state = state
+        self.patches[0].save()
+        self.assertEquals(self._n_todo_patches(), 1)
+
+    def testTodoCountDelete(self):
+        self._n_todo_patches()
+        self.patches[0].delete()
+        self.assertEquals(self._n_todo_patches(), 1)
+
+    def testTodoLists(self):
+        project = Project(linkname = 'test-project-2',
+                          name = 'Test Project 2',
+                          listid = 'test2.example.com')
+        project.save()
+        patch = Patch(project = project, msgid = 'patch three',
+                      name = 'patch three', content = '',
+                      submitter = defaults.patch_author_person,
+                      delegate = self.user)
+        patch.save()
+
+        response = self.client.get('/user/todo/')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['todo_lists'],
+                [{'project': defaults.project, 'n_patches': 2},
+                 {'project': project, 'n_patches': 1}])
+
+    def testTodoPatchCounts(self):
+        projects = [defaults.project]
+        for i in range(3):
+            project = Project(linkname = 'test-project-%d' % i,
+                              name = 'Test Project %d' % i,
+                              listid = 'test%d.example.com' % i)
+            project.save()
+            projects.append(project)
+        profile = self.user.profile
+
+        with self.assertNumQueries(1):
+            counts = todo_patch_counts(profile, projects)
+        self.assertEquals(counts, dict([(project.id, 0)
+                                        for project in projects[1:]] +
+                                       [(defaults.project.id, 2)]))
+
+        with self.assertNumQueries(0):
+            self.assertEquals(todo_patch_counts(profile, projects), counts)
+
+        self.patches[0].archived = True
+        self.patches[0].save()
+        self.assertEquals(todo_patch_counts(profile, projects)
+                          [defaults.project.id], 1)
@@ -17,13 +17,24 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import base64
+import gzip
+import json
 import unittest
 import xmlrpclib
-from django.test import LiveServerTestCase
+from StringIO import StringIO
+from django.db import connection
+from django.core.cache import cache
+from django.test import LiveServerTestCase, TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
 from django.conf import settings
-from patchwork.models import Person, Patch
-from patchwork.tests.utils import defaults
+from patchwork.cache import get_verified_credentials
+from patchwork.models import (Person, Patch, Bundle, BundlePatch, Check,
+        State, APIToken)
+from patchwork.tests.utils import defaults, create_user, create_maintainer
 
 @unittest.skipUnless(settings.ENABLE_XMLRPC,
         "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
@@ -53,3 +64,521 @@ class XMLRPCTest(LiveServerTestCase):
         patches = self.rpc.patch_list()
         self.assertEqual(len(patches), 1)
         self.assertEqual(patches[0]['id'], patch.id)
+
+@unittest.skipUnless(settings.ENABLE_XMLRPC,
+        "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
+@override_settings(XMLRPC_MAX_PAGE_SIZE = 2)
+class XMLRPCPaginationTest(LiveServerTestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        self.url = (self.live_server_url +
+                    reverse('patchwork.views.xmlrpc.xmlrpc'))
+        self.rpc = xmlrpclib.Server(self.url)
+
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_user()
+        self.patches = []
+        for i in range(5):
+            patch = Patch(project = defaults.project,
+                    submitter = defaults.patch_author_person,
+                    msgid = 'testpatch%d' % i, name = 'testpatch%d' % i,
+                    content = defaults.patch)
+            patch.save()
+            Check(patch = patch, user = self.user,
+                  target_url = 'http://example.com/',
+                  description = 'test check').save()
+            self.patches.append(patch)
+
+    def _ids(self, objs):
+        return [obj['id'] for obj in objs]
+
+    def testPatchListPages(self):
+        ids = [patch.id for patch in self.patches]
+
+        page = self.rpc.patch_list()
+        self.assertEqual(self._ids(page), ids[:2])
+        page = self.rpc.patch_list({'cursor': page[-1]['id']})
+        self.assertEqual(self._ids(page), ids[2:4])
+        page = self.rpc.patch_list({'cursor': page[-1]['id']})
+        self.assertEqual(self._ids(page), ids[4:])
+        page = self.rpc.patch_list({'cursor': page[-1]['id']})
+        self.assertEqual(page, [])
+
+    def testPatchListMaxCount(self):
+        self.assertEqual(self._ids(self.rpc.patch_list({'max_count': 1})),
+                         [self.patches[0].id])
+        self.assertEqual(len(self.rpc.patch_list({'max_count': 10})), 2)
+
+    def testPatchListFilteredPages(self):
+        filt = {'name__in': ['testpatch1', 'testpatch3', 'testpatch4']}
+        page = self.rpc.patch_list(filt)
+        self.assertEqual(self._ids(page),
+                         [self.patches[1].id, self.patches[3].id])
+        filt['cursor'] = page[-1]['id']
+        self.assertEqual(self._ids(self.rpc.patch_list(filt)),
+                         [self.patches[4].id])
+
+    def testCheckListPages(self):
+        checks = Check.objects.order_by('id')
+        page = self.rpc.check_list()
+        self.assertEqual(self._ids(page), [c.id for c in checks[:2]])
+        page = self.rpc.check_list({'cursor': page[-1]['id'],
+                                    'max_count': 1})
+        self.assertEqual(self._ids(page), [checks[2].id])
+
+@unittest.skipUnless(settings.ENABLE_XMLRPC,
+        "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
+class JSONRPCTest(TestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        self.url = reverse('patchwork.views.xmlrpc.jsonrpc')
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_maintainer(defaults.project)
+        self.patches = []
+        for i in range(2):
+            patch = Patch(project = defaults.project,
+                    submitter = defaults.patch_author_person,
+                    msgid = 'testpatch%d' % i, name = 'testpatch%d' % i,
+                    content = defaults.patch)
+            patch.save()
+            self.patches.append(patch)
+
+    def post(self, data, **extra):
+        response = self.client.post(self.url, json.dumps(data),
+                content_type = 'application/json', **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response
+
+    def call(self, method, *params, **kwargs):
+        data = {'jsonrpc': '2.0', 'id': 1, 'method': method,
+                'params': list(params)}
+        data.update(kwargs)
+        return json.loads(self.post(data).content)
+
+    def testPatchList(self):
+        response = self.call('patch_list', {})
+        self.assertEqual(response['id'], 1)
+        self.assertEqual([p['id'] for p in response['result']],
+                         [p.id for p in self.patches])
+        self.assertEqual(response['result'][0]['project'],
+                         defaults.project.name)
+
+    def testFields(self):
+        response = self.call('patch_list', {}, fields = ['id', 'name'])
+        self.assertEqual(response['result'],
+                [{'id': p.id, 'name': p.name} for p in self.patches])
+
+        response = self.call('patch_get', self.patches[0].id,
+                             fields = ['state'])
+        self.assertEqual(response['result'],
+                         {'state': self.patches[0].state.name})
+
+    def testChangeListFields(self):
+        response = self.call('change_list', 0, fields = ['id', 'name'])
+        result = response['result']
+        self.assertEqual(result['patches'],
+                [{'id': p.id, 'name': p.name} for p in self.patches])
+        self.assertEqual(result['checks'], [])
+        self.assertEqual(result['seq'],
+                         Patch.objects.get(id = self.patches[-1].id).change_seq)
+
+    def testError(self):
+        response = self.call('no_such_method')
+        self.assertFalse('result' in response)
+        self.assertEqual(response['error']['code'], 1)
+
+    def testParseError(self):
+        response = self.client.post(self.url, '{',
+                content_type = 'application/json')
+        self.assertEqual(json.loads(response.content)['error']['code'],
+                         -32700)
+
+    def testGet(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def testBatch(self):
+        response = json.loads(self.post([
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'patch_get',
+             'params': [self.patches[0].id]},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'no_such_method'},
+        ]).content)
+        self.assertEqual(response[0]['result']['id'], self.patches[0].id)
+        self.assertEqual(response[1]['id'], 2)
+        self.assertTrue('error' in response[1])
+
+    def testAuth(self):
+        (api_token, token) = APIToken.create_token(self.user)
+        data = {'jsonrpc': '2.0', 'id': 1, 'method': 'patch_set',
+                'params': [self.patches[0].id, {'archived': True}]}
+
+        response = json.loads(self.post(data).content)
+        self.assertTrue('error' in response)
+        self.assertFalse(Patch.objects.get(id = self.patches[0].id).archived)
+
+        response = json.loads(self.post(data,
+                HTTP_AUTHORIZATION = 'Token ' + token).content)
+        self.assertEqual(response['result'], True)
+        self.assertTrue(Patch.objects.get(id = self.patches[0].id).archived)
+
+    def testGzip(self):
+        data = {'jsonrpc': '2.0', 'id': 1, 'method': 'patch_list',
+                'params': [{}]}
+        response = self.post(data, HTTP_ACCEPT_ENCODING = 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj = StringIO(response.content)).read()
+        self.assertEqual(len(json.loads(content)['result']), 2)
+
+@unittest.skipUnless(settings.ENABLE_XMLRPC,
+        "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
+class XMLRPCAuthTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        (self.api_token, self.token) = APIToken.create_token(self.user)
+
+    def requestUser(self, auth):
+        from patchwork.views.xmlrpc import dispatcher
+        request = RequestFactory().post('/xmlrpc/',
+                HTTP_AUTHORIZATION = auth)
+        return dispatcher._user_for_request(request)
+
+    def basicUser(self, username, password):
+        return self.requestUser('Basic ' +
+                base64.encodestring('%s:%s' % (username, password)).strip())
+
+    def testPassword(self):
+        self.assertEqual(self.basicUser(self.user.username,
+                                        self.user.username), self.user)
+
+    def testWrongPassword(self):
+        self.assertEqual(self.basicUser(self.user.username, 'wrong'), None)
+        self.assertEqual(get_verified_credentials(self.user.username,
+                                                  'wrong'), None)
+
+    def testTokenHeader(self):
+        self.assertEqual(self.requestUser('Token ' + self.token), self.user)
+
+    def testTokenAsPassword(self):
+        self.assertEqual(self.basicUser(self.user.username, self.token),
+                         self.user)
+
+    def testTokenOtherUser(self):
+        other = create_user()
+        self.assertEqual(self.basicUser(other.username, self.token), None)
+
+    def testDeletedToken(self):
+        self.api_token.delete()
+        self.assertEqual(self.requestUser('Token ' + self.token), None)
+
+    def testInactiveUserToken(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.requestUser('Token ' + self.token), None)
+
+    def testCachedPassword(self):
+        self.basicUser(self.user.username, self.user.username)
+        self.assertNotEqual(get_verified_credentials(self.user.username,
+                                                     self.user.username),
+                            None)
+        # the cached credentials need a single query to fetch the user
+        with self.assertNumQueries(1):
+            self.assertEqual(self.basicUser(self.user.username,
+                                            self.user.username), self.user)
+
+    def testCachedPasswordChanged(self):
+        self.basicUser(self.user.username, self.user.username)
+        self.user.set_password('newpassword')
+        self.user.save()
+        self.assertEqual(self.basicUser(self.user.username,
+                                        self.user.username), None)
+        self.assertEqual(self.basicUser(self.user.username, 'newpassword'),
+                         self.user)
+
+    @override_settings(XMLRPC_AUTH_CACHE_TIMEOUT = 0)
+    def testCacheDisabled(self):
+        self.basicUser(self.user.username, self.user.username)
+        self.assertEqual(get_verified_credentials(self.user.username,
+                                                  self.user.username), None)
+
+@unittest.skipUnless(settings.ENABLE_XMLRPC,
+        "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
+class XMLRPCQueryCountTest(TestCase):
+    """Check that the number of queries made by each method doesn't
+       depend on the number of objects returned"""
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        self.user = create_user()
+        self.submitter = Person.objects.get(user = self.user)
+        self.patch = self.addPatch()
+
+    def addPatch(self):
+        n = Patch.objects.count()
+        patch = Patch(project = defaults.project, submitter = self.submitter,
+                delegate = self.user, msgid = 'testpatch%d' % n,
+                name = 'testpatch%d' % n, content = defaults.patch)
+        patch.save()
+        self.addCheck(patch)
+        return patch
+
+    def addCheck(self, patch):
+        Check(patch = patch, user = self.user,
+              target_url = 'http://example.com/', description = 'test check',
+              context = 'context%d' % Check.objects.count()).save()
+
+    def countQueries(self, fn, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            # marshal the result too, in case that makes any queries
+            xmlrpclib.dumps((fn(*args),), methodresponse = 1)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, grow, fn, *args):
+        before = self.countQueries(fn, *args)
+        for i in range(3):
+            grow()
+        self.assertEqual(self.countQueries(fn, *args), before)
+
+    def testPatchList(self):
+        from patchwork.views import xmlrpc
+        self.assertConstantQueries(self.addPatch, xmlrpc.patch_list, {})
+
+    def testPatchListFiltered(self):
+        from patchwork.views import xmlrpc
+        self.assertConstantQueries(self.addPatch, xmlrpc.patch_list,
+                {'project_id': defaults.project.id,
+                 'submitter_id': self.submitter.id})
+
+    def testPatchGet(self):
+        from patchwork.views import xmlrpc
+        self.assertEqual(self.countQueries(xmlrpc.patch_get, self.patch.id),
+                         1)
+
+    def testPatchGetMany(self):
+        from patchwork.views import xmlrpc
+        ids = lambda: list(Patch.objects.values_list('id', flat = True))
+        before = self.countQueries(xmlrpc.patch_get_many, ids())
+        for i in range(3):
+            self.addPatch()
+        self.assertEqual(self.countQueries(xmlrpc.patch_get_many, ids()),
+                         before)
+
+    def testPatchGetMboxMany(self):
+        from patchwork.views import xmlrpc
+        ids = lambda: list(Patch.objects.values_list('id', flat = True))
+        before = self.countQueries(xmlrpc.patch_get_mbox_many, ids())
+        for i in range(3):
+            self.addPatch()
+        self.assertEqual(
+                self.countQueries(xmlrpc.patch_get_mbox_many, ids()),
+                before)
+
+    def testPersonList(self):
+        from patchwork.views import xmlrpc
+        grow = lambda: create_user()
+        self.assertConstantQueries(grow, xmlrpc.person_list)
+
+    def testCheckList(self):
+        from patchwork.views import xmlrpc
+        self.assertConstantQueries(self.addPatch, xmlrpc.check_list, {})
+
+    def testCheckGet(self):
+        from patchwork.views import xmlrpc
+        check = Check.objects.all()[0]
+        self.assertEqual(self.countQueries(xmlrpc.check_get, check.id), 1)
+
+    def testChangeList(self):
+        from patchwork.views import xmlrpc
+        self.assertConstantQueries(self.addPatch, xmlrpc.change_list, 0)
+
+    def testChangeListSince(self):
+        from patchwork.views import xmlrpc
+        since = Check.objects.get(patch = self.patch).change_seq
+        patch = self.addPatch()
+        changes = xmlrpc.change_list(since)
+        self.assertEqual([p['id'] for p in changes['patches']], [patch.id])
+        self.assertEqual([c['patch_id'] for c in changes['checks']],
+                         [patch.id])
+        self.assertEqual(changes['seq'], changes['checks'][0]['change_seq'])
+
+    def testPatchIdsByHash(self):
+        from patchwork.views import xmlrpc
+        hashes = lambda: list(Patch.objects.values_list('hash', flat = True))
+        before = self.countQueries(xmlrpc.patch_ids_by_hash, hashes())
+        for i in range(3):
+            self.addPatch()
+        self.assertEqual(
+                self.countQueries(xmlrpc.patch_ids_by_hash, hashes()), before)
+        self.assertEqual(before, 1)
+
+    def testPatchCheckGet(self):
+        from patchwork.views import xmlrpc
+        grow = lambda: self.addCheck(self.patch)
+        self.assertConstantQueries(grow, xmlrpc.patch_check_get,
+                                   self.patch.id)
+
+@unittest.skipUnless(settings.ENABLE_XMLRPC,
+        "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
+class XMLRPCBatchTest(LiveServerTestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        defaults.project.save()
+        defaults.patch_author_person.save()
+        self.user = create_maintainer(defaults.project)
+        self.patches = []
+        for i in range(3):
+            patch = Patch(project = defaults.project,
+                    submitter = defaults.patch_author_person,
+                    msgid = 'testpatch%d' % i, name = 'testpatch%d' % i,
+                    content = defaults.patch)
+            patch.save()
+            self.patches.append(patch)
+        self.ids = [patch.id for patch in self.patches]
+
+        url = self.live_server_url.replace('://', '://%s:%s@' %
+                (self.user.username, self.user.username))
+        self.rpc = xmlrpclib.Server(url +
+                reverse('patchwork.views.xmlrpc.xmlrpc'))
+
+    def testMulticall(self):
+        multicall = xmlrpclib.MultiCall(self.rpc)
+        multicall.patch_get(self.ids[0])
+        multicall.patch_get_mbox(0)
+        multicall.patch_set(self.ids[1], {'archived': True})
+        multicall.no_such_method()
+        results = multicall()
+
+        self.assertEqual(results[0]['id'], self.ids[0])
+        self.assertEqual(results[1], '')
+        self.assertEqual(results[2], True)
+        self.assertRaises(xmlrpclib.Fault, lambda: results[3])
+        self.assertTrue(Patch.objects.get(id = self.ids[1]).archived)
+
+    def testPatchGetMany(self):
+        patches = self.rpc.patch_get_many([self.ids[2], 0, self.ids[0]])
+        self.assertEqual(patches[0]['id'], self.ids[2])
+        self.assertEqual(patches[1], {})
+        self.assertEqual(patches[2]['id'], self.ids[0])
+
+    @override_settings(XMLRPC_MAX_PAGE_SIZE = 2)
+    def testPatchGetManyLimit(self):
+        self.assertRaises(xmlrpclib.Fault, self.rpc.patch_get_many, self.ids)
+
+    def testPatchGetMboxMany(self):
+        mboxes = self.rpc.patch_get_mbox_many([self.ids[1], 0])
+        self.assertEqual(mboxes[0], self.rpc.patch_get_mbox(self.ids[1]))
+        self.assertEqual(mboxes[1], '')
+
+    def testPatchSetMany(self):
+        state = State.objects.exclude(id = self.patches[0].state_id)[0]
+        self.assertTrue(self.rpc.patch_set_many(self.ids[:2],
+                {'state': state.id, 'archived': True}))
+        for patch in Patch.objects.filter(id__in = self.ids[:2]):
+            self.assertEqual(patch.state, state)
+            self.assertTrue(patch.archived)
+        self.assertFalse(Patch.objects.get(id = self.ids[2]).archived)
+
+    def testPatchSetManyNotEditable(self):
+        patch = Patch(project = defaults.project,
+                submitter = defaults.patch_author_person,
+                msgid = 'otherpatch', name = 'otherpatch', content = '')
+        patch.save()
+        self.user.profile.maintainer_projects.clear()
+        self.assertRaises(xmlrpclib.Fault, self.rpc.patch_set_many,
+                self.ids, {'archived': True})
+        self.assertFalse(Patch.objects.filter(archived = True).exists())
+
+    def testPatchSetManyMissing(self):
+        self.assertRaises(xmlrpclib.Fault, self.rpc.patch_set_many,
+                self.ids + [0], {'archived': True})
+        self.assertFalse(Patch.objects.filter(archived = True).exists())
+
+    def testCheckCreateMany(self):
+        self.assertTrue(self.rpc.check_create_many([
+            {'patch_id': self.ids[0], 'state': 'success', 'context': 'a'},
+            {'patch_id': self.ids[1], 'state': 'fail',
+             'target_url': 'http://example.com/'},
+        ]))
+        checks = Check.objects.order_by('id')
+        self.assertEqual([(c.patch_id, c.state, c.context, c.user)
+                          for c in checks],
+                [(self.ids[0], Check.STATE_SUCCESS, 'a', self.user),
+                 (self.ids[1], Check.STATE_FAIL, 'default', self.user)])
+
+    def testPatchIdsByHash(self):
+        hashes = ['%040x' % i for i in range(3)]
+        for (patch, hash) in zip(self.patches, hashes):
+            Patch.objects.filter(id = patch.id).update(hash = hash)
+        self.assertEqual(self.rpc.patch_ids_by_hash(hashes[:2] + ['f' * 40]),
+                         dict(zip(hashes[:2], self.ids[:2])))
+        self.assertEqual(self.rpc.patch_ids_by_hash(hashes,
+                         defaults.project.linkname), dict(zip(hashes, self.ids)))
+        self.assertEqual(self.rpc.patch_ids_by_hash(hashes, 'other'), {})
+
+    def testPatchIdsByHashDuplicate(self):
+        hash = self.patches[0].hash
+        self.assertEqual(self.rpc.patch_ids_by_hash([hash]),
+                         {hash: self.ids[0]})
+
+    def testCheckCreateManyInvalid(self):
+        self.assertRaises(xmlrpclib.Fault, self.rpc.check_create_many, [
+            {'patch_id': self.ids[0], 'state': 'success'},
+            {'patch_id': self.ids[1], 'state': 'bogus'},
+        ])
+        self.assertEqual(Check.objects.count(), 0)
+
+@unittest.skipUnless(settings.ENABLE_XMLRPC,
+        "requires xmlrpc interface (use the ENABLE_XMLRPC setting)")
+class XMLRPCBundleTest(LiveServerTestCase):
+    fixtures = ['default_states']
+
+    def setUp(self):
+        self.user = create_user()
+        defaults.project.save()
+        self.bundle = Bundle(owner = self.user, project = defaults.project,
+                name = 'testbundle')
+        self.bundle.save()
+        self.patches = []
+        for i in range(3):
+            patch = Patch(project = defaults.project,
+                    submitter = Person.objects.get(user = self.user),
+                    msgid = 'testpatch%d' % i, name = 'testpatch%d' % i,
+                    content = '')
+            patch.save()
+            self.patches.append(patch)
+
+        url = self.live_server_url.replace('://', '://%s:%s@' %
+                (self.user.username, self.user.username))
+        self.rpc = xmlrpclib.Server(url +
+                reverse('patchwork.views.xmlrpc.xmlrpc'))
+
+    def bundlePatchIds(self):
+        return [bp.patch_id for bp in
+                BundlePatch.objects.filter(bundle = self.bundle)]
+
+    def testAddPatches(self):
+        ids = [self.patches[2].id, self.patches[0].id]
+        self.assertTrue(self.rpc.bundle_update_patches(self.bundle.id, ids))
+        self.assertEqual(self.bundlePatchIds(), ids)
+
+    def testAddAndRemovePatches(self):
+        self.bundle.add_patches(self.patches[:2])
+        self.rpc.bundle_update_patches(self.bundle.id,
+                [self.patches[2].id], [self.patches[0].id])
+        self.assertEqual(self.bundlePatchIds(),
+                [self.patches[1].id, self.patches[2].id])
+
+    def testOtherUsersBundle(self):
+        bundle = Bundle(owner = create_user(), project = defaults.project,
+                name = 'otherbundle')
+        bundle.save()
+        self.assertRaises(xmlrpclib.Fault, self.rpc.bundle_update_patches,
+                bundle.id, [self.patches[0].id])
+        self.assertEqual(bundle.patches.count(), 0)
@@ -29,12 +29,18 @@ urlpatterns = patterns('',
 
     (r'^$', 'patchwork.views.projects'),
     (r'^project/(?P<project_id>[^/]+)/list/$', 'patchwork.views.patch.list'),
+    (r'^project/(?P<project_id>[^/]+)/list/mbox/$',
+        'patchwork.views.patch.list_mbox'),
+    (r'^project/(?P<project_id>[^/]+)/changes/$',
+        'patchwork.views.patch.changes'),
     (r'^project/(?P<project_id>[^/]+)/$', 'patchwork.views.project.project'),
 
     # patch views
     (r'^patch/(?P<patch_id>\d+)/$', 'patchwork.views.patch.patch'),
     (r'^patch/(?P<patch_id>\d+)/raw/$', 'patchwork.views.patch.content'),
     (r'^patch/(?P<patch_id>\d+)/mbox/$', 'patchwork.views.patch.mbox'),
+    (r'^patch/(?P<patch_id>\d+)/files/(?P<index>\d+)/$',
+        'patchwork.views.patch.file'),
 
     # logged-in user stuff
     (r'^user/$', 'patchwork.views.user.profile'),
@@ -47,6 +53,10 @@ urlpatterns = patterns('',
     (r'^user/link/$', 'patchwork.views.user.link'),
     (r'^user/unlink/(?P<person_id>[^/]+)/$', 'patchwork.views.user.unlink'),
 
+    (r'^user/tokens/new/$', 'patchwork.views.user.token_create'),
+    (r'^user/tokens/(?P<token_id>[^/]+)/delete/$',
+        'patchwork.views.user.token_delete'),
+
     # password change
     url(r'^user/password-change/$', auth_views.password_change,
             name='password_change'),
@@ -80,6 +90,8 @@ urlpatterns = patterns('',
                                 'patchwork.views.bundle.bundle'),
     (r'^bundle/(?P<username>[^/]*)/(?P<bundlename>[^/]*)/mbox/$',
                                 'patchwork.views.bundle.mbox'),
+    (r'^bundle/(?P<username>[^/]*)/(?P<bundlename>[^/]*)/reorder/$',
+                                'patchwork.views.bundle.reorder'),
 
     (r'^confirm/(?P<key>[0-9a-f]+)/$', 'patchwork.views.confirm'),
 
@@ -98,6 +110,7 @@ urlpatterns = patterns('',
 if settings.ENABLE_XMLRPC:
     urlpatterns += patterns('',
         (r'xmlrpc/$', 'patchwork.views.xmlrpc.xmlrpc'),
+        (r'^jsonrpc/$', 'patchwork.views.xmlrpc.jsonrpc'),
         (r'^pwclient/$', 'patchwork.views.pwclient'),
         (r'^project/(?P<project_id>[^/]+)/pwclientrc/$',
              'patchwork.views.pwclientrc'),
@@ -18,14 +18,17 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
+import collections
 import itertools
 import datetime
+import threading
+import time
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 from django.db.models import Max, Q, F
 from django.db.utils import IntegrityError
 from patchwork.models import Bundle, Project, BundlePatch, UserProfile, \
@@ -145,32 +148,163 @@ def set_bundle(user, project, action, data, patches, context):
     if not bundle:
         return ['no such bundle']
 
-    for patch in patches:
-        if action == 'create' or action == 'add':
-            bundlepatch_count = BundlePatch.objects.filter(bundle = bundle,
-                        patch = patch).count()
-            if bundlepatch_count == 0:
-                bundle.append_patch(patch)
+    if action == 'create' or action == 'add':
+        patches = list(patches)
+        added = set([patch.id for patch in bundle.add_patches(patches)])
+        for patch in patches:
+            if patch.id in added:
                 context.add_message("Patch '%s' added to bundle %s" % \
                         (patch.name, bundle.name))
             else:
                 context.add_message("Patch '%s' already in bundle %s" % \
                         (patch.name, bundle.name))
 
-        elif action == 'remove':
-            try:
-                bp = BundlePatch.objects.get(bundle = bundle, patch = patch)
-                bp.delete()
-                context.add_message("Patch '%s' removed from bundle %s\n" % \
-                        (patch.name, bundle.name))
-            except Exception:
-                pass
-
-    bundle.save()
+    elif action == 'remove':
+        for patch in bundle.remove_patches(patches):
+            context.add_message("Patch '%s' removed from bundle %s\n" % \
+                    (patch.name, bundle.name))
 
     return []
 
-def send_notifications():
+def _notification_message(site, recipient, notifications):
+    projects = set([n.patch.project.linkname for n in notifications])
+
+    context = {
+        'site': site,
+        'person': recipient,
+        'notifications': notifications,
+        'projects': projects,
+    }
+
+    subject = render_to_string(
+                    'patchwork/patch-change-notification-subject.text',
+                    context).strip()
+    content = render_to_string('patchwork/patch-change-notification.mail',
+                            context)
+
+    return EmailMessage(subject = subject, body = content,
+                        from_email = settings.NOTIFICATION_FROM_EMAIL,
+                        to = [recipient.email],
+                        headers = {'Precedence': 'bulk'})
+
+def _send_notification(connection, message):
+    # reconnects if the previous message failed
+    connection.open()
+    try:
+        connection.send_messages([message])
+    except Exception:
+        connection.close()
+        raise
+
+def _delete_sent_notifications(batch, errors):
+    failed = set([recipient.id for (recipient, ex) in errors])
+    pks = [n.pk for (recipient, notifications, message) in batch
+           if recipient.id not in failed for n in notifications]
+    PatchChangeNotification.objects.filter(pk__in = pks).delete()
+
+def _send_notification_batch(connection, batch):
+    """Send a batch of (recipient, notifications, message) tuples over a
+    single connection, and delete the notifications that were sent.
+
+    Messages are sent one at a time, so that errors can be attributed to
+    their recipients. Returns a tuple of the number of messages sent and
+    a list of (recipient, exception) tuples for those that failed."""
+    errors = []
+
+    try:
+        for (recipient, notifications, message) in batch:
+            try:
+                _send_notification(connection, message)
+            except Exception, ex:
+                errors.append((recipient, ex))
+    finally:
+        connection.close()
+
+    _delete_sent_notifications(batch, errors)
+
+    return (len(batch) - len(errors), errors)
+
+def _email_domain(email):
+    return email.rsplit('@', 1)[-1].lower()
+
+def _deliver_notification_batch(batch):
+    """Send a batch of notification emails as _send_notification_batch
+    does, but from a pool of NOTIFICATION_DELIVERY_THREADS threads.
+
+    Each thread uses its own connection, reconnecting after every
+    NOTIFICATION_BATCH_SIZE messages. No more than
+    NOTIFICATION_DOMAIN_CONCURRENCY messages to any one domain are sent
+    at a time, so that a slow mail server only holds up its own
+    recipients' messages. The threads only send mail; notifications are
+    deleted by the calling thread once they are done."""
+    pending = collections.OrderedDict()
+    for item in batch:
+        pending.setdefault(_email_domain(item[0].email), []).append(item)
+
+    active = collections.Counter()
+    errors = []
+    cond = threading.Condition()
+
+    def next_item():
+        limit = settings.NOTIFICATION_DOMAIN_CONCURRENCY
+        with cond:
+            while pending:
+                for (domain, items) in pending.items():
+                    if active[domain] < limit:
+                        active[domain] += 1
+                        if len(items) == 1:
+                            del pending[domain]
+                        return (domain, items.pop(0))
+                cond.wait()
+            return (None, None)
+
+    def worker():
+        connection = get_connection()
+        n_sent = 0
+        try:
+            while True:
+                (domain, item) = next_item()
+                if item is None:
+                    break
+
+                if n_sent == settings.NOTIFICATION_BATCH_SIZE:
+                    connection.close()
+                    n_sent = 0
+
+                (recipient, notifications, message) = item
+                error = None
+                try:
+                    _send_notification(connection, message)
+                    n_sent += 1
+                except Exception, ex:
+                    error = (recipient, ex)
+
+                with cond:
+                    active[domain] -= 1
+                    if error:
+                        errors.append(error)
+                    cond.notify_all()
+        finally:
+            connection.close()
+
+    n_threads = min(settings.NOTIFICATION_DELIVERY_THREADS, len(batch))
+    threads = [threading.Thread(target = worker) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    _delete_sent_notifications(batch, errors)
+
+    return (len(batch) - len(errors), errors)
+
+def send_notifications(stats = None):
+    """Send emails for notifications that are ready to go out, returning
+    a list of (recipient, exception) tuples for any that failed.
+
+    If stats is a dict, the number of emails sent, the number of
+    notifications processed and the time taken are stored in it."""
+    start = time.time()
     date_limit = datetime.datetime.now() - \
                      datetime.timedelta(minutes =
                                 settings.NOTIFICATION_DELAY_MINUTES)
@@ -181,52 +315,67 @@ def send_notifications():
     # Person -> Patch -> max(PCN.last_modified)), filtering out any maxima
     # that are with the date_limit.
     qs = PatchChangeNotification.objects \
-            .annotate(m = Max('patch__submitter__patch__patchchangenotification'
-                        '__last_modified')) \
-                .filter(m__lt = date_limit)
-
-    groups = itertools.groupby(qs.order_by('patch__submitter'),
-                               lambda n: n.patch.submitter)
+            .annotate(m = Max('patch__submitter__patch__'
+                              'patchchangenotification__last_modified')) \
+                .filter(m__lt = date_limit) \
+                .select_related('patch__submitter', 'patch__project',
+                                'patch__state', 'orig_state')
+
+    groups = itertools.groupby(qs.order_by('patch__submitter', 'patch'),
+                               lambda n: n.patch.submitter_id)
+
+    optouts = set([email.lower() for email in
+                   EmailOptout.objects.values_list('email', flat = True)])
+    site = Site.objects.get_current()
+
+    if settings.NOTIFICATION_DELIVERY_THREADS > 1:
+        deliver = _deliver_notification_batch
+        batch_size = settings.NOTIFICATION_BATCH_SIZE * \
+                        settings.NOTIFICATION_DELIVERY_THREADS
+    else:
+        connection = get_connection()
+
+        def deliver(batch):
+            return _send_notification_batch(connection, batch)
+        batch_size = settings.NOTIFICATION_BATCH_SIZE
 
     errors = []
+    n_sent = n_notifications = 0
+    optout_pks = []
+    batch = []
 
-    for (recipient, notifications) in groups:
+    for (_, notifications) in groups:
         notifications = list(notifications)
-        projects = set([ n.patch.project.linkname for n in notifications ])
+        recipient = notifications[0].patch.submitter
+        n_notifications += len(notifications)
 
-        def delete_notifications():
-            pks = [ n.pk for n in notifications ]
-            PatchChangeNotification.objects.filter(pk__in = pks).delete()
-
-        if EmailOptout.is_optout(recipient.email):
-            delete_notifications()
+        if recipient.email.lower().strip() in optouts:
+            optout_pks.extend([n.pk for n in notifications])
             continue
 
-        context = {
-            'site': Site.objects.get_current(),
-            'person': recipient,
-            'notifications': notifications,
-            'projects': projects,
-        }
+        batch.append((recipient, notifications,
+                      _notification_message(site, recipient, notifications)))
 
-        subject = render_to_string(
-                        'patchwork/patch-change-notification-subject.text',
-                        context).strip()
-        content = render_to_string('patchwork/patch-change-notification.mail',
-                                context)
+        if len(batch) >= batch_size:
+            (sent, batch_errors) = deliver(batch)
+            n_sent += sent
+            errors.extend(batch_errors)
+            batch = []
 
-        message = EmailMessage(subject = subject, body = content,
-                               from_email = settings.NOTIFICATION_FROM_EMAIL,
-                               to = [recipient.email],
-                               headers = {'Precedence': 'bulk'})
+    if batch:
+        (sent, batch_errors) = deliver(batch)
+        n_sent += sent
+        errors.extend(batch_errors)
 
-        try:
-            message.send()
-        except ex:
-            errors.append((recipient, ex))
-            continue
+    if optout_pks:
+        PatchChangeNotification.objects.filter(pk__in = optout_pks).delete()
 
-        delete_notifications()
+    if stats is not None:
+        stats.update({
+            'sent': n_sent,
+            'notifications': n_notifications,
+            'time': time.time() - start,
+        })
 
     return errors
 
@@ -248,5 +397,25 @@ def do_expiry():
     # delete users
     users.delete()
 
+def compact_bundles():
+    """Renumber the patches of any bundles where the gaps between order
+    keys have become too small to move patches between them. Returns the
+    number of bundles compacted."""
+    bundle_ids = set()
+    last_bundle_id = last_order = None
+
+    orders = BundlePatch.objects.order_by('bundle', 'order') \
+                .values_list('bundle_id', 'order')
+    for (bundle_id, order) in orders.iterator():
+        if bundle_id == last_bundle_id and \
+                order - last_order < BundlePatch.MIN_ORDER_GAP:
+            bundle_ids.add(bundle_id)
+        last_bundle_id, last_order = bundle_id, order
+
+    for bundle in Bundle.objects.filter(id__in = bundle_ids):
+        bundle.compact_order()
+
+    return len(bundle_ids)
+
 
 
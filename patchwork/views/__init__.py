@@ -20,11 +20,16 @@
 
 from base import *
 from patchwork.utils import Order, get_patch_ids, bundle_actions, set_bundle
+from patchwork.cache import get_patch_mboxes, patch_list_count
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
 from patchwork.paginator import Paginator
 from patchwork.forms import MultiplePatchForm
-from patchwork.models import Comment
+from patchwork.models import Comment, Patch, Person
 import re
 import datetime
+import operator
 
 from email.mime.nonmultipart import MIMENonMultipart
 from email.encoders import encode_7or8bit
@@ -32,6 +37,22 @@ from email.parser import HeaderParser
 from email.header import Header
 import email.utils
 
+def filter_patches(filters, patches, order, explicit_order,
+        editable_order = False):
+    """Apply the list filters and ordering to a queryset of patches"""
+    patches = filters.apply(patches)
+
+    # order search results by relevance, unless the user has asked for
+    # a specific order
+    search_filter = filters.search_filter()
+    if search_filter and search_filter.ranked() and not explicit_order \
+            and not editable_order:
+        patches = search_filter.rank(patches)
+    elif not editable_order:
+        patches = order.apply(patches)
+
+    return patches
+
 def generic_list(request, project, view,
         view_args = {}, filter_settings = [], patches = None,
         editable_order = False):
@@ -47,6 +68,7 @@ def generic_list(request, project, view,
     elif request.method == 'POST':
         data = request.POST
     order = Order(data.get('order'), editable=editable_order)
+    explicit_order = bool(data.get('order'))
 
     # Explicitly set data to None because request.POST will be an empty dict
     # when the form is not submitted, but passing a non-None data argument to
@@ -102,9 +124,8 @@ def generic_list(request, project, view,
     # annotate with tag counts
     patches = patches.with_tag_counts(project)
 
-    patches = context.filters.apply(patches)
-    if not editable_order:
-        patches = order.apply(patches)
+    patches = filter_patches(context.filters, patches, order,
+                             explicit_order, editable_order)
 
     # we don't need the content or headers for a list; they're text fields
     # that can potentially contain a lot of data
@@ -114,7 +135,16 @@ def generic_list(request, project, view,
     # rendering the list template
     patches = patches.select_related('state', 'submitter', 'delegate')
 
-    paginator = Paginator(request, patches)
+    # ... and the checks, for the check counts
+    patches = patches.prefetch_related('check_set')
+
+    # counts are cached per filter state. For the default view of a
+    # project, we may also serve an approximate count if configured to.
+    approximate = settings.APPROXIMATE_PATCH_COUNTS and \
+        not context.filters.params()
+    count = patch_list_count(project, patches, approximate = approximate)
+
+    paginator = Paginator(request, patches, count = count)
 
     context.update({
             'page':             paginator.current_page,
@@ -131,19 +161,17 @@ def process_multiplepatch_form(form, user, action, patches, context):
     if not form.is_valid() or action != form.action:
         return ['The submitted form data was invalid']
 
-    if len(patches) == 0:
+    if not patches.exists():
         context.add_message("No patches selected; nothing updated")
         return errors
 
-    changed_patches = 0
-    for patch in patches:
-        if not patch.is_editable(user):
-            errors.append("You don't have permissions to edit patch '%s'"
-                            % patch.name)
-            continue
+    editable = patches.editable(user)
+    for name in patches.exclude(id__in = editable.values('id')) \
+            .values_list('name', flat = True):
+        errors.append("You don't have permissions to edit patch '%s'"
+                        % name)
 
-        changed_patches += 1
-        form.save(patch)
+    changed_patches = editable.update_patches(**form.changes())
 
     if changed_patches == 1:
         context.add_message("1 patch updated")
@@ -162,20 +190,16 @@ class PatchMbox(MIMENonMultipart):
         self.set_payload(_text.encode(self.patch_charset))
         encode_7or8bit(self)
 
-def patch_to_mbox(patch):
-    postscript_re = re.compile('\n-{2,3} ?\n')
-
-    comment = None
-    try:
-        comment = Comment.objects.get(patch = patch, msgid = patch.msgid)
-    except Exception:
-        pass
+_postscript_re = re.compile('\n-{2,3} ?\n')
+_header_parser = HeaderParser()
+_copied_headers = ['To', 'Cc', 'Date']
 
+def _patch_mbox(patch, submitter, commit_message, responses):
     body = ''
-    if comment:
-        body = comment.content.strip() + "\n"
+    if commit_message is not None:
+        body = commit_message.strip() + "\n"
 
-    parts = postscript_re.split(body, 1)
+    parts = _postscript_re.split(body, 1)
     if len(parts) == 2:
         (body, postscript) = parts
         body = body.strip() + "\n"
@@ -183,9 +207,7 @@ def patch_to_mbox(patch):
     else:
         postscript = ''
 
-    for comment in Comment.objects.filter(patch = patch) \
-            .exclude(msgid = patch.msgid):
-        body += comment.patch_responses()
+    body += ''.join(responses)
 
     if postscript:
         body += '---\n' + postscript + '\n'
@@ -199,16 +221,14 @@ def patch_to_mbox(patch):
     mail = PatchMbox(body)
     mail['Subject'] = patch.name
     mail['From'] = email.utils.formataddr((
-                    str(Header(patch.submitter.name, mail.patch_charset)),
-                    patch.submitter.email))
+                    str(Header(submitter.name, mail.patch_charset)),
+                    submitter.email))
     mail['X-Patchwork-Id'] = str(patch.id)
     mail['Message-Id'] = patch.msgid
     mail.set_unixfrom('From patchwork ' + patch.date.ctime())
 
-
-    copied_headers = ['To', 'Cc', 'Date']
-    orig_headers = HeaderParser().parsestr(str(patch.headers))
-    for header in copied_headers:
+    orig_headers = _header_parser.parsestr(str(patch.headers))
+    for header in _copied_headers:
         if header in orig_headers:
             mail[header] = orig_headers[header]
 
@@ -216,3 +236,124 @@ def patch_to_mbox(patch):
         mail['Date'] = email.utils.formatdate(utc_timestamp)
 
     return mail
+
+def patch_mboxes(patches):
+    """Return a list of mbox messages for a list (or queryset) of
+    patches, in the same order.
+
+    The patches' submitters, commit messages and responses are loaded
+    with a fixed number of queries, regardless of the number of patches.
+    """
+    patches = [patch for patch in patches]
+    if not patches:
+        return []
+
+    submitters = Person.objects.in_bulk(
+            set([patch.submitter_id for patch in patches]))
+
+    msgids = dict([(patch.id, patch.msgid) for patch in patches])
+    commit_messages = {}
+    responses = dict([(patch.id, []) for patch in patches])
+
+    comments = Comment.objects.filter(patch__in = msgids.keys()) \
+            .values_list('patch_id', 'msgid', 'content')
+    for (patch_id, msgid, content) in comments:
+        if msgid == msgids[patch_id]:
+            commit_messages.setdefault(patch_id, content)
+        else:
+            responses[patch_id].extend(
+                    [match.group(0) + '\n' for match in
+                     Comment.response_re.finditer(content)])
+
+    return [_patch_mbox(patch, submitters[patch.submitter_id],
+                        commit_messages.get(patch.id), responses[patch.id])
+            for patch in patches]
+
+def patch_to_mbox(patch):
+    return patch_mboxes([patch])[0]
+
+def patch_mbox_strings(patches):
+    """Return a list of the mbox text for a list of patches, using
+    cached text where possible."""
+    return get_patch_mboxes(patches,
+            lambda patches: [mail.as_string(True)
+                             for mail in patch_mboxes(patches)])
+
+# number of patches fetched at a time by patches_to_mbox
+MBOX_CHUNK_SIZE = 100
+
+def _keyset_ordering(patches):
+    """Return the ordering of a queryset of patches, as a list of
+    (field, descending) pairs ending with the (unique) patch ID."""
+    query = patches.query
+    ordering = query.order_by or \
+            (query.default_ordering and patches.model._meta.ordering) or []
+
+    keys = []
+    for field in ordering:
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        if field in ['id', 'pk']:
+            return keys + [('id', descending)]
+        keys.append((field, descending))
+    return keys + [('id', False)]
+
+def _keyset_after(keys, values):
+    """Return a Q object matching the objects which come after the object
+    with the given values of keys, a list of (name, descending) pairs."""
+    nulls_largest = connection.features.nulls_order_largest
+    conditions = []
+    equal = Q()
+    for ((name, descending), value) in zip(keys, values):
+        if value is None:
+            if nulls_largest == descending:
+                conditions.append(equal & Q(**{name + '__isnull': False}))
+            equal &= Q(**{name + '__isnull': True})
+            continue
+
+        after = Q(**{name + ('__lt' if descending else '__gt'): value})
+        if nulls_largest != descending:
+            after |= Q(**{name + '__isnull': True})
+        conditions.append(equal & after)
+        equal &= Q(**{name: value})
+
+    return reduce(operator.or_, conditions)
+
+def patches_to_mbox(patches):
+    """Generate an mbox of patches, one message at a time.
+
+    patches is an ordered queryset of patches. These are fetched in
+    chunks of MBOX_CHUNK_SIZE (see patch_mbox_strings), so memory use
+    doesn't grow with the number of patches. Chunks are paged by the
+    values of the ordering keys (with the patch ID as a tiebreaker)
+    rather than by offset, so patches added or changed while the mbox
+    is being sent don't cause others to be skipped or repeated.
+    """
+    # annotate the patches with the values of the ordering keys, so that
+    # they can be compared using the same joins as the ordering
+    ordering = _keyset_ordering(patches)
+    keys = [('mbox_key_%d' % i, descending)
+            for (i, (_, descending)) in enumerate(ordering)]
+    patches = patches.annotate(**dict(
+            [(name, F(field)) for ((name, _), (field, _))
+             in zip(keys, ordering)])) \
+            .order_by(*[('-' if descending else '') + name
+                        for (name, descending) in keys])
+
+    chunk_patches = patches
+    first = True
+    while True:
+        chunk = list(chunk_patches[:MBOX_CHUNK_SIZE])
+
+        for mbox in patch_mbox_strings(chunk):
+            if not first:
+                yield '\n'
+            first = False
+            yield mbox
+
+        if len(chunk) < MBOX_CHUNK_SIZE:
+            break
+
+        last = chunk[-1]
+        chunk_patches = patches.filter(_keyset_after(keys,
+                [getattr(last, name) for (name, _) in keys]))
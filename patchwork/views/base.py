@@ -19,20 +19,23 @@
 
 import json
 
-from patchwork.models import Patch, Project, Person, EmailConfirmation
+from patchwork.models import Project, EmailConfirmation, normalise_search
+from patchwork.cache import get_person_completions
 from django.shortcuts import render_to_response, get_object_or_404
 from django.http import HttpResponse, HttpResponseRedirect, Http404
 from patchwork.requestcontext import PatchworkRequestContext
 from django.core import urlresolvers
 from django.template.loader import render_to_string
 from django.conf import settings
-from django.db.models import Q
+
+SUBMITTER_COMPLETE_DEFAULT_LIMIT = 20
+SUBMITTER_COMPLETE_MAX_LIMIT = 100
 
 def projects(request):
     context = PatchworkRequestContext(request)
-    projects = Project.objects.all()
+    projects = context.projects
 
-    if projects.count() == 1:
+    if len(projects) == 1:
         return HttpResponseRedirect(
                 urlresolvers.reverse('patchwork.views.patch.list',
                     kwargs = {'project_id': projects[0].linkname}))
@@ -86,25 +89,23 @@ def confirm(request, key):
     return render_to_response('patchwork/confirm-error.html', context)
 
 def submitter_complete(request):
-    search = request.GET.get('q', '')
+    search = normalise_search(request.GET.get('q', ''))
     limit = request.GET.get('l', None)
 
     if len(search) <= 3:
         return HttpResponse(content_type="application/json")
 
-    queryset = Person.objects.filter(Q(name__icontains = search) |
-                                     Q(email__icontains = search))
-    if limit is not None:
-        try:
-            limit = int(limit)
-        except ValueError:
-            limit = None
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        limit = None
 
-    if limit is not None and limit > 0:
-            queryset = queryset[:limit]
+    if limit is None or limit <= 0:
+        limit = SUBMITTER_COMPLETE_DEFAULT_LIMIT
+    limit = min(limit, SUBMITTER_COMPLETE_MAX_LIMIT)
 
     data = []
-    for submitter in queryset:
+    for submitter in get_person_completions(search, limit):
         item = {}
         item['pk'] = submitter.id
         item['name'] = submitter.name
@@ -17,16 +17,19 @@
 # along with Patchwork; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import json
+
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.shortcuts import render_to_response, get_object_or_404
 from patchwork.requestcontext import PatchworkRequestContext
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseRedirect, \
+     HttpResponseNotFound, HttpResponseNotAllowed, StreamingHttpResponse
 import django.core.urlresolvers
-from patchwork.models import Patch, Bundle, BundlePatch, Project
+from patchwork.models import Patch, Bundle, Project
 from patchwork.utils import get_patch_ids
 from patchwork.forms import BundleForm, DeleteBundleForm
-from patchwork.views import generic_list, patch_to_mbox
+from patchwork.views import generic_list, patches_to_mbox
 from patchwork.filters import DelegateFilter
 
 @login_required
@@ -56,22 +59,14 @@ def setbundle(request):
         elif action == 'add':
             bundle = get_object_or_404(Bundle,
                     owner = request.user, id = request.POST['id'])
-            bundle.save()
 
-            patch_id = request.get('patch_id', None)
+            patch_id = request.POST.get('patch_id', None)
             if patch_id:
-                patch_ids = patch_id
+                patch_ids = [patch_id]
             else:
                 patch_ids = get_patch_ids(request.POST)
 
-            for id in patch_ids:
-                try:
-                    patch = Patch.objects.get(id = id)
-                    bundle.append_patch(patch)
-                except:
-                    pass
-
-            bundle.save()
+            bundle.add_patches(Patch.objects.filter(id__in = patch_ids))
         elif action == 'delete':
             try:
                 bundle = Bundle.objects.get(owner = request.user,
@@ -125,6 +120,9 @@ def bundles(request):
 
     return render_to_response('patchwork/bundles.html', context)
 
+def _neworder_ids(data):
+    return [int(id) for id in data.getlist('neworder') if id.isdigit()]
+
 def bundle(request, username, bundlename):
     bundle = get_object_or_404(Bundle, owner__username = username,
                                 name = bundlename)
@@ -161,15 +159,7 @@ def bundle(request, username, bundlename):
 
         if request.method == 'POST' and \
                            request.POST.get('form') == 'reorderform':
-            order = get_object_or_404(BundlePatch, bundle = bundle,
-                            patch__id = request.POST.get('order_start')).order
-
-            for patch_id in request.POST.getlist('neworder'):
-                bundlepatch = get_object_or_404(BundlePatch,
-                            bundle = bundle, patch__id = patch_id)
-                bundlepatch.order = order
-                bundlepatch.save()
-                order += 1
+            bundle.reorder_patches(_neworder_ids(request.POST))
     else:
         form = None
 
@@ -186,6 +176,22 @@ def bundle(request, username, bundlename):
 
     return render_to_response('patchwork/bundle.html', context)
 
+@login_required
+def reorder(request, username, bundlename):
+    """Reorder the patches in a bundle in a single request. The new order
+    is given by the list of patch IDs in the 'neworder' parameter."""
+    bundle = get_object_or_404(Bundle, owner = request.user,
+                                owner__username = username,
+                                name = bundlename)
+
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    updated = bundle.reorder_patches(_neworder_ids(request.POST))
+
+    return HttpResponse(json.dumps({'updated': updated}),
+                        content_type = 'application/json')
+
 def mbox(request, username, bundlename):
     bundle = get_object_or_404(Bundle, owner__username = username,
                                 name = bundlename)
@@ -193,14 +199,12 @@ def mbox(request, username, bundlename):
     if not (request.user == bundle.owner or bundle.public):
         return HttpResponseNotFound()
 
-    mbox = '\n'.join([patch_to_mbox(p).as_string(True)
-                        for p in bundle.ordered_patches()])
-
-    response = HttpResponse(content_type='text/plain')
+    response = StreamingHttpResponse(
+                    patches_to_mbox(bundle.ordered_patches()),
+                    content_type='text/plain')
     response['Content-Disposition'] = \
 	'attachment; filename=bundle-%d-%s.mbox' % (bundle.id, bundle.name)
 
-    response.write(mbox)
     return response
 
 @login_required
@@ -18,12 +18,21 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from patchwork.models import Patch, Project, Bundle
+from patchwork.models import Patch, PatchFile, Project, Bundle
 from patchwork.forms import PatchForm, CreateBundleForm
 from patchwork.requestcontext import PatchworkRequestContext
 from django.shortcuts import render_to_response, get_object_or_404
-from django.http import HttpResponse, HttpResponseForbidden
-from patchwork.views import generic_list, patch_to_mbox
+from django.http import HttpResponse, HttpResponseBadRequest, \
+     HttpResponseForbidden, Http404, StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
+from django.db.models.functions import Length
+from django.conf import settings
+from patchwork.cache import patch_list_count
+from patchwork.filters import Filters
+from patchwork.utils import Order
+from patchwork.views import filter_patches, generic_list, patches_to_mbox
+from patchwork.views.xmlrpc import change_list
+import json
 
 def patch(request, patch_id):
     context = PatchworkRequestContext(request)
@@ -81,25 +90,116 @@ def patch(request, patch_id):
     context['createbundleform'] = createbundleform
     context['project'] = patch.project
 
+    # large patches are shown a file at a time; the first few files are
+    # shown with the page, and the rest are loaded on request
+    if patch.content and \
+            len(patch.content) > settings.PATCH_PROGRESSIVE_THRESHOLD:
+        files = patch.patchfile_set.all()
+        for (i, patch_file) in enumerate(files):
+            if i >= settings.PATCH_PROGRESSIVE_FILES:
+                break
+            patch_file.content = patch.content[patch_file.start_offset:
+                                               patch_file.end_offset]
+        context['patch_files'] = files
+
     return render_to_response('patchwork/patch.html', context)
 
+def file(request, patch_id, index):
+    # only fetch this file's section of the patch content
+    files = PatchFile.objects.filter(patch=patch_id).extra(
+        select={'content': 'SUBSTR(patchwork_patch.content, '
+                    'patchwork_patchfile.start_offset + 1, '
+                    'patchwork_patchfile.end_offset - '
+                    'patchwork_patchfile.start_offset)'},
+        tables=['patchwork_patch'],
+        where=['patchwork_patch.id = patchwork_patchfile.patch_id'])
+
+    try:
+        patch_file = files[int(index)]
+    except IndexError:
+        raise Http404
+
+    return render_to_response('patchwork/patch-file.html',
+                              {'file': patch_file})
+
+# size of the chunks (in characters) that patch content is sent in
+CONTENT_CHUNK_SIZE = 256 * 1024
+
+def _content_chunks(patch_id, length):
+    # fetch the content from the database a chunk at a time, so that large
+    # patches needn't be held in memory
+    patches = Patch.objects.filter(id=patch_id)
+    for start in xrange(0, length, CONTENT_CHUNK_SIZE):
+        chunks = patches.extra(
+            select={'chunk': 'SUBSTR(patchwork_patch.content, %s, %s)'},
+            select_params=(start + 1, CONTENT_CHUNK_SIZE)) \
+            .values_list('chunk', flat=True)
+        if not chunks:
+            # the patch has been deleted
+            return
+        yield chunks[0]
+
 def content(request, patch_id):
-    patch = get_object_or_404(Patch, id=patch_id)
-    response = HttpResponse(content_type="text/x-patch")
-    response.write(patch.content)
+    patch = get_object_or_404(
+        Patch.objects.defer('content', 'headers')
+            .annotate(content_length=Length('content')),
+        id=patch_id)
+    response = StreamingHttpResponse(
+                    _content_chunks(patch.id, patch.content_length or 0),
+                    content_type="text/x-patch")
     response['Content-Disposition'] = 'attachment; filename=' + \
         patch.filename().replace(';', '').replace('\n', '')
     return response
 
 def mbox(request, patch_id):
-    patch = get_object_or_404(Patch, id=patch_id)
-    response = HttpResponse(content_type="text/plain")
-    response.write(patch_to_mbox(patch).as_string(True))
+    # the content is only fetched by the stream
+    patch = get_object_or_404(Patch.objects.only('id', 'name'), id=patch_id)
+    response = StreamingHttpResponse(
+                    patches_to_mbox(Patch.objects.filter(id=patch.id)),
+                    content_type="text/plain")
     response['Content-Disposition'] = 'attachment; filename=' + \
         patch.filename().replace(';', '').replace('\n', '')
     return response
 
 
+def list_mbox(request, project_id):
+    project = get_object_or_404(Project, linkname=project_id)
+
+    filters = Filters(request)
+    filters.set_project(project)
+    order = request.GET.get('order')
+    patches = filter_patches(filters, Patch.objects.filter(project=project),
+                             Order(order), bool(order))
+
+    count = patch_list_count(project, patches)
+    if count > settings.MAX_LIST_MBOX_PATCHES:
+        return HttpResponseBadRequest(
+                'Too many patches (%d) to download; the maximum is %d\n' %
+                (count, settings.MAX_LIST_MBOX_PATCHES),
+                content_type="text/plain")
+
+    response = StreamingHttpResponse(patches_to_mbox(patches),
+                                     content_type="text/plain")
+    response['Content-Disposition'] = \
+        'attachment; filename=%s.mbox' % project.linkname
+    return response
+
+@gzip_page
+def changes(request, project_id):
+    """Return the project's patches and checks changed since the change
+    sequence number in the 'since' parameter, as JSON. The data is the
+    same as returned by the change_list XML-RPC method."""
+    project = get_object_or_404(Project, linkname=project_id)
+
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid change sequence number\n',
+                                      content_type="text/plain")
+
+    data = change_list(since, project.id)
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
 def list(request, project_id):
     project = get_object_or_404(Project, linkname=project_id)
     context = generic_list(request, project, 'patchwork.views.patch.list',
@@ -18,9 +18,9 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-from patchwork.models import Patch, Project
+from patchwork.cache import get_delegates, project_patch_count
+from patchwork.models import Project
 from django.shortcuts import render_to_response, get_object_or_404
-from django.contrib.auth.models import User
 from patchwork.requestcontext import PatchworkRequestContext
 
 def project(request, project_id):
@@ -28,11 +28,9 @@ def project(request, project_id):
     project = get_object_or_404(Project, linkname = project_id)
     context.project = project
 
-    context['maintainers'] = User.objects.filter( \
-            profile__maintainer_projects = project)
-    context['n_patches'] = Patch.objects.filter(project = project,
-            archived = False).count()
-    context['n_archived_patches'] = Patch.objects.filter(project = project,
-            archived = True).count()
+    context['maintainers'] = get_delegates(project)
+    context['n_patches'] = project_patch_count(project, archived = False)
+    context['n_archived_patches'] = project_patch_count(project,
+            archived = True)
 
     return render_to_response('patchwork/project.html', context)
@@ -20,12 +20,13 @@
 
 from django.contrib.auth.decorators import login_required
 from patchwork.requestcontext import PatchworkRequestContext
+from patchwork.cache import get_projects, todo_patch_counts
 from django.shortcuts import render_to_response, get_object_or_404
 from django.contrib import auth
 from django.contrib.sites.models import Site
 from django.http import HttpResponseRedirect
 from patchwork.models import Project, Bundle, Person, EmailConfirmation, \
-         State, EmailOptout
+         State, EmailOptout, APIToken
 from patchwork.forms import UserProfileForm, UserPersonLinkForm, \
          RegistrationForm
 from patchwork.filters import DelegateFilter
@@ -117,6 +118,7 @@ def profile(request):
              .extra(select = {'is_optout': optout_query})
     context['linked_emails'] = people
     context['linkform'] = UserPersonLinkForm()
+    context['api_tokens'] = APIToken.objects.filter(user = request.user)
 
     return render_to_response('patchwork/profile.html', context)
 
@@ -178,17 +180,43 @@ def unlink(request, person_id):
     url = django.core.urlresolvers.reverse('patchwork.views.user.profile')
     return HttpResponseRedirect(url)
 
+@login_required
+def token_create(request):
+    if request.method != 'POST':
+        url = django.core.urlresolvers.reverse('patchwork.views.user.profile')
+        return HttpResponseRedirect(url)
+
+    # the token is only available now; we just store its hash
+    (api_token, token) = APIToken.create_token(request.user)
+
+    context = PatchworkRequestContext(request)
+    context['token'] = token
+    return render_to_response('patchwork/api-token.html', context)
+
+@login_required
+def token_delete(request, token_id):
+    api_token = get_object_or_404(APIToken, id = token_id,
+                                  user = request.user)
+
+    if request.method == 'POST':
+        api_token.delete()
+
+    url = django.core.urlresolvers.reverse('patchwork.views.user.profile')
+    return HttpResponseRedirect(url)
+
 
 @login_required
 def todo_lists(request):
     todo_lists = []
 
-    for project in Project.objects.all():
-        patches = request.user.profile.todo_patches(project = project)
-        if not patches.count():
+    projects = get_projects()
+    counts = todo_patch_counts(request.user.profile, projects)
+    for project in projects:
+        n_patches = counts[project.id]
+        if not n_patches:
             continue
 
-        todo_lists.append({'project': project, 'n_patches': patches.count()})
+        todo_lists.append({'project': project, 'n_patches': n_patches})
 
     if len(todo_lists) == 1:
         return todo_list(request, todo_lists[0]['project'].linkname)
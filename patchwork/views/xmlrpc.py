@@ -23,17 +23,26 @@
 from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
 from DocXMLRPCServer import XMLRPCDocGenerator
 import base64
+import json
 import sys
 import xmlrpclib
 
+from django.conf import settings
 from django.core import urlresolvers
 from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Prefetch
 from django.http import (
-    HttpResponse, HttpResponseRedirect, HttpResponseServerError)
+    HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect,
+    HttpResponseServerError)
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 
-from patchwork.models import Patch, Project, Person, State, Check
-from patchwork.views import patch_to_mbox
+from patchwork.cache import get_verified_credentials, set_verified_credentials
+from patchwork.models import (Patch, Project, Person, State, Check, Bundle,
+                              APIToken, ChangeSequence, changes_since)
+from patchwork.views import patch_mbox_strings
 
 
 class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
@@ -57,6 +66,10 @@ class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
         # map of name => (auth, func)
         self.func_map = {}
 
+        # system.multicall is handled by _dispatch, but is listed here so
+        # that it's included in the documentation
+        self.funcs['system.multicall'] = self.system_multicall
+
     def register_function(self, fn, auth_required):
         self.funcs[fn.__name__] = fn  # needed by superclass methods
         self.func_map[fn.__name__] = (auth_required, fn)
@@ -74,6 +87,9 @@ class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
 
         header = auth_header.strip()
 
+        if header.startswith('Token '):
+            return APIToken.user_for_token(header[len('Token '):].strip())
+
         if not header.startswith('Basic '):
             raise Exception('Authentication scheme not supported')
 
@@ -85,16 +101,45 @@ class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
         except:
             raise Exception('Invalid authentication credentials')
 
-        return authenticate(username=username, password=password)
+        return self._authenticate(username, password)
+
+    def _authenticate(self, username, password):
+        # Avoid running the (slow) password hasher if we've recently
+        # verified the same credentials
+        verified = get_verified_credentials(username, password)
+        if verified is not None:
+            (user_id, auth_hash) = verified
+            user = User.objects.filter(id=user_id).first()
+            if user is not None and \
+                    user.get_session_auth_hash() == auth_hash:
+                return user
+
+        # The password may be one of the user's API tokens, which are
+        # quick to check
+        user = APIToken.user_for_token(password)
+        if user is not None:
+            return user if user.username == username else None
+
+        user = authenticate(username=username, password=password)
+        if user is not None:
+            set_verified_credentials(username, password, user)
+        return user
 
     def _dispatch(self, request, method, params):
+        if method == 'system.multicall':
+            return self._multicall(request, *params)
+
         if method not in self.func_map.keys():
             raise Exception('method "%s" is not supported' % method)
 
         auth_required, fn = self.func_map[method]
 
         if auth_required:
-            user = self._user_for_request(request)
+            # remember the user for the rest of the request, so that the
+            # calls in a system.multicall only authenticate once
+            if not hasattr(request, 'xmlrpc_user'):
+                request.xmlrpc_user = self._user_for_request(request)
+            user = request.xmlrpc_user
             if not user:
                 raise Exception('Invalid username/password')
 
@@ -102,6 +147,33 @@ class PatchworkXMLRPCDispatcher(SimpleXMLRPCDispatcher,
 
         return fn(*params)
 
+    def _multicall(self, request, calls):
+        """Dispatch each of a list of calls, as for system.multicall.
+
+        Each call is a struct with 'methodName' and 'params' members.
+        The result of each call is returned as a single-item list, or as
+        a fault struct if the call failed, in which case the remaining
+        calls are still made.
+        """
+        results = []
+        for call in calls:
+            try:
+                method = call['methodName']
+                if method == 'system.multicall':
+                    raise Exception('Recursive system.multicall forbidden')
+                results.append([self._dispatch(request, method,
+                                               tuple(call['params']))])
+            except xmlrpclib.Fault, fault:
+                results.append({'faultCode': fault.faultCode,
+                                'faultString': fault.faultString})
+            except Exception, ex:
+                results.append({
+                    'faultCode': 1,
+                    'faultString': '%s:%s' % (ex.__class__, ex),
+                })
+
+        return results
+
     def _marshaled_dispatch(self, request):
         try:
             params, method = xmlrpclib.loads(request.body)
@@ -145,6 +217,85 @@ def xmlrpc(request):
 
     return response
 
+
+# JSON view function. This provides the same methods as the XML-RPC
+# interface, using JSON-RPC 2.0 requests and responses, which are
+# smaller and quicker to encode. A request may also give a list of
+# 'fields', in which case the objects returned are limited to those
+# fields.
+
+# Methods which return a dict holding lists of objects, rather than the
+# objects themselves. Fields are selected from the objects in the given
+# lists, and the dict's other keys (such as change_list's 'seq' cursor)
+# are always kept.
+_nested_results = {
+    'change_list': ['patches', 'checks'],
+}
+
+
+def _select_fields(result, fields):
+    if isinstance(result, dict):
+        return dict([(k, v) for (k, v) in result.iteritems() if k in fields])
+    elif isinstance(result, list):
+        return [_select_fields(obj, fields) if isinstance(obj, dict) else obj
+                for obj in result]
+    return result
+
+
+def _jsonrpc_call(request, call):
+    response = {'jsonrpc': '2.0', 'id': None}
+
+    try:
+        response['id'] = call.get('id')
+        params = call.get('params', [])
+        if not isinstance(params, list):
+            raise Exception('params must be a list')
+
+        result = dispatcher._dispatch(request, call['method'], tuple(params))
+
+        if call.get('fields'):
+            fields = set(call['fields'])
+            if call['method'] in _nested_results:
+                result = dict(result)
+                for key in _nested_results[call['method']]:
+                    result[key] = _select_fields(result[key], fields)
+            else:
+                result = _select_fields(result, fields)
+
+        response['result'] = result
+    except xmlrpclib.Fault, fault:
+        response['error'] = {'code': fault.faultCode,
+                             'message': fault.faultString}
+    except Exception, ex:
+        response['error'] = {
+            'code': 1,
+            'message': '%s:%s' % (ex.__class__, ex),
+        }
+
+    return response
+
+
+@csrf_exempt
+@gzip_page
+def jsonrpc(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        ret = {'jsonrpc': '2.0', 'id': None,
+               'error': {'code': -32700, 'message': 'Parse error'}}
+    else:
+        # a list of calls is a batch request
+        if isinstance(data, list):
+            ret = [_jsonrpc_call(request, call) for call in data]
+        else:
+            ret = _jsonrpc_call(request, data)
+
+    return HttpResponse(json.dumps(ret, separators=(',', ':')),
+                        content_type='application/json')
+
 # decorator for XMLRPC methods. Setting login_required to true will call
 # the decorated function with a non-optional user as the first argument.
 
@@ -162,11 +313,79 @@ LOOKUP_TYPES = ['iexact', 'contains', 'icontains', 'gt', 'gte', 'lt',
                 'in', 'startswith', 'istartswith', 'endswith',
                 'iendswith', 'range', 'year', 'month', 'day', 'isnull']
 
+# Related objects used by the serializers below, which we fetch in the
+# same query as the objects themselves. Without these, serializing a
+# list of objects would need several extra queries per object.
+PATCH_RELATED = ['project', 'state', 'submitter', 'delegate']
+CHECK_RELATED = ['patch', 'user']
+
 
 #######################################################################
 # Helper functions
 #######################################################################
 
+def paginate(queryset, cursor, max_count):
+    """Return an iterator over a page of objects from queryset.
+
+    Objects are ordered by ID, starting after the object with ID cursor
+    (if given), so a client can fetch the next page by passing the ID
+    of the last object returned. Pages contain at most max_count
+    objects (if greater than zero), and never more than
+    XMLRPC_MAX_PAGE_SIZE.
+    """
+    if cursor:
+        queryset = queryset.filter(id__gt=cursor)
+
+    limit = settings.XMLRPC_MAX_PAGE_SIZE
+    if max_count > 0:
+        limit = min(max_count, limit)
+
+    return queryset.order_by('id')[:limit].iterator()
+
+
+def patch_queryset():
+    """Return a queryset of patches suitable for patch_to_dict."""
+    return Patch.objects.select_related(*PATCH_RELATED)
+
+
+def check_queryset():
+    """Return a queryset of checks suitable for check_to_dict."""
+    return Check.objects.select_related(*CHECK_RELATED).defer(
+        'patch__content', 'patch__headers')
+
+
+def check_batch_size(ids):
+    """Raise an exception if a batch method is given too many IDs.
+
+    Batches are limited to the maximum page size of the list methods,
+    XMLRPC_MAX_PAGE_SIZE.
+    """
+    if len(ids) > settings.XMLRPC_MAX_PAGE_SIZE:
+        raise Exception('Too many objects given (maximum %d)' %
+                        settings.XMLRPC_MAX_PAGE_SIZE)
+
+
+def patch_set_fields(params):
+    """Return the patch fields to set for a patch_set params dict.
+
+    Only the state, commit_ref and archived fields may be set; any
+    other parameters are ignored.
+    """
+    ok_params = ['state', 'commit_ref', 'archived']
+    fields = {}
+
+    for (k, v) in params.iteritems():
+        if k not in ok_params:
+            continue
+
+        if k == 'state':
+            fields[k] = State.objects.get(id=v)
+        else:
+            fields[k] = v
+
+    return fields
+
+
 def project_to_dict(obj):
     """Serialize a project object.
 
@@ -249,6 +468,7 @@ def patch_to_dict(obj):
         'delegate': 'admin',
         'delegate_id': 1,
         'commit_ref': '',
+        'change_seq': 1234,
     }
 
     Args:
@@ -273,6 +493,7 @@ def patch_to_dict(obj):
         'delegate': unicode(obj.delegate).encode('utf-8'),
         'delegate_id': max(obj.delegate_id, 0),
         'commit_ref': max(obj.commit_ref, ''),
+        'change_seq': obj.change_seq,
     }
 
 
@@ -340,6 +561,7 @@ def check_to_dict(obj):
         'target_url': obj.target_url,
         'description': obj.description,
         'context': obj.context,
+        'change_seq': obj.change_seq,
     }
 
 def patch_check_to_dict(obj):
@@ -370,7 +592,7 @@ def pw_rpc_version():
     Returns:
         Version of the API.
     """
-    return (1, 1, 0)
+    return (1, 4, 0)
 
 
 @xmlrpc_method()
@@ -448,6 +670,8 @@ def person_list(search_str=None, max_count=0):
         else:
             people = Person.objects.all()
 
+        people = people.select_related('user')
+
         if max_count > 0:
             return map(person_to_dict, people)[:max_count]
         else:
@@ -470,7 +694,8 @@ def person_get(person_id):
         dict.
     """
     try:
-        person = Person.objects.filter(id=person_id)[0]
+        person = Person.objects.select_related('user').filter(
+            id=person_id)[0]
         return person_to_dict(person)
     except Person.DoesNotExist:
         return {}
@@ -494,14 +719,17 @@ def patch_list(filt=None):
      * hash
      * msgid
 
-    It is also possible to specify the number of patches returned via
-    a ``max_count`` filter.
+    Patches are returned in pages, ordered by ID. The number of patches
+    returned can be limited via a ``max_count`` filter, and is never
+    more than the server's maximum page size. To fetch the next page,
+    pass the ID of the last patch returned as a ``cursor`` filter.
 
      * max_count
+     * cursor
 
-    With the exception of ``max_count``, the specified field of the
-    patches are compared to the search string using a provided
-    field lookup type, which can be one of:
+    With the exception of ``max_count`` and ``cursor``, the specified
+    field of the patches are compared to the search string using a
+    provided field lookup type, which can be one of:
 
      * iexact
      * contains
@@ -538,8 +766,9 @@ def patch_list(filt=None):
             compare against.
 
     Returns:
-        A serialized list of patches matching filters, if any. A list
-        of all patches if no filter given.
+        A serialized list of the first page of patches matching
+        filters, if any. The first page of all patches if no filter
+        given.
     """
     if filt is None:
         filt = {}
@@ -561,10 +790,12 @@ def patch_list(filt=None):
             'hash',
             'msgid',
             'max_count',
+            'cursor',
         ]
 
         dfilter = {}
         max_count = 0
+        cursor = None
 
         for key in filt:
             parts = key.split('__')
@@ -586,15 +817,16 @@ def patch_list(filt=None):
                 dfilter['state'] = State.objects.filter(id=filt[key])[0]
             elif parts[0] == 'max_count':
                 max_count = filt[key]
+            elif parts[0] == 'cursor':
+                cursor = filt[key]
             else:
                 dfilter[key] = filt[key]
 
-        patches = Patch.objects.filter(**dfilter)
+        # the patch content and headers can be large, and aren't needed
+        patches = patch_queryset().filter(**dfilter).defer('content',
+                                                           'headers')
 
-        if max_count > 0:
-            return map(patch_to_dict, patches[:max_count])
-        else:
-            return map(patch_to_dict, patches)
+        return map(patch_to_dict, paginate(patches, cursor, max_count))
     except Patch.DoesNotExist:
         return []
 
@@ -613,7 +845,7 @@ def patch_get(patch_id):
         dict.
     """
     try:
-        patch = Patch.objects.filter(id=patch_id)[0]
+        patch = patch_queryset().filter(id=patch_id)[0]
         return patch_to_dict(patch)
     except Patch.DoesNotExist:
         return {}
@@ -633,7 +865,7 @@ def patch_get_by_hash(hash):
         dict.
     """
     try:
-        patch = Patch.objects.filter(hash=hash)[0]
+        patch = patch_queryset().filter(hash=hash)[0]
         return patch_to_dict(patch)
     except Patch.DoesNotExist:
         return {}
@@ -655,13 +887,46 @@ def patch_get_by_project_hash(project, hash):
         if any, else an empty dict.
     """
     try:
-        patch = Patch.objects.filter(project__linkname=project,
-                                     hash=hash)[0]
+        patch = patch_queryset().filter(project__linkname=project,
+                                        hash=hash)[0]
         return patch_to_dict(patch)
     except Patch.DoesNotExist:
         return {}
 
 
+@xmlrpc_method()
+def patch_ids_by_hash(hashes, project=''):
+    """Get the IDs of the patches with each of a list of hashes.
+
+    Look up the patches matching each of a list of patch hashes, in a
+    single query. This is much quicker than calling patch_get_by_hash
+    for each hash, for example when updating the patches for each of
+    the commits in a large merge.
+
+    Args:
+        hashes (list): The hashes of the patches to look up. At most
+            the server's maximum page size of hashes may be given.
+        project (str): The linkname of the project to look up patches
+            in. If blank, patches from any project match.
+
+    Returns:
+        A dict mapping each hash to the ID of the matching patch.
+        Hashes which don't match any patch are omitted. Where several
+        patches have the same hash, the first submitted is used.
+    """
+    check_batch_size(hashes)
+
+    patches = Patch.objects.filter(hash__in=hashes)
+    if project:
+        patches = patches.filter(project__linkname=project)
+
+    ids = {}
+    for (hash, patch_id) in patches.order_by('date').values_list('hash',
+                                                                 'id'):
+        ids.setdefault(hash, patch_id)
+    return ids
+
+
 @xmlrpc_method()
 def patch_get_mbox(patch_id):
     """Get a patch by its ID in mbox format.
@@ -677,8 +942,8 @@ def patch_get_mbox(patch_id):
         else an empty string.
     """
     try:
-        patch = Patch.objects.filter(id=patch_id)[0]
-        return patch_to_mbox(patch).as_string(True)
+        patch = Patch.objects.get(id=patch_id)
+        return patch_mbox_strings([patch])[0]
     except Patch.DoesNotExist:
         return ''
 
@@ -737,22 +1002,13 @@ def patch_set(user, patch_id, params):
         Patch.DoesNotExist: The patch did not exist.
     """
     try:
-        ok_params = ['state', 'commit_ref', 'archived']
-
         patch = Patch.objects.get(id=patch_id)
 
         if not patch.is_editable(user):
             raise Exception('No permissions to edit this patch')
 
-        for (k, v) in params.iteritems():
-            if k not in ok_params:
-                continue
-
-            if k == 'state':
-                patch.state = State.objects.get(id=v)
-
-            else:
-                setattr(patch, k, v)
+        for (k, v) in patch_set_fields(params).iteritems():
+            setattr(patch, k, v)
 
         patch.save()
 
@@ -762,6 +1018,137 @@ def patch_set(user, patch_id, params):
         raise
 
 
+@xmlrpc_method()
+def patch_get_many(patch_ids):
+    """Get a list of patches by their IDs.
+
+    Retrieve the patches matching each of a list of patch IDs. This is
+    equivalent to calling patch_get for each ID, but needs only one
+    call.
+
+    Args:
+        patch_ids (list): The IDs of the patches to retrieve. At most
+            the server's maximum page size of IDs may be given.
+
+    Returns:
+        A list of the serialized patches, in the same order as the IDs.
+        Where no patch matches an ID, its entry is an empty dict.
+    """
+    check_batch_size(patch_ids)
+    patches = patch_queryset().in_bulk(patch_ids)
+    return [patch_to_dict(patches[id]) if id in patches else {}
+            for id in patch_ids]
+
+
+@xmlrpc_method()
+def patch_get_mbox_many(patch_ids):
+    """Get a list of patches by their IDs in mbox format.
+
+    Retrieve the patches matching each of a list of patch IDs, and
+    return them in mbox format. This is equivalent to calling
+    patch_get_mbox for each ID, but needs only one call.
+
+    Args:
+        patch_ids (list): The IDs of the patches to retrieve. At most
+            the server's maximum page size of IDs may be given.
+
+    Returns:
+        A list of the patches in mbox format, in the same order as the
+        IDs. Where no patch matches an ID, its entry is an empty string.
+    """
+    check_batch_size(patch_ids)
+    patches = Patch.objects.in_bulk(patch_ids).values()
+    mboxes = dict(zip([patch.id for patch in patches],
+                      patch_mbox_strings(patches)))
+    return [mboxes.get(id, '') for id in patch_ids]
+
+
+@xmlrpc_method(login_required=True)
+def patch_set_many(user, patch_ids, params):
+    """Set fields of a list of patches.
+
+    Modify the patches matching a list of patch IDs, setting the same
+    ``key,value`` pairs on each, as for patch_set. The patches are
+    updated together: if any patch doesn't exist or can't be edited by
+    the user, none of them are modified.
+
+    **NOTE:** Authentication is required for this method.
+
+    Args:
+        user (User): The user making the request. This will be
+            populated from HTTP Basic Auth.
+        patch_ids (list): The IDs of the patches to modify. At most the
+            server's maximum page size of IDs may be given.
+        params (dict): A dictionary of keys corresponding to patch
+            object fields and the values that said fields should be
+            set to.
+
+    Returns:
+        True, if successful else raise exception.
+
+    Raises:
+        Exception: User did not have necessary permissions to edit all
+            of the patches
+        Patch.DoesNotExist: One of the patches did not exist.
+    """
+    check_batch_size(patch_ids)
+    fields = patch_set_fields(params)
+
+    with transaction.atomic():
+        patches = Patch.objects.filter(id__in=patch_ids)
+        ids = set(patch_ids)
+
+        if set(patches.values_list('id', flat=True)) != ids:
+            raise Patch.DoesNotExist('Patch matching query does not exist.')
+
+        if set(patches.editable(user).values_list('id', flat=True)) != ids:
+            raise Exception('No permissions to edit these patches')
+
+        patches.update_patches(**fields)
+
+    return True
+
+
+@xmlrpc_method(login_required=True)
+def bundle_update_patches(user, bundle_id, add=None, remove=None):
+    """Add patches to, and remove patches from, a bundle.
+
+    Patches are added to the end of the bundle, in the order given.
+    Patches which are already in the bundle are not added again, and
+    IDs of patches which don't exist are ignored.
+
+    **NOTE:** Authentication is required for this method.
+
+    Args:
+        user (User): The user making the request. This will be
+            populated from HTTP Basic Auth.
+        bundle_id (int): The ID of the bundle to modify.
+        add (list): The IDs of the patches to add to the bundle.
+        remove (list): The IDs of the patches to remove from the
+            bundle.
+
+    Returns:
+        True, if successful else raise exception.
+
+    Raises:
+        Exception: The user does not own the bundle.
+        Bundle.DoesNotExist: The bundle did not exist.
+    """
+    bundle = Bundle.objects.get(id=bundle_id)
+
+    if bundle.owner_id != user.id:
+        raise Exception('No permissions to edit this bundle')
+
+    if remove:
+        bundle.remove_patches(Patch.objects.filter(id__in=remove))
+
+    if add:
+        patches = Patch.objects.in_bulk(add)
+        bundle.add_patches([patches[id] for id in add if id in patches])
+
+    return True
+
+
 @xmlrpc_method()
 def state_list(search_str=None, max_count=0):
     """List states matching a given name filter.
@@ -823,14 +1210,17 @@ def check_list(filt=None):
      * project_id
      * patch_id
 
-    It is also possible to specify the number of patches returned via
-    a ``max_count`` filter.
+    Checks are returned in pages, ordered by ID. The number of checks
+    returned can be limited via a ``max_count`` filter, and is never
+    more than the server's maximum page size. To fetch the next page,
+    pass the ID of the last check returned as a ``cursor`` filter.
 
      * max_count
+     * cursor
 
-    With the exception of ``max_count``, the specified field of the
-    patches are compared to the search string using a provided
-    field lookup type, which can be one of:
+    With the exception of ``max_count`` and ``cursor``, the specified
+    field of the checks are compared to the search string using a
+    provided field lookup type, which can be one of:
 
      * iexact
      * contains
@@ -867,8 +1257,8 @@ def check_list(filt=None):
             compare against.
 
     Returns:
-        A serialized list of Checks matching filters, if any. A list
-        of all Checks if no filter given.
+        A serialized list of the first page of Checks matching filters,
+        if any. The first page of all Checks if no filter given.
     """
     if filt is None:
         filt = {}
@@ -883,10 +1273,12 @@ def check_list(filt=None):
             'project_id',
             'patch_id',
             'max_count',
+            'cursor',
         ]
 
         dfilter = {}
         max_count = 0
+        cursor = None
 
         for key in filt:
             parts = key.split('__')
@@ -907,19 +1299,81 @@ def check_list(filt=None):
                 dfilter['patch'] = Patch.objects.filter(id=filt[key])[0]
             elif parts[0] == 'max_count':
                 max_count = filt[key]
+            elif parts[0] == 'cursor':
+                cursor = filt[key]
             else:
                 dfilter[key] = filt[key]
 
-        checks = Check.objects.filter(**dfilter)
+        checks = check_queryset().filter(**dfilter)
 
-        if max_count > 0:
-            return map(check_to_dict, checks[:max_count])
-        else:
-            return map(check_to_dict, checks)
+        return map(check_to_dict, paginate(checks, cursor, max_count))
     except Check.DoesNotExist:
         return []
 
 
+@xmlrpc_method(login_required=True)
+def check_create_many(user, checks):
+    """Create checks for a list of patches.
+
+    Each check is given as a struct with the following members:
+
+     * patch_id: The ID of the patch to add the check to.
+     * state: One of 'pending', 'success', 'warning' or 'fail'.
+     * context: A label for the check, used to tell it apart from
+       checks of other testing systems. Defaults to 'default'.
+     * target_url: A URL for the results of the check. Optional.
+     * description: A brief description of the check. Optional.
+
+    The checks are created together: if any check is invalid, or is for
+    a patch which the user can't edit, none of them are created.
+
+    **NOTE:** Authentication is required for this method.
+
+    Args:
+        user (User): The user making the request. This will be
+            populated from HTTP Basic Auth.
+        checks (list): The checks to create. At most the server's
+            maximum page size of checks may be given.
+
+    Returns:
+        True, if successful else raise exception.
+
+    Raises:
+        Exception: A check was invalid, or the user did not have
+            necessary permissions to edit its patch.
+    """
+    check_batch_size(checks)
+    states = dict([(name, value) for (value, name) in Check.STATE_CHOICES])
+
+    with transaction.atomic():
+        editable = set(Patch.objects.filter(
+            id__in=[c['patch_id'] for c in checks]).editable(
+                user).values_list('id', flat=True))
+
+        objs = []
+        for check in checks:
+            if check['patch_id'] not in editable:
+                raise Exception('No permissions to add checks to patch %d' %
+                                check['patch_id'])
+
+            if check.get('state') not in states:
+                raise Exception('Invalid check state %r' % check.get('state'))
+
+            objs.append(Check(patch_id=check['patch_id'], user=user,
+                              state=states[check['state']],
+                              context=check.get('context', 'default'),
+                              target_url=check.get('target_url'),
+                              description=check.get('description')))
+
+        seq = ChangeSequence.reserve(len(objs)) - len(objs) + 1
+        for (i, obj) in enumerate(objs):
+            obj.change_seq = seq + i
+
+        Check.objects.bulk_create(objs)
+
+    return True
+
+
 @xmlrpc_method()
 def check_get(check_id):
     """Get a check by its ID.
@@ -934,12 +1388,65 @@ def check_get(check_id):
         dict.
     """
     try:
-        check = Check.objects.filter(id=check_id)[0]
+        check = check_queryset().filter(id=check_id)[0]
         return check_to_dict(check)
     except Check.DoesNotExist:
         return {}
 
 
+@xmlrpc_method()
+def change_list(since, project_id=0, max_count=0):
+    """List patches and checks changed since a change sequence number.
+
+    Each time a patch or check is created or modified, it is given a
+    new, higher, change sequence number (its ``change_seq`` field).
+    This method returns the objects with a change_seq greater than a
+    given number, ordered by change_seq, so that clients can keep up to
+    date with the patches and checks which have changed, without
+    fetching all of them again. For example:
+
+    {
+        'seq': 1236,
+        'patches': [{'id': 1, 'change_seq': 1234, ...}],
+        'checks': [{'id': 1, 'change_seq': 1236, ...}],
+    }
+
+    To fetch the next changes, call this method again with the ``seq``
+    value returned. Deleted patches and checks are not reported.
+
+    Args:
+        since (int): The change sequence number to list changes after.
+            Use 0 to list all patches and checks.
+        project_id (int): The ID of the project to list changes for. If
+            0, changes for all projects are listed.
+        max_count (int): The maximum number of patches and checks to
+            return. This is never more than the server's maximum page
+            size.
+
+    Returns:
+        A dict of the serialized patches and checks changed since the
+        change sequence number, and the change sequence number of the
+        last of them (or the number given, if there are none).
+    """
+    patches = patch_queryset().defer('content', 'headers')
+    checks = check_queryset()
+    if project_id:
+        patches = patches.filter(project_id=project_id)
+        checks = checks.filter(patch__project_id=project_id)
+
+    limit = settings.XMLRPC_MAX_PAGE_SIZE
+    if max_count > 0:
+        limit = min(max_count, limit)
+
+    (patches, checks) = changes_since(patches, checks, since, limit)
+
+    return {
+        'seq': max([obj.change_seq for obj in patches + checks] + [since]),
+        'patches': map(patch_to_dict, patches),
+        'checks': map(check_to_dict, checks),
+    }
+
+
 @xmlrpc_method()
 def patch_check_get(patch_id):
     """Get a patch's combined checks by its ID.
@@ -955,7 +1462,11 @@ def patch_check_get(patch_id):
         else an empty dict.
     """
     try:
-        patch = Patch.objects.filter(id=patch_id)[0]
+        # the checks' patch is set by the prefetch, so we only need to
+        # fetch their users
+        checks = Check.objects.select_related('user')
+        patch = Patch.objects.filter(id=patch_id).prefetch_related(
+            Prefetch('check_set', queryset=checks))[0]
         return patch_check_to_dict(patch)
     except Patch.DoesNotExist:
         return {}